@@ -0,0 +1,288 @@
+"""
+Admission control for the database-bound routes.
+
+Only as many requests as the connection pool can serve run at once, a few more wait
+briefly in a queue, and the rest are turned away right away with a 503 + Retry-After.
+Without this, a spike queues on the pool for up to pool_timeout seconds and every
+request on the worker slows down with it.
+
+Waiting requests are queued per API tier (as resolved by apikey_auth) and freed slots
+go to the tiers by weighted fair queuing: a tier with twice the weight gets twice the
+slots while both are waiting, so higher tiers keep their latency under overload.  When
+the queue is full, a request from a higher tier takes the place of the newest waiter
+from the lowest tier, so lower tiers are also shed first.
+
+The limit itself adapts to how healthy Postgres is (AIMDLimit): query latency is
+measured on the engine, the limit creeps up by one while it is stable and is cut by a
+factor when it rises, so a slow replica or a vacuum makes requests wait (or be shed)
+here rather than pile up on the database and time out.
+
+The controller lives on the event loop (the dependency is async), so it needs no
+locking.  Limits are per worker, like the connection pool.
+"""
+import os
+import math
+import time
+import asyncio
+import statistics
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import Depends, HTTPException, Request
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import event
+from .db import POOL_SIZE, MAX_OVERFLOW, engine
+from .auth import apikey_auth
+
+TIER_WEIGHTS = {"default": 1, "bronze": 2, "silver": 4, "unlimited": 8}
+
+QUEUE_DEPTH = Gauge(
+    "admission_queue_depth", "Requests waiting for a database slot.", ["tier"]
+)
+ACTIVE = Gauge("admission_active", "Requests holding a database slot.")
+LIMIT = Gauge("admission_limit", "Requests allowed to hold a database slot at once.")
+WAIT_TIME = Histogram(
+    "admission_wait_seconds",
+    "Time spent waiting for a database slot.",
+    ["tier"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REJECTED = Counter(
+    "admission_rejected_total",
+    "Requests turned away with a 503.",
+    ["tier", "reason"],
+)
+
+
+class AdmissionController:
+    """
+    Lets up to limit requests run at once, with up to max_queue more waiting at most
+    max_wait seconds for a slot, shared between tiers according to weights.
+    """
+
+    def __init__(
+        self, limit: int, max_queue: int, max_wait: float, weights=TIER_WEIGHTS
+    ):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.weights = weights
+        # requests without a known tier queue with the lowest one
+        self.default_tier = min(weights, key=weights.get)
+        self.active = 0
+        self._queues = {tier: deque() for tier in weights}
+        # weighted fair queuing: each tier's virtual time advances by 1/weight per slot
+        # it is given, the waiting tier furthest behind goes next
+        self._finish = {tier: 0.0 for tier in weights}
+        self._virtual_time = 0.0
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    @property
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.max_wait))
+
+    async def acquire(self, tier: Optional[str] = None):
+        """wait for a slot, raises a 503 HTTPException if none is available in time"""
+        if tier not in self.weights:
+            tier = self.default_tier
+        if self.active < self.limit and not self.queued:
+            self.active += 1
+            self._update_gauges()
+            WAIT_TIME.labels(tier).observe(0)
+            return
+        if self.queued >= self.max_queue:
+            self._shed_for(tier)
+
+        queue = self._queues[tier]
+        if not queue:
+            # an idle tier doesn't build up credit
+            self._finish[tier] = max(self._finish[tier], self._virtual_time)
+        waiter = asyncio.get_running_loop().create_future()
+        queue.append(waiter)
+        self._update_gauges()
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter, self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled() and not waiter.exception():
+                # a slot was handed over just as we gave up, pass it on
+                self.release()
+            elif waiter in queue:
+                queue.remove(waiter)
+            self._update_gauges()
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject(tier, "timeout")
+            raise
+        finally:
+            WAIT_TIME.labels(tier).observe(time.monotonic() - start)
+
+    def release(self):
+        """give up a slot, handing free slots straight to the next waiters"""
+        self.active -= 1
+        # the limit may have changed (see AIMDLimit), so this can admit several, or none
+        while self.active < self.limit:
+            tier = self._next_tier()
+            if tier is None:
+                break
+            waiter = self._queues[tier].popleft()
+            if waiter.done():
+                continue
+            self._virtual_time = self._finish[tier]
+            self._finish[tier] += 1 / self.weights[tier]
+            self.active += 1
+            waiter.set_result(None)
+        self._update_gauges()
+
+    def _next_tier(self) -> Optional[str]:
+        waiting = [tier for tier, queue in self._queues.items() if queue]
+        if not waiting:
+            return None
+        return min(waiting, key=lambda tier: (self._finish[tier], -self.weights[tier]))
+
+    def _shed_for(self, tier: str):
+        """make room in the queue for tier, by dropping a lower tier's newest waiter"""
+        # waiters that timed out or were cancelled may not have left their queue yet
+        for queue in self._queues.values():
+            for waiter in [waiter for waiter in queue if waiter.done()]:
+                queue.remove(waiter)
+        if self.queued < self.max_queue:
+            return
+        lower = [
+            other
+            for other, queue in self._queues.items()
+            if queue and self.weights[other] < self.weights[tier]
+        ]
+        if not lower:
+            self._reject(tier, "queue_full")
+        victim_tier = min(lower, key=lambda other: self.weights[other])
+        victim = self._queues[victim_tier].pop()
+        REJECTED.labels(victim_tier, "shed").inc()
+        victim.set_exception(self._busy())
+
+    def _reject(self, tier: str, reason: str):
+        REJECTED.labels(tier, reason).inc()
+        raise self._busy()
+
+    def _busy(self) -> HTTPException:
+        return HTTPException(
+            503,
+            detail="Server is busy, try again shortly.",
+            headers={"Retry-After": str(self.retry_after)},
+        )
+
+    def _update_gauges(self):
+        for tier, queue in self._queues.items():
+            QUEUE_DEPTH.labels(tier).set(len(queue))
+        ACTIVE.set(self.active)
+
+
+class AIMDLimit:
+    """
+    Adjusts controller.limit from query latency samples, between min_limit and the
+    controller's initial limit.
+
+    Every window samples, the median latency is compared to a baseline (the lowest
+    window median seen, drifting up slowly so a new normal is accepted): above
+    tolerance times the baseline the limit is multiplied by backoff, otherwise it
+    goes up by one.
+
+    Samples come from the threads running queries, the new limit is picked up by the
+    controller on the event loop the next time it admits a request.
+    """
+
+    def __init__(
+        self,
+        controller: AdmissionController,
+        *,
+        min_limit: int = 2,
+        window: int = 50,
+        tolerance: float = 2.0,
+        backoff: float = 0.75,
+        drift: float = 0.01,
+    ):
+        self.controller = controller
+        self.min_limit = min_limit
+        self.max_limit = controller.limit
+        self.window = window
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.drift = drift
+        self.baseline = None
+        self._samples = []
+        self._lock = threading.Lock()
+        LIMIT.set(controller.limit)
+
+    def sample(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+            if len(self._samples) < self.window:
+                return
+            latency = statistics.median(self._samples)
+            self._samples = []
+            self._adjust(latency)
+
+    def _adjust(self, latency: float):
+        if self.baseline is None:
+            self.baseline = latency
+        limit = self.controller.limit
+        if latency > self.baseline * self.tolerance:
+            limit = max(self.min_limit, math.floor(limit * self.backoff))
+        else:
+            limit = min(self.max_limit, limit + 1)
+        self.baseline = min(self.baseline * (1 + self.drift), latency)
+        self.controller.limit = limit
+        LIMIT.set(limit)
+
+
+controller = AdmissionController(
+    # one slot per connection the pool can hand out
+    limit=POOL_SIZE + MAX_OVERFLOW,
+    max_queue=int(os.environ.get("ADMISSION_MAX_QUEUE", 32)),
+    max_wait=float(os.environ.get("ADMISSION_MAX_WAIT", 2)),
+)
+adaptive_limit = AIMDLimit(controller)
+
+
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_started"] = time.perf_counter()
+
+
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop("query_started", None)
+    if started is not None:
+        adaptive_limit.sample(time.perf_counter() - started)
+
+
+def track_query_latency(engine):
+    """feed the latency of every query run on engine to adaptive_limit"""
+    event.listen(engine, "before_cursor_execute", _query_started)
+    event.listen(engine, "after_cursor_execute", _query_finished)
+
+
+track_query_latency(engine)
+
+
+@asynccontextmanager
+async def admitted(request: Request):
+    """
+    holds a slot for the block, for routes that only use the database for part of
+    the request (e.g. after waiting on another service)
+    """
+    await controller.acquire(getattr(request.state, "tier", None))
+    try:
+        yield
+    finally:
+        controller.release()
+
+
+async def admission(request: Request, auth: str = Depends(apikey_auth)):
+    """
+    dependency holding a slot for the rest of the request, including the response,
+    requests are authenticated first to know their tier
+    """
+    async with admitted(request):
+        yield
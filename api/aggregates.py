@@ -0,0 +1,85 @@
+"""
+Build an include as a correlated JSON subquery, so related rows come back as a column
+of the main query rather than needing one selectinload query per relationship path.
+
+The JSON is shaped by the Pydantic schema that will parse it: every schema field must
+either be a column or a relationship on the model, anything computed in Python (like a
+@property) can't be aggregated and raises ValueError when the include is built.
+
+schema_columns uses the same rules to select a whole response as labeled columns, for
+Pagination.core_rows.
+"""
+from pydantic import BaseModel
+from sqlalchemy import func, inspect, select, literal_column
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+
+
+def field_expression(model, name, field):
+    """
+    SQL expression for the schema field name of a row of model, or None if the model
+    doesn't have it (from_orm would use the schema default too)
+    """
+    mapper = inspect(model)
+    if name in mapper.relationships:
+        return json_relationship(mapper.relationships[name], field.type_)
+    elif name in mapper.column_attrs:
+        return mapper.column_attrs[name].expression
+    elif hasattr(model, name):
+        raise ValueError(
+            f"{model.__name__}.{name} is computed in Python and can't be aggregated"
+        )
+    return None
+
+
+def json_object(model, schema):
+    """json_build_object() of a row of model, with the fields of schema"""
+    args = []
+    for name, field in schema.__fields__.items():
+        value = field_expression(model, name, field)
+        if value is not None:
+            args += [literal_column(f"'{name}'"), value]
+    return func.json_build_object(*args)
+
+
+def schema_columns(model, schema, names, overrides):
+    """
+    labeled columns selecting the fields names of schema from model, so the response
+    can be built straight from the rows
+
+    overrides maps field names to SQL expressions for anything that isn't a column or
+    relationship of the model (like a column of a joined table)
+    """
+    columns = []
+    for name in names:
+        if name in overrides:
+            value = overrides[name]
+        else:
+            value = field_expression(model, name, schema.__fields__.get(name))
+        if value is not None:
+            columns.append(value.label(name))
+    return columns
+
+
+def json_relationship(relationship, schema):
+    """
+    correlated scalar subquery with the JSON for a relationship, a list for one-to-many
+    relationships and an object (or null) for many-to-one relationships
+    """
+    if not (isinstance(schema, type) and issubclass(schema, BaseModel)):
+        raise ValueError(f"{relationship} must map to a Pydantic model, not {schema}")
+    target = relationship.mapper.local_table
+    if target is relationship.parent.local_table:
+        raise ValueError(f"can't aggregate self-referential {relationship}")
+
+    value = json_object(relationship.mapper.class_, schema)
+    if relationship.uselist:
+        if relationship.order_by:
+            value = aggregate_order_by(value, *relationship.order_by)
+        value = func.coalesce(func.json_agg(value), literal_column("'[]'::json"))
+
+    return (
+        select(value)
+        .where(relationship.primaryjoin)
+        .correlate_except(target)
+        .scalar_subquery()
+    )
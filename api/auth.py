@@ -1,27 +1,116 @@
 from typing import Optional
-from fastapi import Header, HTTPException, Depends
+from fastapi import APIRouter, Header, HTTPException, Depends, Request
 from sqlalchemy.orm.exc import NoResultFound
 from rrl import RateLimiter, Tier, RateLimitExceeded
 from .db import SessionLocal, get_db, models
+from .cache import TTLCache
+from .ratelimit import HybridRateLimiter
+from .usage import UsageRecorder
+from .cost import request_cost
+from .invalidation import InvalidationListener
+from .tokens import InvalidToken, signer
 
-limiter = RateLimiter(
-    prefix="v3",
-    tiers=[
-        Tier("default", 10, 0, 250),
-        Tier("bronze", 40, 0, 1000),
-        Tier("silver", 80, 0, 50000),
-        Tier("unlimited", 360, 0, 1_000_000_000),
-    ],
-    use_redis_time=False,
-    track_daily_usage=True,
+router = APIRouter()
+
+# checked locally in each worker, counts are synced to Redis in the background
+limiter = HybridRateLimiter(
+    RateLimiter(
+        prefix="v3",
+        tiers=[
+            Tier("default", 10, 0, 250),
+            Tier("bronze", 40, 0, 1000),
+            Tier("silver", 80, 0, 50000),
+            Tier("unlimited", 360, 0, 1_000_000_000),
+        ],
+        use_redis_time=False,
+        track_daily_usage=True,
+    )
+)
+# per-endpoint daily usage, written to Redis in the background
+usage = UsageRecorder(limiter.redis, prefix="v3")
+
+# api_key -> api_tier, so most authenticated requests don't need the database
+apikey_cache = TTLCache(maxsize=10000, ttl=60)
+# keys recently found not to exist, kept separately so a flood of bad keys can't
+# push valid ones out of apikey_cache
+invalid_apikey_cache = TTLCache(maxsize=10000, ttl=300)
+# client IP -> failed attempts, an IP is throttled until it stops failing for the TTL
+failed_auth_cache = TTLCache(maxsize=10000, ttl=60)
+MAX_FAILED_AUTH = 20
+_missing = object()
+
+INVALID_KEY_DETAIL = (
+    "Invalid API Key. "
+    "Login and visit https://openstates.org/account/profile/ for your API key."
 )
 
 
+def invalidate_apikey(apikey: Optional[str] = None):
+    """
+    forget what's cached about a key, e.g. after its tier changes, it is revoked or it
+    is created (or all keys if apikey is None), otherwise changes take up to the TTL
+    to apply
+
+    this only clears this worker's caches, apikey_invalidations calls it in every
+    worker for keys published on APIKEY_INVALIDATION_CHANNEL
+    """
+    if apikey is None:
+        apikey_cache.clear()
+        invalid_apikey_cache.clear()
+    else:
+        apikey_cache.pop(apikey)
+        invalid_apikey_cache.pop(apikey)
+
+
+APIKEY_INVALIDATION_CHANNEL = "v3:apikey-invalidations"
+# started by each worker, see api/invalidation.py
+apikey_invalidations = InvalidationListener(
+    limiter.redis, APIKEY_INVALIDATION_CHANNEL, invalidate_apikey
+)
+
+
+def _client_ip(request: Optional[Request]) -> Optional[str]:
+    if request is None or request.client is None:
+        return None
+    return request.client.host
+
+
+def _invalid_apikey(ip: Optional[str]):
+    if ip is not None:
+        failed_auth_cache.set(ip, failed_auth_cache.get(ip, 0) + 1)
+    raise HTTPException(401, detail=INVALID_KEY_DETAIL)
+
+
+def _bearer_token(authorization: Optional[str]) -> Optional[str]:
+    if authorization:
+        scheme, _, token = authorization.partition(" ")
+        if scheme.lower() == "bearer" and token.strip():
+            return token.strip()
+    return None
+
+
 def apikey_auth(
+    request: Request,
     apikey: Optional[str] = None,
     x_api_key: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None),
     db: SessionLocal = Depends(get_db),
 ):
+    token = _bearer_token(authorization)
+    if token:
+        # access tokens are checked by their signature alone
+        try:
+            claims = signer.verify(token)
+        except InvalidToken:
+            raise HTTPException(
+                401,
+                detail="Invalid or expired access token.",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        # the same limits & usage as the key the token was issued for
+        _charge(request, claims.apikey, claims.tier)
+        return
+
     provided_apikey = x_api_key or apikey
     if not provided_apikey:
         raise HTTPException(
@@ -30,25 +119,105 @@ def apikey_auth(
             "Login and visit https://openstates.org/account/profile/ for your API key.",
         )
 
-    try:
-        key = (
-            db.query(models.Profile)
-            .filter(models.Profile.api_key == provided_apikey)
-            .one()
-        )
-        try:
-            limiter.check_limit(provided_apikey, key.api_tier)
-        except RateLimitExceeded as e:
-            raise HTTPException(429, detail=str(e))
-        except ValueError:
+    api_tier = apikey_cache.get(provided_apikey, _missing)
+    if api_tier is _missing:
+        # bad keys are turned away before they can use a database connection
+        ip = _client_ip(request)
+        if provided_apikey in invalid_apikey_cache:
+            _invalid_apikey(ip)
+        if ip is not None and failed_auth_cache.get(ip, 0) >= MAX_FAILED_AUTH:
             raise HTTPException(
-                401,
-                detail="Inactive API Key. "
-                "Login and visit https://openstates.org/account/profile/ for details.",
+                429,
+                detail="Too many requests with invalid API keys, try again later.",
+                headers={"Retry-After": str(int(failed_auth_cache.ttl))},
             )
-    except NoResultFound:
+        try:
+            api_tier = (
+                db.query(models.Profile.api_tier)
+                .filter(models.Profile.api_key == provided_apikey)
+                .one()
+                .api_tier
+            )
+        except NoResultFound:
+            invalid_apikey_cache.set(provided_apikey, True)
+            _invalid_apikey(ip)
+        finally:
+            # the session would hold on to its connection while the request waits
+            # for admission, the route checks one out again once it is admitted
+            db.rollback()
+        apikey_cache.set(provided_apikey, api_tier)
+
+    _charge(request, provided_apikey, api_tier)
+
+
+def _charge(request: Request, key: str, api_tier: str):
+    """count the request against key's limits & usage"""
+    # heavier requests use up more of the key's limits
+    cost = request.state.cost = request_cost(request)
+    try:
+        limiter.check_limit(key, api_tier, cost)
+    except RateLimitExceeded as e:
+        raise HTTPException(429, detail=str(e))
+    except ValueError:
         raise HTTPException(
             401,
-            detail="Invalid API Key. "
-            "Login and visit https://openstates.org/account/profile/ for your API key.",
+            detail="Inactive API Key. "
+            "Login and visit https://openstates.org/account/profile/ for details.",
+        )
+    usage.record(key, request.scope["endpoint"].__name__)
+    # for admission control's queueing, and charge_extra
+    request.state.tier = api_tier
+    request.state.ratelimit_key = key
+
+
+def charge_extra(request: Request, units: int):
+    """
+    charge units more to the request's key, for routes whose cost depends on the
+    request body rather than its parameters
+    """
+    key = getattr(request.state, "ratelimit_key", None)
+    if key is None or units <= 0:
+        return
+    request.state.cost += units
+    try:
+        limiter.check_limit(key, request.state.tier, units)
+    except RateLimitExceeded as e:
+        raise HTTPException(429, detail=str(e))
+
+
+@router.post("/tokens")
+def create_token(
+    request: Request,
+    apikey: Optional[str] = None,
+    x_api_key: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None),
+    db: SessionLocal = Depends(get_db),
+    auth: str = Depends(apikey_auth),
+):
+    """
+    Trade an API key for a short-lived access token, to send as
+    `Authorization: Bearer <token>` instead of the key.
+    """
+    if not signer.enabled:
+        raise HTTPException(404, detail="Access tokens are not enabled.")
+    if _bearer_token(authorization):
+        # otherwise a token could be renewed forever, however the key changes
+        raise HTTPException(
+            403, detail="Access tokens must be created with an API key."
+        )
+    try:
+        profile = (
+            db.query(models.Profile.id, models.Profile.api_tier)
+            .filter(models.Profile.api_key == (x_api_key or apikey))
+            .one()
         )
+    except NoResultFound:
+        # removed since its tier was cached
+        raise HTTPException(401, detail=INVALID_KEY_DETAIL)
+    return {
+        "access_token": signer.mint(
+            profile.id, profile.api_tier, apikey=x_api_key or apikey
+        ),
+        "token_type": "bearer",
+        "expires_in": signer.ttl,
+    }
@@ -0,0 +1,65 @@
+import time
+import logging
+import threading
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundFlusher:
+    """
+    Base for per-worker buffers that a daemon thread flushes every interval seconds.
+
+    Subclasses implement flush().  The thread is started on first use, so it belongs
+    to the worker process rather than a parent that forked it, and close() flushes
+    whatever is left.  interval=None disables the thread, flush() must be called.
+    """
+
+    thread_name = "flusher"
+
+    def __init__(self, interval: Optional[float]):
+        self.interval = interval
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+
+    def flush(self):
+        raise NotImplementedError()
+
+    def wake(self):
+        """flush now rather than at the next interval"""
+        self._wake.set()
+
+    def close(self):
+        """stop the background thread and flush what's left"""
+        if self._thread is not None:
+            self._stop.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+            self._stop.clear()
+        self.flush()
+
+    def _ensure_started(self):
+        if self.interval is None or self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name=self.thread_name, daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            try:
+                self.flush()
+            except Exception:
+                logger.exception(f"{self.thread_name} failed")
+                # back off a little while the backend is unavailable
+                time.sleep(self.interval)
@@ -1,15 +1,21 @@
 import re
 import datetime
+import orjson
 from typing import Optional, List
 from enum import Enum
-from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi import APIRouter, Depends, Query, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy import func, desc, nullslast
 from sqlalchemy.orm import contains_eager
 from openstates.utils.transformers import fix_bill_id
 from .db import SessionLocal, get_db, models
-from .schemas import Bill
-from .pagination import Pagination
+from .db.models.bills import bill_openstates_url
+from .schemas import Bill, CompactJurisdiction
+from .pagination import Pagination, IncludeStrategy
+from .aggregates import json_object
 from .auth import apikey_auth
+from .cost import costed
+from .conditional import Conditional, jurisdiction_watermark, watermark
 from .utils import jurisdiction_filter
 
 
@@ -51,6 +57,30 @@ class BillPagination(Pagination):
         ],
         BillInclude.actions: ["actions", "actions.related_entities"],
     }
+    # nested includes are faster as one JSON subquery than a selectin query per path
+    include_strategies = {
+        BillInclude.sponsorships: IncludeStrategy.aggregate,
+        BillInclude.versions: IncludeStrategy.aggregate,
+        BillInclude.documents: IncludeStrategy.aggregate,
+        BillInclude.votes: IncludeStrategy.aggregate,
+        BillInclude.actions: IncludeStrategy.aggregate,
+    }
+    # computed fields & the columns they need, relationships are always joined
+    field_columns = {
+        "openstates_url": ["identifier", "session", "jurisdiction"],
+        "session": [],
+        "jurisdiction": [],
+        "from_organization": [],
+    }
+    # the legislative session & jurisdiction are already joined by base_query
+    core_rows = True
+    core_fields = {
+        "session": models.LegislativeSession.identifier,
+        "jurisdiction": json_object(models.Jurisdiction, CompactJurisdiction),
+        "openstates_url": lambda row: bill_openstates_url(
+            row["jurisdiction"]["id"], row["session"], row["identifier"]
+        ),
+    }
     max_per_page = 20
 
 
@@ -58,6 +88,7 @@ router = APIRouter()
 
 
 _likely_bill_id = re.compile(r"\w{1,3}\s*\d{1,5}")
+NDJSON_BATCH_SIZE = 500
 
 
 def base_query(db):
@@ -75,56 +106,196 @@ def base_query(db):
     )
 
 
+class BillFilters:
+    """the filters shared by /bills and /bills.ndjson, as a dependency"""
+
+    def __init__(
+        self,
+        jurisdiction: Optional[str] = Query(
+            None, description="Filter by jurisdiction name or ID."
+        ),
+        session: Optional[str] = Query(
+            None, description="Filter by session identifier."
+        ),
+        chamber: Optional[str] = Query(
+            None, description="Filter by chamber of origination."
+        ),
+        identifier: Optional[List[str]] = Query(
+            [],
+            description="Filter to only include bills with this identifier.",
+        ),
+        classification: Optional[str] = Query(
+            None, description="Filter by classification, e.g. bill or resolution"
+        ),
+        subject: Optional[List[str]] = Query(
+            [], description="Filter by one or more subjects."
+        ),
+        updated_since: Optional[str] = Query(
+            None,
+            description="Filter to only include bills with updates since a given date.",
+        ),
+        created_since: Optional[str] = Query(
+            None,
+            description="Filter to only include bills created since a given date.",
+        ),
+        action_since: Optional[str] = Query(
+            None,
+            description="Filter to only include bills with an action since a given date.",
+        ),
+        sort: Optional[BillSortOption] = Query(
+            BillSortOption.updated_desc,
+            description="Desired sort order for bill results.",
+        ),
+        sponsor: Optional[str] = Query(
+            None,
+            description="Filter to only include bills sponsored by a given name or person ID.",
+        ),
+        sponsor_classification: Optional[str] = Query(
+            None,
+            description="Filter matched sponsors to only include particular types of sponsorships.",
+        ),
+        q: Optional[str] = Query(None, description="Filter by full text search term."),
+    ):
+        self.jurisdiction = jurisdiction
+        self.session = session
+        self.chamber = chamber
+        self.identifier = identifier
+        self.classification = classification
+        self.subject = subject
+        self.updated_since = updated_since
+        self.created_since = created_since
+        self.action_since = action_since
+        self.sort = sort
+        self.sponsor = sponsor
+        self.sponsor_classification = sponsor_classification
+        self.q = q
+
+    def query(self, db):
+        """the sorted & filtered bill query, raises HTTPException for invalid filters"""
+        query = base_query(db)
+
+        if self.sort == BillSortOption.updated_asc:
+            query = query.order_by(models.Bill.updated_at)
+        elif self.sort == BillSortOption.updated_desc:
+            query = query.order_by(desc(models.Bill.updated_at))
+        elif self.sort == BillSortOption.first_action_asc:
+            query = query.order_by(nullslast(models.Bill.first_action_date))
+        elif self.sort == BillSortOption.first_action_desc:
+            query = query.order_by(nullslast(desc(models.Bill.first_action_date)))
+        elif self.sort == BillSortOption.latest_action_asc:
+            query = query.order_by(nullslast(models.Bill.latest_action_date))
+        elif self.sort == BillSortOption.latest_action_desc:
+            query = query.order_by(nullslast(desc(models.Bill.latest_action_date)))
+        else:
+            raise HTTPException(500, "Unknown sort option, this shouldn't happen!")
+
+        if self.jurisdiction:
+            query = query.filter(
+                jurisdiction_filter(
+                    self.jurisdiction,
+                    jid_field=models.LegislativeSession.jurisdiction_id,
+                )
+            )
+        if self.session:
+            if not self.jurisdiction:
+                raise HTTPException(
+                    400,
+                    "filtering by session requires a jurisdiction parameter as well",
+                )
+            query = query.filter(models.LegislativeSession.identifier == self.session)
+        if self.chamber:
+            query = query.filter(models.Organization.classification == self.chamber)
+        if self.identifier:
+            if len(self.identifier) > 20:
+                raise HTTPException(
+                    400,
+                    "can only provide up to 20 identifiers in one request",
+                )
+            identifiers = [fix_bill_id(bill_id).upper() for bill_id in self.identifier]
+            query = query.filter(models.Bill.identifier.in_(identifiers))
+        if self.classification:
+            query = query.filter(models.Bill.classification.any(self.classification))
+        if self.subject:
+            query = query.filter(models.Bill.subject.contains(self.subject))
+        if self.sponsor:
+            # need to join this way, or sqlalchemy will try to join via from_organization
+            query = query.join(models.Bill.sponsorships)
+            if self.sponsor.startswith("ocd-person/"):
+                query = query.filter(models.BillSponsorship.person_id == self.sponsor)
+            else:
+                query = query.filter(models.BillSponsorship.name == self.sponsor)
+        if self.sponsor_classification:
+            if not self.sponsor:
+                raise HTTPException(
+                    400,
+                    "filtering by sponsor_classification requires sponsor parameter as well",
+                )
+            query = query.filter(
+                models.BillSponsorship.classification == self.sponsor_classification
+            )
+        try:
+            if self.updated_since:
+                query = query.filter(
+                    models.Bill.updated_at
+                    >= datetime.datetime.fromisoformat(self.updated_since)
+                )
+            if self.created_since:
+                query = query.filter(
+                    models.Bill.created_at
+                    >= datetime.datetime.fromisoformat(self.created_since)
+                )
+        except ValueError:
+            raise HTTPException(
+                400,
+                "datetime must be in ISO-8601 format, try YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS",
+            )
+
+        if self.action_since:
+            query = query.filter(models.Bill.latest_action_date >= self.action_since)
+        if self.q:
+            if _likely_bill_id.match(self.q):
+                query = query.filter(
+                    func.upper(models.Bill.identifier) == fix_bill_id(self.q).upper()
+                )
+            else:
+                query = query.join(models.SearchableBill).filter(
+                    models.SearchableBill.search_vector.op("@@")(
+                        func.websearch_to_tsquery("english", self.q)
+                    )
+                )
+
+        if not self.q and not self.jurisdiction:
+            raise HTTPException(400, "either 'jurisdiction' or 'q' required")
+
+        return query
+
+    def conditional(self, request: Request, db) -> Conditional:
+        """conditional GET validators, bills change with their jurisdiction's watermark"""
+        return Conditional(
+            request,
+            jurisdiction_watermark(
+                db, models.Jurisdiction.latest_bill_update, self.jurisdiction
+            ),
+        )
+
+
 @router.get(
     "/bills",
     response_model=BillPagination.response_model(),
     response_model_exclude_none=True,
     tags=["bills"],
 )
-async def bills_search(
-    jurisdiction: Optional[str] = Query(
-        None, description="Filter by jurisdiction name or ID."
-    ),
-    session: Optional[str] = Query(None, description="Filter by session identifier."),
-    chamber: Optional[str] = Query(
-        None, description="Filter by chamber of origination."
-    ),
-    identifier: Optional[List[str]] = Query(
-        [],
-        description="Filter to only include bills with this identifier.",
-    ),
-    classification: Optional[str] = Query(
-        None, description="Filter by classification, e.g. bill or resolution"
-    ),
-    subject: Optional[List[str]] = Query(
-        [], description="Filter by one or more subjects."
-    ),
-    updated_since: Optional[str] = Query(
-        None,
-        description="Filter to only include bills with updates since a given date.",
-    ),
-    created_since: Optional[str] = Query(
-        None, description="Filter to only include bills created since a given date."
-    ),
-    action_since: Optional[str] = Query(
-        None,
-        description="Filter to only include bills with an action since a given date.",
-    ),
-    sort: Optional[BillSortOption] = Query(
-        BillSortOption.updated_desc, description="Desired sort order for bill results."
-    ),
-    sponsor: Optional[str] = Query(
-        None,
-        description="Filter to only include bills sponsored by a given name or person ID.",
-    ),
-    sponsor_classification: Optional[str] = Query(
-        None,
-        description="Filter matched sponsors to only include particular types of sponsorships.",
-    ),
-    q: Optional[str] = Query(None, description="Filter by full text search term."),
+@costed(BillPagination)
+def bills_search(
+    request: Request,
+    filters: BillFilters = Depends(),
     include: List[BillInclude] = Query(
         [], description="Additional information to include in response."
     ),
+    fields: List[str] = Query(
+        [],
+        description="Only return these fields (comma separated), includes are unaffected.",
+    ),
     db: SessionLocal = Depends(get_db),
     pagination: BillPagination = Depends(),
     auth: str = Depends(apikey_auth),
@@ -135,102 +306,58 @@ async def bills_search(
     Must either specify a jurisdiction or a full text query (q).  Additional parameters will
     futher restrict bills returned.
     """
-    query = base_query(db)
-
-    if sort == BillSortOption.updated_asc:
-        query = query.order_by(models.Bill.updated_at)
-    elif sort == BillSortOption.updated_desc:
-        query = query.order_by(desc(models.Bill.updated_at))
-    elif sort == BillSortOption.first_action_asc:
-        query = query.order_by(nullslast(models.Bill.first_action_date))
-    elif sort == BillSortOption.first_action_desc:
-        query = query.order_by(nullslast(desc(models.Bill.first_action_date)))
-    elif sort == BillSortOption.latest_action_asc:
-        query = query.order_by(nullslast(models.Bill.latest_action_date))
-    elif sort == BillSortOption.latest_action_desc:
-        query = query.order_by(nullslast(desc(models.Bill.latest_action_date)))
-    else:
-        raise HTTPException(500, "Unknown sort option, this shouldn't happen!")
-
-    if jurisdiction:
-        query = query.filter(
-            jurisdiction_filter(
-                jurisdiction, jid_field=models.LegislativeSession.jurisdiction_id
-            )
-        )
-    if session:
-        if not jurisdiction:
-            raise HTTPException(
-                400, "filtering by session requires a jurisdiction parameter as well"
-            )
-        query = query.filter(models.LegislativeSession.identifier == session)
-    if chamber:
-        query = query.filter(models.Organization.classification == chamber)
-    if identifier:
-        if len(identifier) > 20:
-            raise HTTPException(
-                400,
-                "can only provide up to 20 identifiers in one request",
-            )
-        identifiers = [fix_bill_id(bill_id).upper() for bill_id in identifier]
-        query = query.filter(models.Bill.identifier.in_(identifiers))
-    if classification:
-        query = query.filter(models.Bill.classification.any(classification))
-    if subject:
-        query = query.filter(models.Bill.subject.contains(subject))
-    if sponsor:
-        # need to join this way, or sqlalchemy will try to join via from_organization
-        query = query.join(models.Bill.sponsorships)
-        if sponsor.startswith("ocd-person/"):
-            query = query.filter(models.BillSponsorship.person_id == sponsor)
-        else:
-            query = query.filter(models.BillSponsorship.name == sponsor)
-    if sponsor_classification:
-        if not sponsor:
-            raise HTTPException(
-                400,
-                "filtering by sponsor_classification requires sponsor parameter as well",
-            )
-        query = query.filter(
-            models.BillSponsorship.classification == sponsor_classification
-        )
-    try:
-        if updated_since:
-            query = query.filter(
-                models.Bill.updated_at >= datetime.datetime.fromisoformat(updated_since)
-            )
-        if created_since:
-            query = query.filter(
-                models.Bill.created_at >= datetime.datetime.fromisoformat(created_since)
-            )
-    except ValueError:
-        raise HTTPException(
-            400,
-            "datetime must be in ISO-8601 format, try YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS",
-        )
+    query = filters.query(db)
+    conditional = filters.conditional(request, db)
+    if conditional.not_modified:
+        return conditional.not_modified_response()
+    return conditional.apply(
+        pagination.paginate(query, includes=include, fields=fields)
+    )
 
-    if action_since:
-        query = query.filter(models.Bill.latest_action_date >= action_since)
-    if q:
-        if _likely_bill_id.match(q):
-            query = query.filter(
-                func.upper(models.Bill.identifier) == fix_bill_id(q).upper()
-            )
-        else:
-            query = query.join(models.SearchableBill).filter(
-                models.SearchableBill.search_vector.op("@@")(
-                    func.websearch_to_tsquery("english", q)
-                )
-            )
 
-    if not q and not jurisdiction:
-        raise HTTPException(400, "either 'jurisdiction' or 'q' required")
+@router.get(
+    "/bills.ndjson",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}}}},
+    tags=["bills"],
+)
+@costed(BillPagination, rows=NDJSON_BATCH_SIZE)
+def bills_ndjson(
+    request: Request,
+    filters: BillFilters = Depends(),
+    include: List[BillInclude] = Query(
+        [], description="Additional information to include in response."
+    ),
+    fields: List[str] = Query(
+        [],
+        description="Only return these fields (comma separated), includes are unaffected.",
+    ),
+    db: SessionLocal = Depends(get_db),
+    auth: str = Depends(apikey_auth),
+):
+    """
+    Stream all bills matching given criteria as newline-delimited JSON, one bill per line.
 
-    # handle includes
+    Takes the same parameters as /bills, without pagination.  Useful for getting every bill
+    in a session in a single request.
+    """
+    fields = BillPagination.parse_fields(fields)
+    query = filters.query(db)
+    conditional = filters.conditional(request, db)
+    if conditional.not_modified:
+        return conditional.not_modified_response()
+    query, plan = BillPagination.prepare_query(query, include, fields)
+    # a server-side cursor, so only NDJSON_BATCH_SIZE rows are in memory at a time
+    rows = query.yield_per(NDJSON_BATCH_SIZE)
 
-    resp = pagination.paginate(query, includes=include)
+    def lines():
+        for row in rows:
+            obj = BillPagination.to_obj(row, include, fields, plan)
+            yield orjson.dumps(obj) + b"\n"
 
-    return resp
+    return conditional.apply(
+        StreamingResponse(lines(), media_type="application/x-ndjson")
+    )
 
 
 @router.get(
@@ -240,15 +367,40 @@ async def bills_search(
     response_model_exclude_none=True,
     tags=["bills"],
 )
-async def bill_detail_by_id(
+@costed(BillPagination, rows=1)
+def bill_detail_by_id(
+    request: Request,
     openstates_bill_id: str,
     include: List[BillInclude] = Query([]),
+    fields: List[str] = Query(
+        [],
+        description="Only return these fields (comma separated), includes are unaffected.",
+    ),
     db: SessionLocal = Depends(get_db),
     auth: str = Depends(apikey_auth),
 ):
     """Obtain bill information by internal ID in the format ocd-bill/*uuid*."""
-    query = base_query(db).filter(models.Bill.id == "ocd-bill/" + openstates_bill_id)
-    return BillPagination.detail(query, includes=include)
+    bill_id = "ocd-bill/" + openstates_bill_id
+    jurisdiction_id = (
+        db.query(models.LegislativeSession.jurisdiction_id)
+        .join(models.Bill.legislative_session)
+        .filter(models.Bill.id == bill_id)
+        .scalar_subquery()
+    )
+    conditional = Conditional(
+        request,
+        watermark(
+            db,
+            models.Jurisdiction.latest_bill_update,
+            models.Jurisdiction.id == jurisdiction_id,
+        ),
+    )
+    if conditional.not_modified:
+        return conditional.not_modified_response()
+    query = base_query(db).filter(models.Bill.id == bill_id)
+    return conditional.apply(
+        BillPagination.detail(query, includes=include, fields=fields)
+    )
 
 
 @router.get(
@@ -258,15 +410,29 @@ async def bill_detail_by_id(
     response_model_exclude_none=True,
     tags=["bills"],
 )
-async def bill_detail(
+@costed(BillPagination, rows=1)
+def bill_detail(
+    request: Request,
     jurisdiction: str,
     session: str,
     bill_id: str,
     include: List[BillInclude] = Query([]),
+    fields: List[str] = Query(
+        [],
+        description="Only return these fields (comma separated), includes are unaffected.",
+    ),
     db: SessionLocal = Depends(get_db),
     auth: str = Depends(apikey_auth),
 ):
     """Obtain bill information based on (state, session, bill_id)."""
+    conditional = Conditional(
+        request,
+        jurisdiction_watermark(
+            db, models.Jurisdiction.latest_bill_update, jurisdiction
+        ),
+    )
+    if conditional.not_modified:
+        return conditional.not_modified_response()
     query = base_query(db).filter(
         models.Bill.identifier == fix_bill_id(bill_id).upper(),
         models.LegislativeSession.identifier == session,
@@ -274,4 +440,6 @@ async def bill_detail(
             jurisdiction, jid_field=models.LegislativeSession.jurisdiction_id
         ),
     )
-    return BillPagination.detail(query, includes=include)
+    return conditional.apply(
+        BillPagination.detail(query, includes=include, fields=fields)
+    )
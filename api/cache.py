@@ -0,0 +1,55 @@
+import time
+import threading
+from collections import OrderedDict
+
+_missing = object()
+
+
+class TTLCache:
+    """
+    Small thread-safe LRU cache where entries also expire ttl seconds after being set.
+
+    Caches are per-worker, so anything stored here must be safe to be briefly stale.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            value, expires = self._data.get(key, (_missing, 0))
+            if value is _missing:
+                return default
+            if expires <= self.timer():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, self.timer() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            value, expires = self._data.pop(key, (_missing, 0))
+            if value is _missing or expires <= self.timer():
+                return default
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def __len__(self):
+        return len(self._data)
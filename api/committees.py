@@ -1,10 +1,12 @@
 from enum import Enum
 from typing import List, Optional
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, Query, Request
 from .db import SessionLocal, get_db, models
 from .schemas import Committee, OrgClassification, CommitteeClassification
-from .pagination import Pagination
+from .pagination import Pagination, CountOption, IncludeStrategy
 from .auth import apikey_auth
+from .cost import costed
+from .conditional import Conditional, jurisdiction_watermark, watermark
 from .utils import jurisdiction_filter
 
 
@@ -25,11 +27,18 @@ class CommitteePagination(Pagination):
         CommitteeInclude.links: [],
         CommitteeInclude.sources: [],
     }
+    include_strategies = {CommitteeInclude.memberships: IncludeStrategy.aggregate}
     max_per_page = 20
 
-    def __init__(self, page: int = 1, per_page: int = 20):
-        self.page = page
-        self.per_page = per_page
+    def __init__(
+        self,
+        page: int = 1,
+        per_page: int = 20,
+        cursor: Optional[str] = None,
+        count: Optional[CountOption] = None,
+        request: Request = None,
+    ):
+        super().__init__(page, per_page, cursor, count, request)
 
 
 @router.get(
@@ -38,7 +47,9 @@ class CommitteePagination(Pagination):
     response_model_exclude_none=True,
     tags=["committees"],
 )
-async def committee_list(
+@costed(CommitteePagination)
+def committee_list(
+    request: Request,
     jurisdiction: str = Query(None, description="Filter by jurisdiction name or ID."),
     classification: Optional[CommitteeClassification] = None,
     parent: Optional[str] = Query(
@@ -83,7 +94,16 @@ async def committee_list(
         )
         query = query.filter(models.Organization.parent_id == subquery)
 
-    return pagination.paginate(query, includes=include)
+    # committees are updated along with people
+    conditional = Conditional(
+        request,
+        jurisdiction_watermark(
+            db, models.Jurisdiction.latest_people_update, jurisdiction
+        ),
+    )
+    if conditional.not_modified:
+        return conditional.not_modified_response()
+    return conditional.apply(pagination.paginate(query, includes=include))
 
 
 @router.get(
@@ -93,7 +113,9 @@ async def committee_list(
     response_model_exclude_none=True,
     tags=["committees"],
 )
-async def committee_detail(
+@costed(CommitteePagination, rows=1)
+def committee_detail(
+    request: Request,
     committee_id: str,
     include: List[CommitteeInclude] = Query(
         [], description="Additional includes for the Committee response."
@@ -102,8 +124,23 @@ async def committee_detail(
     auth: str = Depends(apikey_auth),
 ):
     """Get details on a single committee by ID."""
+    jurisdiction_id = (
+        db.query(models.Organization.jurisdiction_id)
+        .filter(models.Organization.id == committee_id)
+        .scalar_subquery()
+    )
+    conditional = Conditional(
+        request,
+        watermark(
+            db,
+            models.Jurisdiction.latest_people_update,
+            models.Jurisdiction.id == jurisdiction_id,
+        ),
+    )
+    if conditional.not_modified:
+        return conditional.not_modified_response()
     query = db.query(models.Organization).filter(
         models.Organization.id == committee_id,
         models.Organization.classification.in_(("committee", "subcommittee")),
     )
-    return CommitteePagination.detail(query, includes=include)
+    return conditional.apply(CommitteePagination.detail(query, includes=include))
@@ -0,0 +1,104 @@
+"""
+Conditional GET support driven by jurisdiction update watermarks.
+
+Jurisdiction.latest_bill_update and latest_people_update record when a jurisdiction's
+data last changed.  A cheap max() over the relevant jurisdictions gives a watermark for
+a request: responses carry an ETag and Last-Modified derived from it, and clients that
+already have the current version (If-None-Match / If-Modified-Since) get a 304 without
+the main query running.
+"""
+import datetime
+import hashlib
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+from fastapi import Request, Response
+from sqlalchemy import func
+from .db import models
+from .utils import jurisdiction_filter
+
+# query parameters that don't change the response
+_IGNORED_PARAMS = {"apikey"}
+
+
+def watermark(db, column, *criteria) -> Optional[datetime.datetime]:
+    """latest value of column (an expression over Jurisdiction) among matching rows"""
+    return db.query(func.max(column)).filter(*criteria).scalar()
+
+
+def jurisdiction_watermark(
+    db, column, jurisdiction: Optional[str]
+) -> Optional[datetime.datetime]:
+    """watermark for a jurisdiction name/abbr/ID as accepted by the API, or all of them"""
+    if not jurisdiction:
+        return watermark(db, column)
+    return watermark(
+        db, column, jurisdiction_filter(jurisdiction, jid_field=models.Jurisdiction.id)
+    )
+
+
+class Conditional:
+    """
+    The validators for a response whose data last changed at modified.
+
+    If modified is None (e.g. nothing matched) no headers are set and the request is
+    never considered not modified.
+    """
+
+    def __init__(self, request: Request, modified: Optional[datetime.datetime]):
+        self.headers = {}
+        self.not_modified = False
+        if modified is None:
+            return
+
+        # naive timestamps in the database are UTC, HTTP dates have 1s resolution
+        if modified.tzinfo is None:
+            modified = modified.replace(tzinfo=datetime.timezone.utc)
+        modified = modified.replace(microsecond=0)
+
+        params = sorted(
+            (key, value)
+            for key, value in request.query_params.multi_items()
+            if key not in _IGNORED_PARAMS
+        )
+        digest = hashlib.sha1(
+            repr((request.url.path, params, modified.isoformat())).encode()
+        ).hexdigest()
+        etag = f'W/"{digest[:24]}"'
+        self.headers = {
+            "ETag": etag,
+            "Last-Modified": format_datetime(modified, usegmt=True),
+        }
+        self.not_modified = _not_modified(request, etag, modified)
+
+    def not_modified_response(self) -> Response:
+        return Response(status_code=304, headers=self.headers)
+
+    def apply(self, response: Response) -> Response:
+        """add the validators to response"""
+        response.headers.update(self.headers)
+        return response
+
+
+def _not_modified(request: Request, etag: str, modified: datetime.datetime) -> bool:
+    # If-None-Match takes precedence over If-Modified-Since (RFC 7232 section 6)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        # weak comparison, the W/ prefix is ignored
+        return "*" in tags or _opaque(etag) in {_opaque(tag) for tag in tags}
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=datetime.timezone.utc)
+        return modified <= since
+
+    return False
+
+
+def _opaque(tag: str) -> str:
+    return tag[2:] if tag.startswith("W/") else tag
@@ -0,0 +1,79 @@
+"""
+Request costs for rate limiting.
+
+A plain /jurisdictions request and /bills with a page of 20 bills and their votes,
+actions & versions cost the database very different amounts, so requests are charged
+to the limiter in units estimated from the route, includes and per_page (see
+Pagination.cost).  Routes register their cost model with @costed, apikey_auth charges
+the cost and leaves it on request.state, and RequestCostMiddleware reports it in the
+X-Request-Cost header.
+"""
+import inspect
+from typing import Optional
+from fastapi import Request
+
+_endpoint_costs = {}
+
+
+def costed(pagination, *, rows: Optional[int] = None):
+    """
+    decorator registering a route's cost: results are from pagination (a Pagination
+    subclass), rows is how many, or None to use the per_page parameter
+    """
+
+    def decorator(endpoint):
+        _endpoint_costs[endpoint] = (pagination, rows)
+        return endpoint
+
+    return decorator
+
+
+def request_cost(request: Request) -> int:
+    """rate limiting units for request, 1 for routes that didn't register a cost"""
+    try:
+        pagination, rows = _endpoint_costs[request.scope.get("endpoint")]
+    except KeyError:
+        return 1
+
+    includes = set()
+    for value in request.query_params.getlist("include"):
+        try:
+            includes.add(pagination.IncludeEnum(value))
+        except ValueError:
+            # the request will fail validation
+            pass
+    if rows is None:
+        rows = _per_page(pagination, request.query_params.get("per_page"))
+    return pagination.cost(includes, rows)
+
+
+def _per_page(pagination, value) -> int:
+    default = inspect.signature(pagination).parameters["per_page"].default
+    try:
+        per_page = int(value) if value is not None else default
+    except ValueError:
+        per_page = default
+    return min(max(per_page, 1), pagination.max_per_page)
+
+
+class RequestCostMiddleware:
+    """adds X-Request-Cost to responses of requests that were charged a cost"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        # shared with request.state
+        state = scope.setdefault("state", {})
+
+        async def send_with_cost(message):
+            if message["type"] == "http.response.start" and "cost" in state:
+                headers = list(message.get("headers", []))
+                headers.append((b"x-request-cost", str(state["cost"]).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        await self.app(scope, receive, send_with_cost)
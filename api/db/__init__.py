@@ -27,10 +27,12 @@ pool_recycle=28800 - this setting causes the pool to recycle connections after t
     automatically if no activity is detected on a connection for eight hours
     (although this is configurable with the MySQLDB connection itself and the server configuration as well).
 """
+POOL_SIZE = 10
+MAX_OVERFLOW = 7
 engine = create_engine(
     DATABASE_URL,
-    pool_size=10,
-    max_overflow=7,
+    pool_size=POOL_SIZE,
+    max_overflow=MAX_OVERFLOW,
     pool_timeout=45,
     pool_recycle=7200,
     connect_args={"application_name": "os_api_v3"},
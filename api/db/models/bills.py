@@ -14,6 +14,12 @@ def _jid_to_abbr(jid):
     return jid.split(":")[-1].split("/")[0]
 
 
+def bill_openstates_url(jurisdiction_id, session, identifier):
+    abbr = _jid_to_abbr(jurisdiction_id)
+    identifier = identifier.replace(" ", "")
+    return f"https://openstates.org/{abbr}/bills/{session}/{identifier}/"
+
+
 class Bill(Base):
     __tablename__ = "opencivicdata_bill"
 
@@ -57,9 +63,9 @@ class Bill(Base):
 
     @property
     def openstates_url(self):
-        abbr = _jid_to_abbr(self.legislative_session.jurisdiction_id)
-        identifier = self.identifier.replace(" ", "")
-        return f"https://openstates.org/{abbr}/bills/{self.session}/{identifier}/"
+        return bill_openstates_url(
+            self.legislative_session.jurisdiction_id, self.session, self.identifier
+        )
 
     # computed fields
     first_action_date = Column(String)
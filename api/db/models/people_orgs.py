@@ -15,6 +15,11 @@ def encode_uuid(id):
     return base62.encode(as_int)
 
 
+def person_openstates_url(name, id):
+    """get canonical URL for openstates.org"""
+    return f"https://openstates.org/person/{slugify(name)}-{encode_uuid(id)}/"
+
+
 class Organization(Base):
     __tablename__ = "opencivicdata_organization"
 
@@ -83,7 +88,7 @@ class Person(Base):
     @property
     def openstates_url(self):
         """get canonical URL for openstates.org"""
-        return f"https://openstates.org/person/{slugify(self.name)}-{encode_uuid(self.id)}/"
+        return person_openstates_url(self.name, self.id)
 
 
 class PersonIdentifier(PrimaryUUID, Base):
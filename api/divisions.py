@@ -0,0 +1,315 @@
+"""
+Resolving points to divisions (districts) in-process.
+
+With DIVISION_BOUNDARIES set to a GeoJSON file, or a directory of them, each worker
+loads the district boundaries at startup and answers lat/lng lookups itself, for
+/divisions.geo and /people.geo, instead of making a request to the divisions.geo
+service for each.
+
+Features need their division id as an ocdid or id property (or the feature id), the
+state and division set are derived from it where they aren't given.  Polygons are
+indexed in a grid of cell_size degree cells, a lookup tests the point against the
+polygons whose bounding box overlaps its cell with a ray casting test.
+
+Lookups cluster (the same neighborhoods and city halls come up again and again), so
+results are cached in geo_cache, whether resolved here or by the upstream service.
+A result is cached for its whole ~100m cell only where the boundaries show that no
+district edge crosses the cell, so the cell can't span two districts; otherwise, and
+for upstream results, it is cached for the exact point only.
+"""
+import os
+import math
+import time
+import glob
+import logging
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Query
+from prometheus_client import Counter
+from .auth import apikey_auth
+from .cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+GEO_CACHE_LOOKUPS = Counter(
+    "geo_cache_lookups_total",
+    "Division lookups by cache result: cell or point hit, or miss.",
+    ["result"],
+)
+
+
+class _Polygon:
+    __slots__ = ("division", "bbox", "rings")
+
+    def __init__(self, division: Dict[str, str], rings):
+        self.division = division
+        # outer ring first, then holes, each a list of (lng, lat)
+        self.rings = rings
+        lngs = [lng for lng, lat in rings[0]]
+        lats = [lat for lng, lat in rings[0]]
+        self.bbox = (min(lngs), min(lats), max(lngs), max(lats))
+
+    def contains(self, lng: float, lat: float) -> bool:
+        min_lng, min_lat, max_lng, max_lat = self.bbox
+        if not (min_lng <= lng <= max_lng and min_lat <= lat <= max_lat):
+            return False
+        # inside the outer ring and none of the holes
+        inside = _in_ring(self.rings[0], lng, lat)
+        return inside and not any(_in_ring(hole, lng, lat) for hole in self.rings[1:])
+
+    def crosses(self, bounds) -> bool:
+        """whether any of the polygon's edges touches the bounds rectangle"""
+        min_lng, min_lat, max_lng, max_lat = bounds
+        if (
+            self.bbox[0] > max_lng
+            or self.bbox[2] < min_lng
+            or self.bbox[1] > max_lat
+            or self.bbox[3] < min_lat
+        ):
+            return False
+        return any(
+            _segment_touches(ring[i - 1], ring[i], bounds)
+            for ring in self.rings
+            for i in range(len(ring))
+        )
+
+
+def _in_ring(ring, x: float, y: float) -> bool:
+    inside = False
+    x1, y1 = ring[-1]
+    for x2, y2 in ring:
+        if (y1 > y) != (y2 > y) and x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+            inside = not inside
+        x1, y1 = x2, y2
+    return inside
+
+
+def _segment_touches(start, end, bounds) -> bool:
+    min_lng, min_lat, max_lng, max_lat = bounds
+    (x1, y1), (x2, y2) = start, end
+    if (
+        max(x1, x2) < min_lng
+        or min(x1, x2) > max_lng
+        or max(y1, y2) < min_lat
+        or min(y1, y2) > max_lat
+    ):
+        return False
+    if min_lng <= x1 <= max_lng and min_lat <= y1 <= max_lat:
+        return True
+    # the segment's bounding box overlaps the rectangle but it starts outside, it
+    # touches it unless all four corners are strictly on the same side of its line
+    sides = {
+        _side(x1, y1, x2, y2, x, y)
+        for x in (min_lng, max_lng)
+        for y in (min_lat, max_lat)
+    }
+    return sides != {1} and sides != {-1}
+
+
+def _side(x1, y1, x2, y2, x, y) -> int:
+    cross = (x2 - x1) * (y - y1) - (y2 - y1) * (x - x1)
+    return (cross > 0) - (cross < 0)
+
+
+class DivisionResolver:
+    """divisions containing a point, from a set of boundary features"""
+
+    def __init__(self, features: Iterable[dict], *, cell_size: float = 0.5):
+        self.cell_size = cell_size
+        self._grid = defaultdict(list)
+        self.divisions = 0
+        for feature in features:
+            self._add(feature)
+
+    @classmethod
+    def from_geojson(cls, path: str, **kwargs) -> "DivisionResolver":
+        """load a GeoJSON file, or all the .geojson/.json files in a directory"""
+        if os.path.isdir(path):
+            paths = sorted(
+                glob.glob(os.path.join(path, "*.geojson"))
+                + glob.glob(os.path.join(path, "*.json"))
+            )
+        else:
+            paths = [path]
+
+        def features():
+            for filename in paths:
+                with open(filename, "rb") as f:
+                    data = orjson.loads(f.read())
+                if data.get("type") == "FeatureCollection":
+                    yield from data["features"]
+                else:
+                    yield data
+
+        return cls(features(), **kwargs)
+
+    def lookup(self, lat: float, lng: float) -> List[Dict[str, str]]:
+        """divisions containing the point, in the divisions.geo response format"""
+        found = []
+        for polygon in self._grid.get(self._cell(lng, lat), ()):
+            if polygon.contains(lng, lat) and polygon.division not in found:
+                found.append(polygon.division)
+        return found
+
+    def uniform(self, bounds) -> bool:
+        """
+        whether every point within bounds, (min_lng, min_lat, max_lng, max_lat),
+        resolves to the same divisions: true when no polygon edge touches it
+        """
+        min_lng, min_lat, max_lng, max_lat = bounds
+        min_x, min_y = self._cell(min_lng, min_lat)
+        max_x, max_y = self._cell(max_lng, max_lat)
+        seen = set()
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                for polygon in self._grid.get((x, y), ()):
+                    if id(polygon) not in seen:
+                        seen.add(id(polygon))
+                        if polygon.crosses(bounds):
+                            return False
+        return True
+
+    def _add(self, feature: dict):
+        properties = feature.get("properties") or {}
+        division_id = properties.get("ocdid") or properties.get("id") or feature["id"]
+        geometry = feature["geometry"]
+        if geometry["type"] == "Polygon":
+            polygons = [geometry["coordinates"]]
+        elif geometry["type"] == "MultiPolygon":
+            polygons = geometry["coordinates"]
+        else:
+            raise ValueError(f"{division_id}: unsupported {geometry['type']} geometry")
+
+        division = _division(division_id, properties)
+        for coordinates in polygons:
+            rings = [[(lng, lat) for lng, lat, *_ in ring] for ring in coordinates]
+            polygon = _Polygon(division, rings)
+            min_lng, min_lat, max_lng, max_lat = polygon.bbox
+            min_x, min_y = self._cell(min_lng, min_lat)
+            max_x, max_y = self._cell(max_lng, max_lat)
+            for x in range(min_x, max_x + 1):
+                for y in range(min_y, max_y + 1):
+                    self._grid[(x, y)].append(polygon)
+        self.divisions += 1
+
+    def _cell(self, lng: float, lat: float):
+        return (math.floor(lng / self.cell_size), math.floor(lat / self.cell_size))
+
+
+def _division(division_id: str, properties: dict) -> Dict[str, str]:
+    # e.g. ocd-division/country:us/state:ne/sldu:1
+    parts = dict(
+        part.split(":", 1) for part in division_id.split("/")[1:] if ":" in part
+    )
+    division_set, _, name = division_id.rpartition("/")[2].partition(":")
+    return {
+        "id": division_id,
+        "state": properties.get("state") or parts.get("state", ""),
+        "name": properties.get("name") or name,
+        "division_set": properties.get("division_set") or division_set,
+    }
+
+
+class GeoCache:
+    """
+    Division lookup results by location, LRU with a TTL.  Results are stored for a
+    point (rounded to ~10cm) or, when it is known to resolve the same throughout, for
+    the point's cell_size degree cell.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 100_000,
+        ttl: float = 3600,
+        cell_size: float = 0.001,
+        timer=time.monotonic,
+    ):
+        self.cell_size = cell_size
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl, timer=timer)
+
+    def get(self, lat: float, lng: float) -> Optional[List[Dict[str, str]]]:
+        found = self._cache.get(self._point(lat, lng))
+        if found is not None:
+            GEO_CACHE_LOOKUPS.labels("point_hit").inc()
+            return found
+        found = self._cache.get(self._cell(lat, lng))
+        if found is not None:
+            GEO_CACHE_LOOKUPS.labels("cell_hit").inc()
+            return found
+        GEO_CACHE_LOOKUPS.labels("miss").inc()
+        return None
+
+    def set(self, lat: float, lng: float, divisions, *, whole_cell: bool = False):
+        key = self._cell(lat, lng) if whole_cell else self._point(lat, lng)
+        self._cache.set(key, divisions)
+
+    def cell_bounds(self, lat: float, lng: float):
+        """(min_lng, min_lat, max_lng, max_lat) of the cell containing the point"""
+        _, x, y = self._cell(lat, lng)
+        # padded a little, so rounding can't leave out the cell's edges
+        pad = self.cell_size * 1e-6
+        return (
+            x * self.cell_size - pad,
+            y * self.cell_size - pad,
+            (x + 1) * self.cell_size + pad,
+            (y + 1) * self.cell_size + pad,
+        )
+
+    def clear(self):
+        self._cache.clear()
+
+    def _cell(self, lat, lng):
+        return (
+            "cell",
+            math.floor(lng / self.cell_size),
+            math.floor(lat / self.cell_size),
+        )
+
+    def _point(self, lat, lng):
+        return ("point", round(lat, 6), round(lng, 6))
+
+
+# loaded at startup by load_boundaries if DIVISION_BOUNDARIES is set
+resolver: Optional[DivisionResolver] = None
+geo_cache = GeoCache()
+
+
+def lookup(lat: float, lng: float) -> List[Dict[str, str]]:
+    """divisions containing the point from the loaded boundaries, via geo_cache"""
+    found = geo_cache.get(lat, lng)
+    if found is None:
+        found = resolver.lookup(lat, lng)
+        geo_cache.set(
+            lat,
+            lng,
+            found,
+            whole_cell=resolver.uniform(geo_cache.cell_bounds(lat, lng)),
+        )
+    return found
+
+
+def load_boundaries():
+    global resolver
+    path = os.environ.get("DIVISION_BOUNDARIES")
+    if path:
+        resolver = DivisionResolver.from_geojson(path)
+        geo_cache.clear()
+        logger.info(f"loaded {resolver.divisions} divisions from {path}")
+
+
+router = APIRouter()
+
+
+@router.get("/divisions.geo", tags=["divisions"])
+def divisions_geo(
+    lat: float = Query(..., description="Latitude of point."),
+    lng: float = Query(..., description="Longitude of point."),
+    auth: str = Depends(apikey_auth),
+):
+    """
+    Get the divisions (districts) containing a given location.
+    """
+    if resolver is None:
+        raise HTTPException(404, detail="Division boundaries are not available.")
+    return {"divisions": lookup(lat, lng)}
@@ -1,12 +1,13 @@
 from enum import Enum
-from typing import List  # , Optional
-from fastapi import APIRouter, Depends, Query, HTTPException
+from typing import List, Optional
+from fastapi import APIRouter, Depends, Query, HTTPException, Request
 from sqlalchemy import func
 from sqlalchemy.orm import contains_eager
 from .db import SessionLocal, get_db, models
 from .schemas import Event
-from .pagination import Pagination
+from .pagination import Pagination, CountOption
 from .auth import apikey_auth
+from .cost import costed
 from .utils import jurisdiction_filter
 
 router = APIRouter()
@@ -29,11 +30,19 @@ class EventPagination(Pagination):
         EventInclude.sources: [],
         EventInclude.agenda: ["agenda", "agenda.related_entities", "agenda.media"],
     }
+    field_columns = {"jurisdiction": [], "location": []}
+    core_rows = True
     max_per_page = 20
 
-    def __init__(self, page: int = 1, per_page: int = 20):
-        self.page = page
-        self.per_page = per_page
+    def __init__(
+        self,
+        page: int = 1,
+        per_page: int = 20,
+        cursor: Optional[str] = None,
+        count: Optional[CountOption] = None,
+        request: Request = None,
+    ):
+        super().__init__(page, per_page, cursor, count, request)
 
 
 @router.get(
@@ -42,7 +51,8 @@ class EventPagination(Pagination):
     response_model_exclude_none=True,
     tags=["events"],
 )
-async def event_list(
+@costed(EventPagination)
+def event_list(
     jurisdiction: str = Query(None, description="Filter by jurisdiction name or ID."),
     deleted: bool = Query(False, description="Return events marked as deleted?"),
     before: str = Query(
@@ -58,6 +68,10 @@ async def event_list(
     include: List[EventInclude] = Query(
         [], description="Additional includes for the Event response."
     ),
+    fields: List[str] = Query(
+        [],
+        description="Only return these fields (comma separated), includes are unaffected.",
+    ),
     db: SessionLocal = Depends(get_db),
     auth: str = Depends(apikey_auth),
     pagination: EventPagination = Depends(),
@@ -100,7 +114,7 @@ async def event_list(
             .having(func.count_(models.EventRelatedEntity.id) > 0)
         )
 
-    return pagination.paginate(query, includes=include)
+    return pagination.paginate(query, includes=include, fields=fields)
 
 
 @router.get(
@@ -110,11 +124,16 @@ async def event_list(
     response_model_exclude_none=True,
     tags=["events"],
 )
-async def event_detail(
+@costed(EventPagination, rows=1)
+def event_detail(
     event_id: str,
     include: List[EventInclude] = Query(
         [], description="Additional includes for the Event response."
     ),
+    fields: List[str] = Query(
+        [],
+        description="Only return these fields (comma separated), includes are unaffected.",
+    ),
     db: SessionLocal = Depends(get_db),
     auth: str = Depends(apikey_auth),
 ):
@@ -133,4 +152,4 @@ async def event_detail(
             ),
         )
     )
-    return EventPagination.detail(query, includes=include)
+    return EventPagination.detail(query, includes=include, fields=fields)
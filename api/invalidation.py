@@ -0,0 +1,77 @@
+"""
+Cache invalidations shared by every worker, over Redis pub/sub.
+
+Caches are per-worker, so a change made elsewhere (e.g. openstates.org changing a
+profile's tier or revoking its key) can't clear them directly.  Instead it publishes
+the changed key on a channel:
+
+    PUBLISH v3:apikey-invalidations <api key>
+    PUBLISH v3:apikey-invalidations *
+
+and each worker's listener thread passes it on to its callback, within about
+interval seconds (* being passed as None, for everything).  Anything published while
+a worker is disconnected is missed, so the callback is also called with None whenever
+it (re)subscribes.
+"""
+import logging
+from typing import Callable, Optional
+from .background import BackgroundFlusher
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidationListener(BackgroundFlusher):
+    thread_name = "invalidations"
+
+    def __init__(
+        self,
+        redis,
+        channel: str,
+        callback: Callable[[Optional[str]], None],
+        *,
+        interval: Optional[float] = 1,
+    ):
+        super().__init__(interval)
+        self.redis = redis
+        self.channel = channel
+        self.callback = callback
+        self._pubsub = None
+
+    def start(self):
+        """start listening, from the worker process"""
+        self._ensure_started()
+
+    def flush(self):
+        """apply the invalidations received since the last call"""
+        if self._pubsub is None:
+            pubsub = self.redis.pubsub()
+            pubsub.subscribe(self.channel)
+            self._pubsub = pubsub
+            self.callback(None)
+        try:
+            while True:
+                message = self._pubsub.get_message()
+                if message is None:
+                    return
+                if message["type"] != "message":
+                    continue
+                data = message["data"]
+                if isinstance(data, bytes):
+                    data = data.decode()
+                self.callback(None if data == "*" else data)
+        except Exception:
+            # subscribe again next time
+            self._disconnect()
+            raise
+
+    def close(self):
+        super().close()
+        self._disconnect()
+
+    def _disconnect(self):
+        if self._pubsub is not None:
+            try:
+                self._pubsub.close()
+            except Exception:
+                logger.exception("closing the invalidation subscription failed")
+            self._pubsub = None
@@ -1,10 +1,14 @@
 from enum import Enum
 from typing import Optional, List
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, Query, Request
+from sqlalchemy import func, select
 from .db import SessionLocal, get_db, models
 from .schemas import Jurisdiction, JurisdictionClassification
-from .pagination import Pagination
+from .pagination import Pagination, CountOption, IncludeStrategy
+from .serializers import serializer
 from .auth import apikey_auth
+from .cost import costed
+from .conditional import Conditional, watermark
 from .utils import jurisdiction_filter
 
 
@@ -25,6 +29,9 @@ class JurisdictionPagination(Pagination):
             "legislative_sessions.downloads",
         ],
     }
+    include_strategies = {
+        JurisdictionInclude.legislative_sessions: IncludeStrategy.aggregate
+    }
     max_per_page = 52
 
     @classmethod
@@ -32,11 +39,36 @@ class JurisdictionPagination(Pagination):
         # latest runs needs to be set on each object individually, the 20-item
         # limit makes a subquery approach not work
         if JurisdictionInclude.latest_runs in includes:
-            obj.latest_runs = data.get_latest_runs()
+            obj["latest_runs"] = serializer(Jurisdiction).encode(
+                "latest_runs", data.get_latest_runs()
+            )
+
+    def __init__(
+        self,
+        page: int = 1,
+        per_page: int = 52,
+        count: Optional[CountOption] = None,
+        request: Request = None,
+    ):
+        super().__init__(page, per_page, count=count, request=request)
+
 
-    def __init__(self, page: int = 1, per_page: int = 52):
-        self.page = page
-        self.per_page = per_page
+def jurisdiction_modified(includes):
+    """
+    the watermark expression for Jurisdiction rows: their data changes with either
+    update, and latest_runs with each run
+    """
+    columns = [
+        models.Jurisdiction.latest_bill_update,
+        models.Jurisdiction.latest_people_update,
+    ]
+    if JurisdictionInclude.latest_runs in includes:
+        columns.append(
+            select(func.max(models.RunPlan.end_time))
+            .where(models.RunPlan.jurisdiction_id == models.Jurisdiction.id)
+            .scalar_subquery()
+        )
+    return func.greatest(*columns)
 
 
 router = APIRouter()
@@ -48,7 +80,9 @@ router = APIRouter()
     response_model_exclude_none=True,
     tags=["jurisdictions"],
 )
-async def jurisdiction_list(
+@costed(JurisdictionPagination)
+def jurisdiction_list(
+    request: Request,
     classification: Optional[JurisdictionClassification] = Query(
         None, description="Filter returned jurisdictions by type."
     ),
@@ -65,10 +99,17 @@ async def jurisdiction_list(
     query = db.query(models.Jurisdiction).order_by(models.Jurisdiction.name)
 
     # handle parameters
+    criteria = []
     if classification:
-        query = query.filter(models.Jurisdiction.classification == classification)
+        criteria.append(models.Jurisdiction.classification == classification)
+    query = query.filter(*criteria)
 
-    return pagination.paginate(query, includes=include)
+    conditional = Conditional(
+        request, watermark(db, jurisdiction_modified(include), *criteria)
+    )
+    if conditional.not_modified:
+        return conditional.not_modified_response()
+    return conditional.apply(pagination.paginate(query, includes=include))
 
 
 @router.get(
@@ -78,7 +119,9 @@ async def jurisdiction_list(
     response_model_exclude_none=True,
     tags=["jurisdictions"],
 )
-async def jurisdiction_detail(
+@costed(JurisdictionPagination, rows=1)
+def jurisdiction_detail(
+    request: Request,
     jurisdiction_id: str,
     include: List[JurisdictionInclude] = Query(
         [], description="Additional includes for the Jurisdiction response."
@@ -87,7 +130,11 @@ async def jurisdiction_detail(
     auth: str = Depends(apikey_auth),
 ):
     """Get details on a single Jurisdiction (e.g. state or municipality)."""
-    query = db.query(models.Jurisdiction).filter(
-        jurisdiction_filter(jurisdiction_id, jid_field=models.Jurisdiction.id)
+    criteria = jurisdiction_filter(jurisdiction_id, jid_field=models.Jurisdiction.id)
+    conditional = Conditional(
+        request, watermark(db, jurisdiction_modified(include), criteria)
     )
-    return JurisdictionPagination.detail(query, includes=include)
+    if conditional.not_modified:
+        return conditional.not_modified_response()
+    query = db.query(models.Jurisdiction).filter(criteria)
+    return conditional.apply(JurisdictionPagination.detail(query, includes=include))
@@ -1,26 +1,34 @@
 import os
 import sentry_sdk
-from fastapi import FastAPI
+from fastapi import FastAPI, Depends
 from fastapi.openapi.utils import get_openapi
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
+from fastapi.responses import ORJSONResponse, RedirectResponse
 from prometheus_fastapi_instrumentator import Instrumentator
 from uvicorn.workers import UvicornWorker
-from . import jurisdictions, people, bills, committees, events
+from . import jurisdictions, people, bills, committees, events, auth, divisions
+from .admission import admission
+from .auth import apikey_invalidations, limiter, usage
+from .cost import RequestCostMiddleware
 
 if "SENTRY_URL" in os.environ:
     sentry_sdk.init(os.environ["SENTRY_URL"], traces_sample_rate=0)
 
-app = FastAPI()
-app.include_router(jurisdictions.router)
-app.include_router(people.router)
-app.include_router(bills.router)
-app.include_router(committees.router)
-app.include_router(events.router)
+# orjson encodes much faster than json, especially for large lists of results
+app = FastAPI(default_response_class=ORJSONResponse)
+# every router here uses the database, admission control keeps them within the pool
+for module in (jurisdictions, people, bills, committees, events, auth):
+    app.include_router(module.router, dependencies=[Depends(admission)])
+# admitted for their database step only, see people_geo
+app.include_router(people.geo_router)
+# lookups are answered in memory
+app.include_router(divisions.router)
+app.add_middleware(RequestCostMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-Cost"],
 )
 
 instrumentator = Instrumentator(
@@ -37,6 +45,29 @@ instrumentator.instrument(app)
 instrumentator.expose(app, include_in_schema=True, should_gzip=True)
 
 
+@app.on_event("startup")
+def load_boundaries():
+    divisions.load_boundaries()
+
+
+@app.on_event("startup")
+def listen_for_invalidations():
+    apikey_invalidations.start()
+
+
+@app.on_event("shutdown")
+def flush_counts():
+    # send this worker's unsynced request counts & usage before it goes away
+    limiter.close()
+    usage.close()
+    apikey_invalidations.close()
+
+
+@app.on_event("shutdown")
+async def close_upstreams():
+    await people.geo_client.close()
+
+
 @app.get("/healthz", include_in_schema=False)
 async def health():
     return "OK"
@@ -81,37 +112,6 @@ If you have any issues or questions use our
 """,
         routes=app.routes,
     )
-
-    # if we want to publish divisions.geo we can like this
-    # openapi_schema["paths"]["/divisions.geo"] = {
-    #     "get": {
-    #         "summary": "Divisions Geo",
-    #         "operationId": "divisions_geo_get",
-    #         "tags": ["divisions"],
-    #         "parameters": [
-    #             {
-    #                 "required": True,
-    #                 "schema": {"title": "Latitude", "type": "number"},
-    #                 "name": "lat",
-    #                 "in": "query",
-    #             },
-    #             {
-    #                 "required": True,
-    #                 "schema": {"title": "Longitude", "type": "number"},
-    #                 "name": "lng",
-    #                 "in": "query",
-    #             },
-    #         ],
-    #         "responses": {
-    #             "200": {"description": "Successful Response"},
-    #             "content": {
-    #                 "application/json": {
-    #                     "schema": "#/components/schemas/JurisdictionList"
-    #                 }
-    #             },
-    #         },
-    #     }
-    # }
     app.openapi_schema = openapi_schema
     return app.openapi_schema
 
@@ -1,16 +1,179 @@
+import json
 import math
-from typing import List
+import base64
+import hashlib
+import datetime
+import functools
+from enum import Enum
+from typing import Callable, Dict, List, NamedTuple, Optional
 from pydantic import create_model, BaseModel, Field
-from fastapi import HTTPException
-from sqlalchemy.orm import noload, selectinload
-from sqlalchemy.orm.exc import NoResultFound
+from fastapi import HTTPException, Request
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import and_, or_, func, inspect, DateTime
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import noload, selectinload, load_only
+from sqlalchemy.orm.exc import NoResultFound, UnmappedColumnError
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import UnaryExpression
+from .aggregates import json_relationship, schema_columns
+from .serializers import serializer
+from .cache import TTLCache
 
 
 class PaginationMeta(BaseModel):
     per_page: int = Field(..., example=20)
-    page: int = Field(..., example=1)
-    max_page: int = Field(..., example=3)
-    total_items: int = Field(..., example=52)
+    page: Optional[int] = Field(None, example=1)
+    max_page: Optional[int] = Field(None, example=3)
+    total_items: Optional[int] = Field(None, example=52)
+    next_cursor: Optional[str] = Field(None, example="WyIyMDIxLTA4LTAxIl0")
+    has_next_page: Optional[bool] = Field(None, example=True)
+
+
+class IncludeStrategy(str, Enum):
+    # one extra SELECT ... WHERE id IN (...) query per relationship path
+    selectin = "selectin"
+    # a correlated json_agg() subquery per include in the main query
+    aggregate = "aggregate"
+
+
+class CountOption(str, Enum):
+    exact = "exact"
+    estimate = "estimate"
+    none = "none"
+
+
+# recently seen totals, keyed by endpoint and normalized filters (see Pagination.count_key)
+count_cache = TTLCache(maxsize=2048, ttl=300)
+
+# query parameters that don't change which rows match, and so don't affect the count
+_NON_FILTER_PARAMS = {
+    "page",
+    "per_page",
+    "cursor",
+    "fields",
+    "count",
+    "sort",
+    "include",
+    "apikey",
+}
+
+# for rate limiting, related rows selected (one per include path per result) that cost
+# as much as a request, see Pagination.cost
+INCLUDE_ROWS_PER_UNIT = 50
+
+
+def estimate_count(query):
+    """get the planner's row estimate for a query without running it"""
+    session = query.session
+    # expanding IN parameters are only rendered at execution time unless asked for
+    compiled = query.statement.compile(
+        dialect=session.get_bind().dialect,
+        compile_kwargs={"render_postcompile": True},
+    )
+    plan = (
+        session.connection()
+        .exec_driver_sql("EXPLAIN (FORMAT JSON) " + compiled.string, compiled.params)
+        .scalar()
+    )
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def _sort_keys(query):
+    """
+    convert a query's ORDER BY into (column, descending, nulls_last) tuples
+
+    the primary key of the queried entity is appended as a unique tie-breaker so
+    that every row has a distinct position in the ordering
+    """
+    keys = []
+    for clause in query._order_by_clauses:
+        descending = False
+        nulls_last = None
+        while isinstance(clause, UnaryExpression):
+            if clause.modifier is operators.desc_op:
+                descending = True
+            elif clause.modifier in (operators.nulls_last_op, operators.nullslast_op):
+                nulls_last = True
+            elif clause.modifier in (
+                operators.nulls_first_op,
+                operators.nullsfirst_op,
+            ):
+                nulls_last = False
+            elif clause.modifier is not operators.asc_op:
+                break
+            clause = clause.element
+        # postgres sorts NULL as larger than any value unless told otherwise
+        if nulls_last is None:
+            nulls_last = not descending
+        keys.append((clause, descending, nulls_last))
+    for pk in inspect(query.column_descriptions[0]["entity"]).primary_key:
+        keys.append((pk, False, True))
+    return keys
+
+
+def _after_clause(keys, values):
+    """build a WHERE clause matching rows that sort strictly after values"""
+    clauses = []
+    equal_so_far = []
+    for (column, descending, nulls_last), value in zip(keys, values):
+        if value is None:
+            after = None if nulls_last else column.isnot(None)
+            equal = column.is_(None)
+        else:
+            after = column < value if descending else column > value
+            if nulls_last:
+                after = or_(after, column.is_(None))
+            equal = column == value
+        if after is not None:
+            clauses.append(and_(*equal_so_far, after))
+        equal_so_far.append(equal)
+
+    clause = or_(*clauses)
+    # the OR chain above can't be used as an index condition, so also bound the
+    # leading sort key when NULLs can't appear after the cursor
+    column, descending, nulls_last = keys[0]
+    if values[0] is not None and not nulls_last:
+        clause = and_(
+            column <= values[0] if descending else column >= values[0], clause
+        )
+    return clause
+
+
+def _sort_signature(keys):
+    """short fingerprint of a sort order, used to reject a cursor from a different sort"""
+    order = ";".join(f"{col}:{desc}:{nulls}" for col, desc, nulls in keys)
+    return hashlib.sha1(order.encode()).hexdigest()[:8]
+
+
+def encode_cursor(keys, values):
+    payload = [_sort_signature(keys)] + [
+        v.isoformat() if isinstance(v, (datetime.date, datetime.datetime)) else v
+        for v in values
+    ]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+
+def decode_cursor(keys, cursor):
+    try:
+        payload = json.loads(
+            base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        )
+        signature, *values = payload
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    if signature != _sort_signature(keys) or len(values) != len(keys):
+        raise HTTPException(
+            status_code=400, detail="cursor does not match the requested sort order"
+        )
+    try:
+        return [
+            datetime.datetime.fromisoformat(v)
+            if v is not None and isinstance(column.type, DateTime)
+            else v
+            for (column, _, _), v in zip(keys, values)
+        ]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="invalid cursor")
 
 
 class Pagination:
@@ -22,18 +185,52 @@ class Pagination:
         - IncludeEnum - the valid include= parameters enumeration
         - include_map_overrides - mapping of what fields to select-in if included
                         (default to same name as IncludeEnum properties)
-        - postprocess_includes - function to call on each object to set includes
+        - postprocess_includes - function to call on each serialized object to set
+                        includes
+        - include_strategies - mapping of includes to an IncludeStrategy
+                        (default to selectin)
+        - field_columns - mapping of ObjCls fields that aren't plain columns to the
+                        fields they're computed from, for fields=
+        - core_rows - build results straight from the rows of a Core select rather
+                        than from ORM objects (default False)
+        - core_fields - for core_rows, mapping of ObjCls fields that aren't a column or
+                        relationship of the model to a SQL expression, or to a function
+                        of the row for fields computed in Python
 
     Once those are set all of the basic methods work as classmethods so they can be called by
      PaginationSubclass.detail.
 
     The only time the class is insantiated is when it is used as a dependency for actual
     pagination.
+
+    Passing cursor= (empty for the first page, then the returned next_cursor) switches
+    from page/offset pagination to keyset pagination on the query's ORDER BY.
+
+    count= picks how total_items is computed: exact (the default for page-based
+    pagination), estimate (a recently cached total or the planner's estimate), or none
+    (only report whether there is a next page, the default for cursor pagination).
     """
 
-    def __init__(self, page: int = 1, per_page: int = 10):
+    def __init__(
+        self,
+        page: int = 1,
+        per_page: int = 10,
+        cursor: Optional[str] = None,
+        count: Optional[CountOption] = None,
+        request: Request = None,
+    ):
         self.page = page
         self.per_page = per_page
+        self.cursor = cursor
+        if count is None:
+            count = CountOption.exact if cursor is None else CountOption.none
+        self.count = count
+        self.request = request
+
+    include_strategies = {}
+    field_columns = {}
+    core_rows = False
+    core_fields = {}
 
     @classmethod
     def include_map(cls):
@@ -42,6 +239,17 @@ class Pagination:
             cls._include_map.update(cls.include_map_overrides)
         return cls._include_map
 
+    @classmethod
+    def cost(cls, includes, rows: int) -> int:
+        """
+        rate limiting units for a request returning rows results with includes: one,
+        plus one per INCLUDE_ROWS_PER_UNIT included relationship rows (roughly)
+        """
+        include_map = cls.include_map()
+        # includes without paths (like latest_runs) are loaded separately, count them too
+        paths = sum(max(1, len(include_map[include])) for include in includes)
+        return 1 + math.ceil(paths * rows / INCLUDE_ROWS_PER_UNIT)
+
     @classmethod
     def response_model(cls):
         return create_model(
@@ -56,6 +264,7 @@ class Pagination:
         *,
         includes=None,
         skip_count=False,
+        fields=None,
     ):
         # shouldn't happen, but help log if it does
         if not results._order_by_clauses:
@@ -69,80 +278,405 @@ class Pagination:
                 detail=f"invalid per_page, must be in [1, {self.max_per_page}]",
             )
 
-        if not skip_count:
-            total_items = results.count()
-            num_pages = math.ceil(total_items / self.per_page) or 1
-        else:
+        fields = self.parse_fields(fields)
+        if self.cursor is not None:
+            return self.paginate_cursor(results, includes=includes, fields=fields)
+
+        if self.page < 1:
+            raise HTTPException(status_code=404, detail="invalid page, must be >= 1")
+
+        window_count = not skip_count and self.count == CountOption.exact
+        # with count=none fetch one extra row to see if there's another page
+        limit = self.per_page + 1 if self.count == CountOption.none else self.per_page
+
+        # before the query, do the appropriate joins and noload operations
+        query, plan = self.prepare_query(results, includes, fields)
+        if window_count:
+            # count(*) OVER () is evaluated before LIMIT/OFFSET, so every row of the
+            # page carries the total and the count doesn't need its own query
+            query = query.add_columns(func.count().over().label("total_items"))
+        rows = query.limit(limit).offset((self.page - 1) * self.per_page).all()
+
+        has_next_page = None
+        if skip_count:
             # used for people.geo, always fits on one page
-            total_items = 0
-            num_pages = 1
+            # make the data correct without the extra query
+            total_items = len(rows)
+        elif window_count:
+            if rows:
+                total_items = rows[0].total_items
+            else:
+                # an empty page can't tell us the total, so fall back to counting
+                total_items = results.count()
+            self.remember_count(total_items)
+        elif self.count == CountOption.estimate:
+            total_items = max(
+                self.total_items(results), (self.page - 1) * self.per_page + len(rows)
+            )
+        else:
+            total_items = None
+            has_next_page = len(rows) > self.per_page
+            rows = rows[: self.per_page]
 
-        if self.page < 1 or self.page > num_pages:
+        if total_items is None:
+            num_pages = None
+            if self.page > 1 and not rows:
+                raise HTTPException(
+                    status_code=404, detail="invalid page, past the last page"
+                )
+        else:
+            num_pages = math.ceil(total_items / self.per_page) or 1
+            if self.page > num_pages:
+                raise HTTPException(
+                    status_code=404, detail=f"invalid page, must be in [1, {num_pages}]"
+                )
+
+        results = [self.to_obj(data, includes, fields, plan) for data in rows]
+        meta = PaginationMeta(
+            total_items=total_items,
+            per_page=self.per_page,
+            page=self.page,
+            max_page=num_pages,
+            has_next_page=has_next_page,
+        )
+
+        return self.response({"pagination": meta, "results": results})
+
+    def paginate_list(self, items, *, includes=None, fields=None):
+        """
+        paginate results already in memory, items are serialized objects with every
+        field and include, narrowed down here to the requested ones
+        """
+        if self.per_page < 1 or self.per_page > self.max_per_page:
             raise HTTPException(
-                status_code=404, detail=f"invalid page, must be in [1, {num_pages}]"
+                status_code=400,
+                detail=f"invalid per_page, must be in [1, {self.max_per_page}]",
             )
+        if self.page < 1:
+            raise HTTPException(status_code=404, detail="invalid page, must be >= 1")
 
-        # before the query, do the appropriate joins and noload operations
-        results = self.select_or_noload(results, includes)
-        results = (
-            results.limit(self.per_page).offset((self.page - 1) * self.per_page).all()
-        )
-        results = [self.to_obj_with_includes(data, includes) for data in results]
+        names = set(self.output_fields(self.parse_fields(fields), includes or []))
+        start = (self.page - 1) * self.per_page
+        end = start + self.per_page
+        rows = items[start:end]
 
-        # make the data correct without the extra query
-        if skip_count:
-            total_items = len(results)
+        has_next_page = None
+        if self.count == CountOption.none:
+            total_items = num_pages = None
+            has_next_page = end < len(items)
+            if self.page > 1 and not rows:
+                raise HTTPException(
+                    status_code=404, detail="invalid page, past the last page"
+                )
+        else:
+            # exact, and as good as any estimate
+            total_items = len(items)
+            num_pages = math.ceil(total_items / self.per_page) or 1
+            if self.page > num_pages:
+                raise HTTPException(
+                    status_code=404, detail=f"invalid page, must be in [1, {num_pages}]"
+                )
 
+        results = [
+            {name: value for name, value in item.items() if name in names}
+            for item in rows
+        ]
         meta = PaginationMeta(
             total_items=total_items,
             per_page=self.per_page,
             page=self.page,
             max_page=num_pages,
+            has_next_page=has_next_page,
+        )
+        return self.response({"pagination": meta, "results": results})
+
+    def count_key(self):
+        """the endpoint + filters of this request, which determine the total count"""
+        if self.request is None:
+            return None
+        filters = sorted(
+            (k, v)
+            for k, v in self.request.query_params.multi_items()
+            if k not in _NON_FILTER_PARAMS
         )
+        return (self.request.url.path, tuple(filters))
+
+    def remember_count(self, total_items):
+        key = self.count_key()
+        if key is not None:
+            count_cache.set(key, total_items)
+
+    def total_items(self, results):
+        """
+        total number of items for count=exact or count=estimate
+
+        estimates reuse any count seen recently for the same filters, otherwise fall
+        back to the planner's estimate, which is much cheaper than counting
+        """
+        if self.count == CountOption.none:
+            return None
+        if self.count == CountOption.estimate:
+            key = self.count_key()
+            total_items = count_cache.get(key) if key is not None else None
+            if total_items is None:
+                total_items = estimate_count(results)
+                self.remember_count(total_items)
+            return total_items
+        total_items = results.count()
+        self.remember_count(total_items)
+        return total_items
+
+    def paginate_cursor(self, results, *, includes=None, fields=None):
+        """
+        keyset pagination: rather than OFFSET, filter to rows that sort after the
+        last row of the previous page, so every page costs the same to fetch
+        """
+        total_items = self.total_items(results)
+        keys = _sort_keys(results)
+        num_sorts = len(results._order_by_clauses)
+        tie_breakers = keys[num_sorts:]
+        mapper = inspect(results.column_descriptions[0]["entity"])
+        try:
+            props = [mapper.get_property_by_column(col).key for col, _, _ in keys]
+        except UnmappedColumnError:
+            raise HTTPException(
+                status_code=400, detail="cursor pagination not supported for this sort"
+            )
 
-        return {"pagination": meta, "results": results}
+        if self.cursor:
+            results = results.filter(
+                _after_clause(keys, decode_cursor(keys, self.cursor))
+            )
+        results = results.order_by(*(col for col, _, _ in tie_breakers))
+        # the sort keys are needed to build next_cursor, even if not in fields
+        results, plan = self.prepare_query(results, includes, fields, tuple(props))
+        results = results.limit(self.per_page + 1).all()
+
+        next_cursor = None
+        if len(results) > self.per_page:
+            results = results[: self.per_page]
+            if plan is None:
+                last = _unpack_row(results[-1])[0]
+                values = [getattr(last, p) for p in props]
+            else:
+                values = [results[-1]._mapping[p] for p in props]
+            next_cursor = encode_cursor(keys, values)
+
+        meta = PaginationMeta(
+            total_items=total_items,
+            per_page=self.per_page,
+            page=None,
+            max_page=None,
+            next_cursor=next_cursor,
+        )
+        results = [self.to_obj(data, includes, fields, plan) for data in results]
+        return self.response({"pagination": meta, "results": results})
 
     @classmethod
-    def detail(cls, query, *, includes):
+    def detail(cls, query, *, includes, fields=None):
         """convert a single instance query to a model with the appropriate includes"""
-        query = cls.select_or_noload(query, includes)
+        fields = cls.parse_fields(fields)
+        query, plan = cls.prepare_query(query, includes, fields)
         try:
             obj = query.one()
         except NoResultFound:
             raise HTTPException(
                 status_code=404, detail=f"No such {cls.ObjCls.__name__}."
             )
-        return cls.to_obj_with_includes(obj, includes)
+        return cls.response(cls.to_obj(obj, includes, fields, plan))
+
+    @classmethod
+    def parse_fields(cls, fields):
+        """
+        turn fields=a,b&fields=c into a frozenset of ObjCls fields, or None if no
+        fields were requested (meaning all of them)
+        """
+        if not fields:
+            return None
+        fields = frozenset(
+            name.strip()
+            for value in fields
+            for name in value.split(",")
+            if name.strip()
+        )
+        allowed = set(cls.ObjCls.__fields__) - {i.value for i in cls.IncludeEnum}
+        unknown = fields - allowed
+        if unknown:
+            raise HTTPException(
+                status_code=400,
+                detail=f"invalid fields: {', '.join(sorted(unknown))}, "
+                "related data is requested with include=",
+            )
+        return fields or None
+
+    @classmethod
+    def serializer(cls, includes, fields):
+        """the serializer for ObjCls with just the requested fields & includes"""
+        return serializer(cls.ObjCls, frozenset(cls.output_fields(fields, includes)))
+
+    @classmethod
+    def load_fields(cls, query, fields, includes=(), extra=()):
+        """restrict the columns loaded for the main entity to those needed for fields"""
+        if fields is None:
+            return query
+        model = query.column_descriptions[0]["entity"]
+        mapper = inspect(model)
+        names = set(extra)
+        # includes stored as JSON columns (e.g. links) have to be loaded too
+        for field in [*fields, *includes]:
+            names.update(cls.field_columns.get(field, [field]))
+        columns = {name for name in names if name in mapper.column_attrs}
+        for pk in mapper.primary_key:
+            columns.add(mapper.get_property_by_column(pk).key)
+        return query.options(load_only(*(getattr(model, c) for c in columns)))
+
+    @classmethod
+    def output_fields(cls, fields, includes):
+        """names of the ObjCls fields that will be in the response"""
+        if fields is None:
+            exclude = {include.value for include in cls.IncludeEnum}
+            fields = [name for name in cls.ObjCls.__fields__ if name not in exclude]
+        return [*fields, *(include.value for include in includes)]
+
+    @classmethod
+    def core_plan(cls, model, includes, fields, extra=()):
+        """
+        how to select & build results as plain dicts, or None if this combination of
+        includes and fields needs ORM objects (e.g. an include computed in Python)
+        """
+        if not cls.core_rows:
+            return None
+        return _core_plan(cls, model, frozenset(includes), fields, extra)
+
+    @classmethod
+    def prepare_query(cls, query, includes, fields, extra=()):
+        """
+        set up the query to load includes & fields, either with ORM loader options or
+        as a Core select of just the needed columns (see core_plan)
+
+        returns the query and the core plan, which must be passed along to to_obj
+        """
+        model = query.column_descriptions[0]["entity"]
+        plan = cls.core_plan(model, includes, fields, extra)
+        if plan is None:
+            query = cls.select_or_noload(query, includes)
+            query = cls.load_fields(query, fields, includes, extra)
+        else:
+            query = query.with_entities(*plan.columns)
+        return query, plan
+
+    @classmethod
+    def to_obj(cls, data, includes, fields, plan):
+        if plan is None:
+            return cls.to_obj_with_includes(data, includes, fields)
+        row = data._mapping
+        computed = {name: compute(row) for name, compute in plan.computed.items()}
+        return cls.serializer(includes, fields)(row, computed)
+
+    @classmethod
+    def response(cls, data):
+        """
+        results are already serialized to match the response_model, so they're
+        returned as a Response to skip FastAPI validating them all over again
+        """
+        if isinstance(data.get("pagination"), PaginationMeta):
+            data["pagination"] = data["pagination"].dict(exclude_none=True)
+        return ORJSONResponse(data)
 
     @classmethod
     def postprocess_includes(cls, obj, data, includes):
         pass
 
     @classmethod
-    def to_obj_with_includes(cls, data, includes):
+    def to_obj_with_includes(cls, data, includes, fields=None):
         """
-        remove the non-included data from the response by setting the fields to
-        None instead of [], and returning the Pydantic objects directly
+        serialize an ORM object (or row with aggregated includes) with just the
+        requested fields & includes, non-included data is left out of the response
         """
-        newobj = cls.ObjCls.from_orm(data)
-        for include in cls.IncludeEnum:
-            if include not in includes:
-                setattr(newobj, include, None)
-        cls.postprocess_includes(newobj, data, includes)
-        return newobj
+        data, columns = _unpack_row(data)
+        aggregated = {
+            include.value: columns[_aggregate_label(include)]
+            for include in includes
+            if cls.include_strategy(include) == IncludeStrategy.aggregate
+        }
+        obj = cls.serializer(includes, fields)(data, aggregated)
+        cls.postprocess_includes(obj, data, includes)
+        return obj
+
+    @classmethod
+    def include_strategy(cls, include):
+        return cls.include_strategies.get(include, IncludeStrategy.selectin)
+
+    @classmethod
+    def aggregate_include(cls, include, model):
+        """correlated subquery that selects an include as JSON (built once per class)"""
+        if "_aggregates" not in cls.__dict__:
+            cls._aggregates = {}
+        if include not in cls._aggregates:
+            try:
+                relationship = inspect(model).relationships[include]
+            except KeyError:
+                raise ValueError(f"{include} must be a relationship to be aggregated")
+            schema = cls.ObjCls.__fields__[include].type_
+            cls._aggregates[include] = json_relationship(relationship, schema).label(
+                _aggregate_label(include)
+            )
+        return cls._aggregates[include]
 
     @classmethod
     def select_or_noload(cls, query, includes):
         """either pre-join or no-load data based on whether it has been requested"""
+        model = query.column_descriptions[0]["entity"]
         for fieldname in cls.IncludeEnum:
-            if fieldname in includes:
-                # selectinload seems like a strong default choice, but it is possible that
-                # some configurability might be desirable eventually for some types of data
-                loader = selectinload
-            else:
+            if fieldname not in includes:
+                loader = noload
+            elif cls.include_strategy(fieldname) == IncludeStrategy.aggregate:
+                # the relationship comes back as a JSON column of the main query
+                query = query.add_columns(cls.aggregate_include(fieldname, model))
                 loader = noload
+            else:
+                loader = selectinload
 
             # update the query with appropriate loader
             for dbname in cls.include_map()[fieldname]:
                 query = query.options(loader(dbname))
         return query
+
+
+class CorePlan(NamedTuple):
+    columns: list
+    # fields computed in Python from the row
+    computed: Dict[str, Callable]
+
+
+@functools.lru_cache(maxsize=256)
+def _core_plan(Pagination, model, includes, fields, extra):
+    output = Pagination.output_fields(fields, includes)
+    computed = {}
+    overrides = {}
+    for name, value in Pagination.core_fields.items():
+        if callable(value):
+            if name in output:
+                computed[name] = value
+        else:
+            overrides[name] = value
+
+    selected = {name for name in output if name not in computed} | set(extra)
+    for name in computed:
+        selected.update(Pagination.field_columns.get(name, []))
+    try:
+        columns = schema_columns(model, Pagination.ObjCls, sorted(selected), overrides)
+    except ValueError:
+        return None
+    return CorePlan(columns, computed)
+
+
+def _aggregate_label(include):
+    return f"include_{include.value}"
+
+
+def _unpack_row(row):
+    """split a result row into the ORM object and any extra labeled columns"""
+    if isinstance(row, Row):
+        return row[0], row._mapping
+    return row, {}
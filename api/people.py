@@ -1,13 +1,24 @@
+import os
+import math
+import asyncio
 from typing import Optional, List
 from enum import Enum
-import requests
-from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi import APIRouter, Body, Depends, Query, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from pydantic import conlist
 from sqlalchemy import func, or_
 from sqlalchemy.orm import contains_eager
 from .db import SessionLocal, get_db, models
-from .schemas import Person, OrgClassification
+from .db.models.people_orgs import person_openstates_url
+from .schemas import Person, OrgClassification, GeoPoint, PeopleGeoBatch
 from .pagination import Pagination, PaginationMeta
-from .auth import apikey_auth
+from .admission import admitted
+from .auth import apikey_auth, charge_extra
+from .cost import costed
+from .conditional import Conditional, jurisdiction_watermark
+from . import divisions
+from .roster import RosterSnapshot
+from .upstream import CircuitOpen, UpstreamBusy, UpstreamClient, UpstreamError
 from .utils import jurisdiction_filter, add_state_divisions
 
 
@@ -23,6 +34,11 @@ class PeoplePagination(Pagination):
     ObjCls = Person
     IncludeEnum = PersonInclude
     include_map_overrides = {}
+    field_columns = {"openstates_url": ["id", "name"], "jurisdiction": []}
+    core_rows = True
+    core_fields = {
+        "openstates_url": lambda row: person_openstates_url(row["name"], row["id"])
+    }
     max_per_page = 50
 
 
@@ -39,8 +55,42 @@ def people_query(db):
     )
 
 
+# how many points /people.geo/batch takes, and how many one unit of cost covers
+GEO_BATCH_MAX_POINTS = 1000
+GEO_POINTS_PER_UNIT = 10
+
+
+def roster_people(db, jurisdiction_ids):
+    """current people of the jurisdictions, with every include, for the roster"""
+    includes = list(PersonInclude)
+    query = people_query(db).filter(
+        models.Person.jurisdiction_id.in_(jurisdiction_ids),
+        models.Person.current_role.isnot(None),
+    )
+    query, plan = PeoplePagination.prepare_query(query, includes, None)
+    query = query.add_columns(
+        models.Person.jurisdiction_id.label("roster_jurisdiction_id"),
+        models.Person.current_role.label("roster_current_role"),
+    )
+    for row in query:
+        yield (
+            row.roster_jurisdiction_id,
+            row.roster_current_role,
+            PeoplePagination.to_obj(row, includes, None, plan),
+        )
+
+
+# current people, in memory (see api/roster.py)
+roster = RosterSnapshot(roster_people)
 router = APIRouter()
-session = requests.Session()
+# not behind admission control as a whole, they wait on divisions.geo first and are
+# admitted for their database step only
+geo_router = APIRouter()
+# divisions.geo, called without blocking the event loop (see api/upstream.py), unless
+# boundaries are loaded locally
+geo_client = UpstreamClient(
+    os.environ.get("GEO_UPSTREAM_URL", "https://v3.openstates.org")
+)
 
 
 @router.get(
@@ -49,7 +99,9 @@ session = requests.Session()
     response_model_exclude_none=True,
     tags=["people"],
 )
-async def people_search(
+@costed(PeoplePagination)
+def people_search(
+    request: Request,
     jurisdiction: Optional[str] = Query(
         None, description="Filter by jurisdiction name or id."
     ),
@@ -70,6 +122,10 @@ async def people_search(
     include: List[PersonInclude] = Query(
         [], description="Additional information to include in response."
     ),
+    fields: List[str] = Query(
+        [],
+        description="Only return these fields (comma separated), includes are unaffected.",
+    ),
     db: SessionLocal = Depends(get_db),
     pagination: PeoplePagination = Depends(),
     auth: str = Depends(apikey_auth),
@@ -80,6 +136,18 @@ async def people_search(
     Must provide either **jurisdiction**, **name**, or one or more **id** parameters.
     """
 
+    if jurisdiction and not name and not id and pagination.cursor is None:
+        # current members of a jurisdiction, served from the roster snapshot
+        roster.refresh(db)
+        jurisdiction_ids = roster.jurisdiction_ids(jurisdiction)
+        conditional = Conditional(request, roster.updated(jurisdiction_ids))
+        if conditional.not_modified:
+            return conditional.not_modified_response()
+        people = roster.people(jurisdiction_ids, org_classification, district)
+        return conditional.apply(
+            pagination.paginate_list(people, includes=include, fields=fields)
+        )
+
     query = people_query(db)
     filtered = False
 
@@ -114,21 +182,37 @@ async def people_search(
     if not filtered:
         raise HTTPException(400, "either 'jurisdiction', 'name', or 'id' is required")
 
-    return pagination.paginate(query, includes=include)
+    conditional = Conditional(
+        request,
+        jurisdiction_watermark(
+            db, models.Jurisdiction.latest_people_update, jurisdiction
+        ),
+    )
+    if conditional.not_modified:
+        return conditional.not_modified_response()
+    return conditional.apply(
+        pagination.paginate(query, includes=include, fields=fields)
+    )
 
 
-@router.get(
+@geo_router.get(
     "/people.geo",
     response_model=PersonList,
     response_model_exclude_none=True,
     tags=["people"],
 )
+@costed(PeoplePagination)
 async def people_geo(
+    request: Request,
     lat: float = Query(..., description="Latitude of point."),
     lng: float = Query(..., description="Longitude of point."),
     include: List[PersonInclude] = Query(
         [], description="Additional information to include in the response."
     ),
+    fields: List[str] = Query(
+        [],
+        description="Only return these fields (comma separated), includes are unaffected.",
+    ),
     db: SessionLocal = Depends(get_db),
     auth: str = Depends(apikey_auth),
 ):
@@ -137,22 +221,150 @@ async def people_geo(
 
     **Note:** Currently limited to state legislators and US Congress.  Governors & mayors are not included.
     """
-    url = f"https://v3.openstates.org/divisions.geo?lat={lat}&lng={lng}"
-    try:
-        data = session.get(url).json()
-    except Exception as e:
-        raise HTTPException(500, f"Failed to retrieve data from Geo endpoint :: {e}")
+    if divisions.resolver is not None:
+        # point-in-polygon tests are CPU-bound, they run in the threadpool below
+        division_ids = None
+    else:
+        division_ids = await upstream_division_ids(lat, lng)
+
+    # the session is synchronous, so the rest runs in the threadpool
+    async with admitted(request):
+        return await run_in_threadpool(
+            people_in_divisions, db, lat, lng, division_ids, include, fields
+        )
+
+
+@geo_router.post(
+    "/people.geo/batch",
+    response_model=PeopleGeoBatch,
+    response_model_exclude_none=True,
+    tags=["people"],
+)
+@costed(PeoplePagination, rows=GEO_POINTS_PER_UNIT)
+async def people_geo_batch(
+    request: Request,
+    points: conlist(GeoPoint, min_items=1, max_items=GEO_BATCH_MAX_POINTS) = Body(
+        ..., embed=True, description="Locations to look up."
+    ),
+    include: List[PersonInclude] = Query(
+        [], description="Additional information to include in the response."
+    ),
+    fields: List[str] = Query(
+        [],
+        description="Only return these fields (comma separated), includes are unaffected.",
+    ),
+    db: SessionLocal = Depends(get_db),
+    auth: str = Depends(apikey_auth),
+):
+    """
+    Get lists of people currently representing each of up to 1000 locations, like
+    /people.geo for each of them.
+    """
+    # the route's cost covers GEO_POINTS_PER_UNIT points
+    charge_extra(request, math.ceil(len(points) / GEO_POINTS_PER_UNIT) - 1)
+
+    if divisions.resolver is not None:
+        # point-in-polygon tests are CPU-bound, they run in the threadpool below
+        point_divisions = None
+    else:
+        distinct = list({(point.lat, point.lng) for point in points})
+        # bounded together with other batches' lookups, to the upstream client's pool
+        slots = geo_client.slots()
+
+        async def lookup(lat, lng):
+            async with slots:
+                return await upstream_division_ids(lat, lng)
+
+        found = await asyncio.gather(*(lookup(lat, lng) for lat, lng in distinct))
+        point_divisions = dict(zip(distinct, found))
+    async with admitted(request):
+        return await run_in_threadpool(
+            people_by_point, db, points, point_divisions, include, fields
+        )
+
+
+def local_division_ids(lat: float, lng: float) -> List[str]:
+    """ids of the divisions containing the point, from the loaded boundaries"""
+    return division_ids_with_state(divisions.lookup(lat, lng))
+
+
+async def upstream_division_ids(lat: float, lng: float) -> List[str]:
+    """ids of the divisions containing the point, from the divisions.geo service"""
+    found = divisions.geo_cache.get(lat, lng)
+    if found is None:
+        found = await upstream_divisions(lat, lng)
+        divisions.geo_cache.set(lat, lng, found)
+    return division_ids_with_state(found)
+
+
+def division_ids_with_state(found) -> List[str]:
+    """ids of the divisions, and their state's division"""
+    division_ids = [d["id"] for d in found]
+    if found:
+        division_ids.append(add_state_divisions(found[0]["state"]))
+    return division_ids
+
+
+async def upstream_divisions(lat: float, lng: float):
     try:
-        divisions = [d["id"] for d in data["divisions"]]
-        if len(data["divisions"]) > 0:
-            divisions.append(add_state_divisions(data["divisions"][0]["state"]))
-    except KeyError:
+        data = await geo_client.get_json("/divisions.geo", {"lat": lat, "lng": lng})
+    except CircuitOpen as e:
+        raise HTTPException(
+            503,
+            "Geo endpoint is unavailable, try again shortly.",
+            headers={"Retry-After": str(math.ceil(e.retry_after))},
+        )
+    except UpstreamBusy:
+        raise HTTPException(
+            503,
+            "Too many Geo lookups in progress, try again shortly.",
+            headers={"Retry-After": "1"},
+        )
+    except UpstreamError as e:
+        raise HTTPException(502, f"Failed to retrieve data from Geo endpoint :: {e}")
+    # checked before it is cached
+    found = data.get("divisions") if isinstance(data, dict) else None
+    if found is None or not all("id" in d and "state" in d for d in found):
         raise HTTPException(
             500, "unexpected upstream response, try again in 60 seconds"
         )
+    return found
+
+
+def people_by_point(db, points, point_divisions, include, fields):
+    """point_divisions are looked up in the loaded boundaries when None"""
+    if point_divisions is None:
+        point_divisions = {
+            (lat, lng): local_division_ids(lat, lng)
+            for lat, lng in {(point.lat, point.lng) for point in points}
+        }
+    roster.refresh(db)
+    names = set(
+        PeoplePagination.output_fields(PeoplePagination.parse_fields(fields), include)
+    )
+    results = []
+    for point in points:
+        people = roster.in_divisions(point_divisions[(point.lat, point.lng)])
+        results.append(
+            {
+                "lat": point.lat,
+                "lng": point.lng,
+                "results": [
+                    {name: value for name, value in person.items() if name in names}
+                    for person in people
+                ],
+            }
+        )
+    return PeoplePagination.response({"results": results})
+
+
+def people_in_divisions(db, lat, lng, division_ids, include, fields):
+    """division_ids are looked up in the loaded boundaries when None"""
+    if division_ids is None:
+        division_ids = local_division_ids(lat, lng)
 
     # skip the rest of the logic if there are no divisions
-    if not divisions:
+    if not division_ids:
         return {
             "pagination": PaginationMeta(
                 total_items=0, per_page=100, page=1, max_page=1
@@ -160,9 +372,9 @@ async def people_geo(
             "results": [],
         }
 
-    query = people_query(db).filter(
-        models.Person.current_role["division_id"].astext.in_(divisions)
-    )
-    # paginate without looking for page= params
+    roster.refresh(db)
+    # one page, without looking for page= params
     pagination = PeoplePagination()
-    return pagination.paginate(query, includes=include, skip_count=True)
+    return pagination.paginate_list(
+        roster.in_divisions(division_ids), includes=include, fields=fields
+    )
@@ -0,0 +1,210 @@
+"""
+Rate limiting that checks locally and syncs counts to Redis in batches.
+
+rrl's RateLimiter makes a Redis round trip for every request.  HybridRateLimiter
+wraps one (for its tiers, key prefix and connection) and keeps a counter per key and
+limit window in each worker instead:
+
+    - each counter knows the fleet-wide count as of its last sync (known), plus the
+      requests this worker has seen since (pending)
+    - a background thread sends the pending counts to Redis every sync_interval
+      seconds, in one pipeline, and reads back the new fleet-wide totals
+    - once known + pending gets within near_limit of a limit, the key is checked
+      against Redis directly, so limits stay exact where they matter
+
+Counters are written under the same Redis keys rrl uses, so usage reports built on
+RateLimiter.get_usage_since keep working.
+"""
+import datetime
+import threading
+from typing import Optional
+from rrl import RateLimiter, RateLimitExceeded
+from .background import BackgroundFlusher
+
+
+class _Window:
+    __slots__ = ("redis_key", "start", "length", "limit", "unit", "expire")
+
+    def __init__(self, redis_key, start, length, limit, unit, expire):
+        self.redis_key = redis_key
+        self.start = start
+        self.length = length
+        self.limit = limit
+        self.unit = unit
+        self.expire = expire
+
+
+class _Counter:
+    __slots__ = ("known", "pending", "window")
+
+    def __init__(self, window: _Window):
+        self.known = 0
+        self.pending = 0
+        self.window = window
+
+
+class HybridRateLimiter(BackgroundFlusher):
+    thread_name = "ratelimit-sync"
+
+    def __init__(
+        self,
+        limiter: RateLimiter,
+        *,
+        sync_interval: Optional[float] = 0.25,
+        near_limit: float = 0.9,
+        clock=datetime.datetime.utcnow,
+    ):
+        """
+        sync_interval=None disables the background thread, flush() must be called
+        """
+        super().__init__(sync_interval)
+        self.limiter = limiter
+        self.near_limit = near_limit
+        self.clock = clock
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    @property
+    def redis(self):
+        return self.limiter.redis
+
+    def check_limit(self, key: str, tier_name: str, cost: int = 1) -> bool:
+        """
+        charge cost units to key, raises RateLimitExceeded if that puts it over one of
+        its tier's limits, or ValueError if the tier doesn't exist (like rrl)
+        """
+        try:
+            tier = self.limiter.tiers[tier_name]
+        except KeyError:
+            raise ValueError(f"unknown tier: {tier_name}")
+        self._ensure_started()
+
+        windows = self._windows(key, tier, self.clock())
+        with self._lock:
+            counters = [self._counter(window) for window in windows]
+            # Redis already said the key reached one of its limits this window
+            over = [c for c in counters if c.window.limit and c.known >= c.window.limit]
+            near = any(
+                c.window.limit
+                and c.known + c.pending + cost > c.window.limit * self.near_limit
+                for c in counters
+            )
+            if over or not near:
+                # known to be over the limit already, or far enough from it
+                for counter in counters:
+                    counter.pending += cost
+            if over:
+                raise _exceeded(over[0].window, over[0].known + over[0].pending)
+            if not near:
+                return True
+            # close to a limit, check with Redis, sending along what's pending
+            batch = self._take_pending(counters, cost)
+
+        totals = self._send(batch)
+        for counter, total in zip(counters, totals):
+            if counter.window.limit and total > counter.window.limit:
+                raise _exceeded(counter.window, total)
+        return True
+
+    def flush(self):
+        """send all pending counts to Redis"""
+        with self._lock:
+            batch = self._take_pending(
+                [c for c in self._counters.values() if c.pending], 0
+            )
+            self._drop_expired()
+        if batch:
+            self._send(batch)
+
+    def _windows(self, key, tier, now):
+        prefix = f"{self.limiter.prefix}:{key}"
+        windows = []
+        if tier.per_minute:
+            windows.append(
+                _Window(
+                    f"{prefix}:m{now.minute}",
+                    now.replace(second=0, microsecond=0),
+                    datetime.timedelta(minutes=1),
+                    tier.per_minute,
+                    "min",
+                    60,
+                )
+            )
+        if tier.per_hour:
+            windows.append(
+                _Window(
+                    f"{prefix}:h{now.hour}",
+                    now.replace(minute=0, second=0, microsecond=0),
+                    datetime.timedelta(hours=1),
+                    tier.per_hour,
+                    "hour",
+                    3600,
+                )
+            )
+        if tier.per_day or self.limiter.track_daily_usage:
+            windows.append(
+                _Window(
+                    f"{prefix}:d{now.strftime('%Y%m%d')}",
+                    now.replace(hour=0, minute=0, second=0, microsecond=0),
+                    datetime.timedelta(days=1),
+                    tier.per_day,
+                    "day",
+                    # kept for usage tracking
+                    None if self.limiter.track_daily_usage else 86400,
+                )
+            )
+        return windows
+
+    def _counter(self, window):
+        # the start is part of the key, rrl reuses minute & hour keys once they expire
+        counter = self._counters.get((window.redis_key, window.start))
+        if counter is None:
+            counter = self._counters[(window.redis_key, window.start)] = _Counter(
+                window
+            )
+        return counter
+
+    def _take_pending(self, counters, cost):
+        batch = [(counter, counter.pending + cost) for counter in counters]
+        for counter in counters:
+            counter.pending = 0
+        return batch
+
+    def _send(self, batch):
+        """add each (counter, amount) to Redis, returns the new totals"""
+        try:
+            pipe = self.redis.pipeline()
+            for counter, amount in batch:
+                pipe.incrby(counter.window.redis_key, amount)
+                if counter.window.expire:
+                    pipe.expire(counter.window.redis_key, counter.window.expire)
+            results = pipe.execute()
+        except Exception:
+            # keep the counts to send next time
+            with self._lock:
+                for counter, amount in batch:
+                    counter.pending += amount
+            raise
+
+        totals = []
+        position = 0
+        with self._lock:
+            for counter, amount in batch:
+                total = results[position]
+                position += 2 if counter.window.expire else 1
+                counter.known = max(counter.known, total)
+                totals.append(total)
+        return totals
+
+    def _drop_expired(self):
+        now = self.clock()
+        for key, counter in list(self._counters.items()):
+            if (
+                not counter.pending
+                and counter.window.start + counter.window.length <= now
+            ):
+                del self._counters[key]
+
+
+def _exceeded(window, count):
+    return RateLimitExceeded(f"exceeded limit of {window.limit}/{window.unit}: {count}")
@@ -0,0 +1,227 @@
+"""
+In-memory snapshot of current legislators.
+
+There are under 10k people with a current role nationwide and they change rarely, so
+rather than running JSONB filters on Person.current_role (and loading includes) for
+every /people?jurisdiction= and /people.geo request, each worker keeps them all in
+memory, serialized with every include, and indexed by jurisdiction, division, chamber
+and district.
+
+Each request checks the snapshot against Jurisdiction.latest_people_update with one
+small query, and the people of the jurisdictions that changed are loaded again.
+"""
+import json
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+from openstates.metadata import lookup
+from .db import models
+
+
+class _Entry:
+    __slots__ = ("id", "jurisdiction_id", "division_id", "chamber", "district", "data")
+
+    def __init__(self, jurisdiction_id: str, current_role: dict, data: dict):
+        self.id = data["id"]
+        self.jurisdiction_id = jurisdiction_id
+        self.division_id = current_role.get("division_id")
+        self.chamber = current_role.get("org_classification")
+        self.district = _astext(current_role.get("district"))
+        # the serialized person, with every field & include
+        self.data = data
+
+
+def _astext(value) -> Optional[str]:
+    """a JSON value as Postgres' ->> would return it"""
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+
+class Roster:
+    """current people of a jurisdiction, as of updated"""
+
+    def __init__(self, updated, entries: List[_Entry]):
+        self.updated = updated
+        self.entries = entries
+        self.by_chamber = defaultdict(list)
+        self.by_district = defaultdict(list)
+        for entry in entries:
+            self.by_chamber[entry.chamber].append(entry)
+            self.by_district[entry.district].append(entry)
+
+    def select(
+        self, chamber: Optional[str] = None, district: Optional[str] = None
+    ) -> List[_Entry]:
+        if district is not None:
+            entries = self.by_district.get(district, [])
+            if chamber is not None:
+                entries = [entry for entry in entries if entry.chamber == chamber]
+            return entries
+        if chamber is not None:
+            return self.by_chamber.get(chamber, [])
+        return self.entries
+
+
+class _State(NamedTuple):
+    # jurisdiction id -> (name, classification)
+    jurisdictions: Dict[str, Tuple[str, str]]
+    rosters: Dict[str, Roster]
+    by_division: Dict[str, List[_Entry]]
+    # person id -> position in name order, across jurisdictions
+    rank: Dict[str, int]
+
+
+class RosterSnapshot:
+    """
+    load(db, jurisdiction_ids) yields (jurisdiction_id, current_role, serialized
+    person) for the current people of the jurisdictions.
+
+    refresh() must be called (from any thread) before reading, readers get a
+    consistent state without locking as it is replaced in one assignment, the lock
+    only keeps two requests from reloading at once.
+    """
+
+    def __init__(self, load: Callable[..., Iterable[Tuple[str, dict, dict]]]):
+        self.load = load
+        self._state = _State({}, {}, {}, {})
+        self._lock = threading.Lock()
+
+    def refresh(self, db):
+        """reload the people of jurisdictions updated since they were loaded"""
+        # checked without the lock, so requests only wait for each other to reload
+        if not self._changed(self._state, self._jurisdictions(db)):
+            return
+        # while another request reloads, the current snapshot is served, unless
+        # there isn't one yet
+        if not self._lock.acquire(blocking=not self._state.rosters):
+            return
+        try:
+            self._reload(db)
+        finally:
+            self._lock.release()
+
+    def _jurisdictions(self, db):
+        return db.query(
+            models.Jurisdiction.id,
+            models.Jurisdiction.name,
+            models.Jurisdiction.classification,
+            models.Jurisdiction.latest_people_update,
+        ).all()
+
+    @staticmethod
+    def _changed(state: _State, rows) -> bool:
+        return len(rows) != len(state.rosters) or any(
+            row.id not in state.rosters
+            or state.rosters[row.id].updated != row.latest_people_update
+            or state.jurisdictions.get(row.id) != (row.name, row.classification)
+            for row in rows
+        )
+
+    def _reload(self, db):
+        # read again, another request may have reloaded since the check
+        state = self._state
+        rows = self._jurisdictions(db)
+        updated = {row.id: row.latest_people_update for row in rows}
+        stale = [
+            jid
+            for jid, when in updated.items()
+            if jid not in state.rosters or state.rosters[jid].updated != when
+        ]
+        jurisdictions = {row.id: (row.name, row.classification) for row in rows}
+        if not stale and set(state.rosters) == set(updated):
+            if jurisdictions != state.jurisdictions:
+                self._state = state._replace(jurisdictions=jurisdictions)
+            return
+
+        loaded = defaultdict(list)
+        for jid, current_role, data in self.load(db, stale):
+            loaded[jid].append(_Entry(jid, current_role or {}, data))
+        rank = self._rank(db)
+        rosters = {
+            jid: roster
+            for jid, roster in state.rosters.items()
+            if jid in updated and jid not in stale
+        }
+        for jid in stale:
+            entries = sorted(loaded[jid], key=lambda entry: _position(rank, entry))
+            rosters[jid] = Roster(updated[jid], entries)
+
+        by_division = defaultdict(list)
+        for roster in rosters.values():
+            for entry in roster.entries:
+                by_division[entry.division_id].append(entry)
+        self._state = _State(jurisdictions, rosters, dict(by_division), rank)
+
+    def _rank(self, db) -> Dict[str, int]:
+        # the order of people_query, which the database's collation decides
+        ids = (
+            db.query(models.Person.id)
+            .join(models.Person.jurisdiction)
+            .filter(models.Person.current_role.isnot(None))
+            .order_by(models.Person.name)
+        )
+        return {person_id: position for position, (person_id,) in enumerate(ids)}
+
+    def jurisdiction_ids(self, jurisdiction: str) -> List[str]:
+        """jurisdictions matching a name/abbr/ID as accepted by the API"""
+        jurisdictions = self._state.jurisdictions
+        if not jurisdiction:
+            return []
+        if len(jurisdiction) == 2:
+            try:
+                jid = lookup(abbr=jurisdiction).jurisdiction_id
+                return [jid] if jid in jurisdictions else []
+            except KeyError:
+                pass
+        elif jurisdiction.startswith("ocd-jurisdiction"):
+            return [jurisdiction] if jurisdiction in jurisdictions else []
+        return [
+            jid
+            for jid, (name, classification) in jurisdictions.items()
+            if name == jurisdiction and classification == "state"
+        ]
+
+    def updated(self, jurisdiction_ids: List[str]):
+        """latest people update among the jurisdictions, like jurisdiction_watermark"""
+        rosters = self._state.rosters
+        times = [
+            rosters[jid].updated
+            for jid in jurisdiction_ids
+            if jid in rosters and rosters[jid].updated is not None
+        ]
+        return max(times, default=None)
+
+    def people(
+        self,
+        jurisdiction_ids: List[str],
+        chamber: Optional[str] = None,
+        district: Optional[str] = None,
+    ) -> List[dict]:
+        """serialized current people of the jurisdictions, in name order"""
+        state = self._state
+        entries = [
+            entry
+            for jid in jurisdiction_ids
+            if jid in state.rosters
+            for entry in state.rosters[jid].select(chamber, district)
+        ]
+        if len(jurisdiction_ids) > 1:
+            entries.sort(key=lambda entry: _position(state.rank, entry))
+        return [entry.data for entry in entries]
+
+    def in_divisions(self, division_ids: Iterable[str]) -> List[dict]:
+        """serialized current people whose role is in one of the divisions, in name order"""
+        state = self._state
+        entries = [
+            entry
+            for division_id in set(division_ids)
+            for entry in state.by_division.get(division_id, [])
+        ]
+        entries.sort(key=lambda entry: _position(state.rank, entry))
+        return [entry.data for entry in entries]
+
+
+def _position(rank, entry) -> int:
+    # people added after they were loaded go last until the next reload
+    return rank.get(entry.id, len(rank))
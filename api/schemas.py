@@ -213,6 +213,19 @@ class Person(CompactPerson):
         orm_mode = True
 
 
+class GeoPoint(BaseModel):
+    lat: float = Field(..., example=41.5)
+    lng: float = Field(..., example=-100.0)
+
+
+class PeopleGeoResult(GeoPoint):
+    results: List[Person]
+
+
+class PeopleGeoBatch(BaseModel):
+    results: List[PeopleGeoResult]
+
+
 class RelatedBill(BaseModel):
     identifier: str = Field(..., example="HB 123")
     legislative_session: str = Field(..., example="2022S1")
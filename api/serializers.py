@@ -0,0 +1,134 @@
+"""
+Serializers turn ORM objects, or dicts already shaped like a schema (Core rows, JSON
+includes), straight into JSON-ready dicts for a Pydantic schema.
+
+Data from the database already has the right types, so rather than validating it with
+from_orm (and then letting FastAPI validate it again against the response_model) each
+schema gets an encoder per field, built once and cached by (schema, field names).
+
+The output matches what the response_model + response_model_exclude_none=True would
+produce: nulls fall back to the field's default, and are left out if that is None too.
+"""
+import copy
+import datetime
+from collections.abc import Mapping
+from enum import Enum
+from functools import lru_cache
+from typing import Optional, FrozenSet
+from uuid import UUID
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from pydantic.datetime_parse import parse_datetime, parse_date
+from pydantic.fields import SHAPE_SINGLETON, SHAPE_LIST
+
+
+class Serializer:
+    def __init__(self, schema, names: Optional[FrozenSet[str]] = None):
+        self.schema = schema
+        # name -> (encoder or None for values used as-is, default)
+        self.fields = {
+            name: (_field_encoder(field), field.default)
+            for name, field in schema.__fields__.items()
+            if names is None or name in names
+        }
+
+    def __call__(self, obj, overrides=None):
+        """
+        serialize obj, an ORM object or a mapping (like a row), overrides are values
+        to use instead of the ones on obj
+        """
+        get = obj.get if isinstance(obj, Mapping) else obj.__getattribute__
+        data = {}
+        for name, (encode, default) in self.fields.items():
+            if overrides is not None and name in overrides:
+                value = overrides[name]
+            else:
+                try:
+                    value = get(name)
+                except AttributeError:
+                    value = None
+            if value is None:
+                if default is None:
+                    continue
+                value = copy.copy(default)
+            elif encode is not None:
+                value = encode(value)
+            data[name] = value
+        return data
+
+    def encode(self, name, value):
+        """serialize a single field's value"""
+        encode, default = self.fields[name]
+        if value is None:
+            return copy.copy(default)
+        return encode(value) if encode is not None else value
+
+
+@lru_cache(maxsize=512)
+def serializer(schema, names: Optional[FrozenSet[str]] = None):
+    """the cached Serializer for (schema, names), names=None for all fields"""
+    return Serializer(schema, names)
+
+
+def _field_encoder(field):
+    if field.shape == SHAPE_SINGLETON:
+        return _type_encoder(field)
+    if field.shape == SHAPE_LIST and not field.sub_fields[0].sub_fields:
+        encode = _type_encoder(field.sub_fields[0])
+        if encode is None:
+            return list
+        return lambda values: [encode(value) for value in values]
+    return _validate_encoder(field)
+
+
+def _type_encoder(field):
+    type_ = field.type_
+    if field.sub_fields:
+        # Unions and the like, rare enough to just let Pydantic do the work
+        return _validate_encoder(field)
+    if isinstance(type_, type):
+        if issubclass(type_, BaseModel):
+            return serializer(type_)
+        if issubclass(type_, Enum):
+            return _encode_enum
+        if issubclass(type_, datetime.datetime):
+            return _encode_datetime
+        if issubclass(type_, datetime.date):
+            return _encode_date
+        if type_ is str:
+            return _encode_str
+        if issubclass(type_, UUID):
+            return str
+    return None
+
+
+def _validate_encoder(field):
+    def encode(value):
+        value, errors = field.validate(value, {}, loc=field.name)
+        if errors:
+            raise ValueError(f"invalid value for {field.name}: {errors}")
+        return jsonable_encoder(value, exclude_none=True)
+
+    return encode
+
+
+def _encode_enum(value):
+    return value.value if isinstance(value, Enum) else value
+
+
+def _encode_datetime(value):
+    # JSON from Postgres has datetimes as strings, normalize to Python's isoformat
+    if isinstance(value, str):
+        value = parse_datetime(value)
+    return value.isoformat()
+
+
+def _encode_date(value):
+    if isinstance(value, str):
+        value = parse_date(value)
+    return value.isoformat()
+
+
+def _encode_str(value):
+    # Pydantic coerces numbers to str
+    return value if isinstance(value, str) else str(value)
@@ -6,6 +6,7 @@ from sqlalchemy_utils.functions import database_exists, drop_database, create_da
 from sqlalchemy.exc import OperationalError
 from fastapi.testclient import TestClient
 from api.main import app
+from api.people import roster
 from api.auth import apikey_auth
 from api.db import Base, get_db
 from . import fixtures
@@ -20,12 +21,15 @@ TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engin
 class QueryLogger:
     def __init__(self):
         self.count = 0
+        self.statements = []
 
     def reset(self):
         self.count = 0
+        self.statements = []
 
     def callback(self, conn, cursor, statement, parameters, context, executemany):
         self.count += 1
+        self.statements.append(statement)
         print(f"==== QUERY #{self.count} ====\n", statement, parameters)
 
 
@@ -70,6 +74,9 @@ def common_data(create_test_database):
     for obj in fixtures.mentor():
         db.add(obj)
     db.commit()
+    # loaded up front, so query counts don't depend on which test runs first
+    roster.refresh(db)
+    db.close()
 
 
 @pytest.fixture
@@ -0,0 +1,95 @@
+class FakeRedis:
+    """just enough of redis.Redis for the rate limiter, in memory"""
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        self.calls = 0
+        self.subscribers = []
+
+    def incrby(self, key, amount=1):
+        self.data[key] = int(self.data.get(key, 0)) + amount
+        return self.data[key]
+
+    def incr(self, key):
+        return self.incrby(key)
+
+    def expire(self, key, seconds):
+        self.expires[key] = seconds
+        return True
+
+    def hincrby(self, key, field, amount=1):
+        hash = self.data.setdefault(key, {})
+        hash[field] = hash.get(field, 0) + amount
+        return hash[field]
+
+    def hgetall(self, key):
+        return {
+            field.encode(): str(value).encode()
+            for field, value in self.data.get(key, {}).items()
+        }
+
+    def get(self, key):
+        value = self.data.get(key)
+        return None if value is None else str(value).encode()
+
+    def mget(self, keys):
+        return [self.get(key) for key in keys]
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def pubsub(self):
+        return FakePubSub(self)
+
+    def publish(self, channel, message):
+        subscribers = [s for s in self.subscribers if channel in s.channels]
+        for subscriber in subscribers:
+            subscriber.messages.append(
+                {
+                    "type": "message",
+                    "channel": channel.encode(),
+                    "data": message.encode(),
+                }
+            )
+        return len(subscribers)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def command(*args):
+            self.commands.append((name, args))
+            return self
+
+        return command
+
+    def execute(self):
+        self.redis.calls += 1
+        results = [getattr(self.redis, name)(*args) for name, args in self.commands]
+        self.commands = []
+        return results
+
+
+class FakePubSub:
+    def __init__(self, redis):
+        self.redis = redis
+        self.channels = set()
+        self.messages = []
+
+    def subscribe(self, channel):
+        self.channels.add(channel)
+        self.redis.subscribers.append(self)
+        self.messages.append(
+            {"type": "subscribe", "channel": channel.encode(), "data": 1}
+        )
+
+    def get_message(self):
+        return self.messages.pop(0) if self.messages else None
+
+    def close(self):
+        self.channels = set()
+        self.redis.subscribers.remove(self)
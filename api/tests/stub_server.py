@@ -0,0 +1,64 @@
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubServer:
+    """
+    HTTP server on a local port, answering every GET with the next queued response
+    (or the last one, once the queue is down to one), recording request paths.
+
+    Responses are (status, body, delay): body is encoded as JSON unless it is bytes,
+    delay is how many seconds to wait before answering.
+    """
+
+    def __init__(self):
+        self.responses = []
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests.append(self.path)
+                status, body, delay = stub._next_response()
+                time.sleep(delay)
+                if not isinstance(body, bytes):
+                    body = json.dumps(body).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except ConnectionError:
+                    # the client gave up waiting
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, args=(0.05,), daemon=True
+        )
+        self._thread.start()
+
+    def respond(self, *responses):
+        """queue (status, body) or (status, body, delay) responses"""
+        with self._lock:
+            self.responses = [(r + (0,))[:3] for r in responses]
+            self.requests = []
+
+    def _next_response(self):
+        with self._lock:
+            if len(self.responses) > 1:
+                return self.responses.pop(0)
+            return self.responses[0]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,278 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from api import admission
+from prometheus_client import REGISTRY
+from sqlalchemy import event
+from api.admission import AdmissionController, AIMDLimit
+from .conftest import engine
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_admission_within_limit():
+    async def main():
+        controller = AdmissionController(limit=2, max_queue=0, max_wait=1)
+        await controller.acquire()
+        await controller.acquire()
+        assert controller.active == 2
+        controller.release()
+        controller.release()
+        assert controller.active == 0
+
+    run(main())
+
+
+def test_admission_queue_full():
+    async def main():
+        controller = AdmissionController(limit=1, max_queue=0, max_wait=3)
+        await controller.acquire()
+        with pytest.raises(HTTPException) as e:
+            await controller.acquire()
+        assert e.value.status_code == 503
+        assert e.value.headers == {"Retry-After": "3"}
+
+    run(main())
+
+
+def test_admission_waiter_gets_released_slot():
+    async def main():
+        controller = AdmissionController(limit=1, max_queue=2, max_wait=1)
+        order = []
+        await controller.acquire()
+
+        async def waiter(n):
+            await controller.acquire()
+            order.append(n)
+
+        tasks = [asyncio.create_task(waiter(n)) for n in range(2)]
+        await asyncio.sleep(0)
+        assert controller.queued == 2
+        controller.release()
+        await asyncio.sleep(0)
+        controller.release()
+        await asyncio.gather(*tasks)
+        # first come, first served, and the slot is handed over rather than freed
+        assert order == [0, 1]
+        assert controller.active == 1
+        assert controller.queued == 0
+
+    run(main())
+
+
+def test_admission_wait_timeout():
+    async def main():
+        controller = AdmissionController(limit=1, max_queue=1, max_wait=0.01)
+        await controller.acquire()
+        with pytest.raises(HTTPException) as e:
+            await controller.acquire()
+        assert e.value.status_code == 503
+        assert controller.queued == 0
+        controller.release()
+        assert controller.active == 0
+
+    run(main())
+
+
+def test_admission_cancelled_waiter():
+    async def main():
+        controller = AdmissionController(limit=1, max_queue=1, max_wait=1)
+        await controller.acquire()
+        task = asyncio.create_task(controller.acquire())
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert controller.queued == 0
+        controller.release()
+        assert controller.active == 0
+
+    run(main())
+
+
+def test_admission_weighted_fair_queuing():
+    async def main():
+        controller = AdmissionController(
+            limit=1, max_queue=10, max_wait=1, weights={"low": 1, "high": 3}
+        )
+        order = []
+        await controller.acquire("low")
+
+        async def waiter(tier):
+            await controller.acquire(tier)
+            order.append(tier)
+
+        tasks = [asyncio.create_task(waiter(tier)) for tier in ["low"] * 3]
+        tasks += [asyncio.create_task(waiter(tier)) for tier in ["high"] * 3]
+        await asyncio.sleep(0)
+        for _ in tasks:
+            controller.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        # high gets three slots for each of low's, but low isn't starved
+        assert order == ["high", "low", "high", "high", "low", "low"]
+
+    run(main())
+
+
+def test_admission_sheds_lower_tiers_first():
+    async def main():
+        controller = AdmissionController(
+            limit=1, max_queue=1, max_wait=1, weights={"low": 1, "high": 3}
+        )
+        await controller.acquire("high")
+        low = asyncio.create_task(controller.acquire("low"))
+        await asyncio.sleep(0)
+        high = asyncio.create_task(controller.acquire("high"))
+        await asyncio.sleep(0)
+        # the low tier request made room for the high tier one
+        with pytest.raises(HTTPException) as e:
+            await low
+        assert e.value.status_code == 503
+        controller.release()
+        await high
+        assert controller.active == 1
+
+        # but not the other way around
+        waiting = asyncio.create_task(controller.acquire("high"))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException):
+            await controller.acquire("low")
+        controller.release()
+        await waiting
+
+    run(main())
+
+
+def test_admission_shed_skips_finished_waiters():
+    async def main():
+        controller = AdmissionController(
+            limit=1, max_queue=1, max_wait=1, weights={"low": 1, "high": 3}
+        )
+        await controller.acquire("high")
+        low = asyncio.create_task(controller.acquire("low"))
+        await asyncio.sleep(0)
+        # low's wait is over (e.g. timed out) but it hasn't left the queue yet
+        controller._queues["low"][0].cancel()
+        high = asyncio.create_task(controller.acquire("high"))
+        await asyncio.sleep(0)
+        with pytest.raises(asyncio.CancelledError):
+            await low
+        # nothing to shed, the high tier request is queued
+        assert controller.queued == 1
+        controller.release()
+        await high
+        assert controller.active == 1
+
+    run(main())
+
+
+def test_admission_tier_metrics():
+    async def main():
+        controller = AdmissionController(
+            limit=2, max_queue=1, max_wait=1, weights={"metrics": 1, "other": 2}
+        )
+        await controller.acquire("other")
+        # unknown tiers (or none, without a key) are treated as the lowest
+        await controller.acquire("unknown")
+        assert controller.active == 2
+
+    run(main())
+    for tier in ("metrics", "other"):
+        assert (
+            REGISTRY.get_sample_value("admission_wait_seconds_count", {"tier": tier})
+            == 1
+        )
+
+
+def test_admission_raised_limit_admits_waiters():
+    async def main():
+        controller = AdmissionController(limit=1, max_queue=3, max_wait=1)
+        await controller.acquire()
+        tasks = [asyncio.create_task(controller.acquire()) for n in range(3)]
+        await asyncio.sleep(0)
+        controller.limit = 3
+        controller.release()
+        await asyncio.sleep(0)
+        assert controller.active == 3
+        assert controller.queued == 0
+        # and a lowered one admits no one until enough slots are released
+        controller.limit = 1
+        controller.release()
+        controller.release()
+        assert controller.active == 1
+        await asyncio.gather(*tasks[:2])
+        tasks[2].cancel()
+
+    run(main())
+
+
+def aimd(limit=10, **kwargs):
+    controller = AdmissionController(limit=limit, max_queue=0, max_wait=1)
+    return controller, AIMDLimit(controller, window=4, **kwargs)
+
+
+def sample(adaptive, seconds, windows=1):
+    for _ in range(windows * adaptive.window):
+        adaptive.sample(seconds)
+
+
+def test_aimd_limit_stays_within_bounds():
+    controller, adaptive = aimd(min_limit=3)
+    sample(adaptive, 0.01, windows=5)
+    assert controller.limit == 10
+    sample(adaptive, 1, windows=10)
+    assert controller.limit == 3
+    assert REGISTRY.get_sample_value("admission_limit") == 3
+
+
+def test_aimd_limit_decreases_multiplicatively():
+    controller, adaptive = aimd()
+    sample(adaptive, 0.01)
+    sample(adaptive, 0.05)
+    assert controller.limit == 7
+    sample(adaptive, 0.05)
+    assert controller.limit == 5
+
+
+def test_aimd_limit_increases_additively():
+    controller, adaptive = aimd(min_limit=2)
+    sample(adaptive, 0.01)
+    sample(adaptive, 0.1, windows=5)
+    assert controller.limit == 2
+    sample(adaptive, 0.01, windows=3)
+    assert controller.limit == 5
+
+
+def test_aimd_limit_ignores_outliers():
+    controller, adaptive = aimd()
+    sample(adaptive, 0.01)
+    controller.limit = 5
+    # the median of a window decides, a single slow query doesn't
+    for seconds in (0.01, 0.01, 0.01, 5):
+        adaptive.sample(seconds)
+    assert controller.limit == 6
+
+
+def test_aimd_limit_samples_queries(client, monkeypatch):
+    samples = []
+    monkeypatch.setattr(admission.adaptive_limit, "sample", samples.append)
+    admission.track_query_latency(engine)
+    try:
+        client.get("/jurisdictions/ne")
+    finally:
+        event.remove(engine, "before_cursor_execute", admission._query_started)
+        event.remove(engine, "after_cursor_execute", admission._query_finished)
+    assert samples and all(seconds >= 0 for seconds in samples)
+
+
+def test_admission_rejects_requests(client, monkeypatch):
+    monkeypatch.setattr(admission.controller, "limit", 0)
+    monkeypatch.setattr(admission.controller, "max_queue", 0)
+    response = client.get("/bills?jurisdiction=ne")
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == str(admission.controller.retry_after)
+    # non-database routes aren't affected
+    assert client.get("/healthz").status_code == 200
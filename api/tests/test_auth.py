@@ -0,0 +1,314 @@
+import uuid
+import base64
+import pytest
+from fastapi import HTTPException, Request
+from rrl import RateLimitExceeded
+from api import auth
+from api.auth import (
+    apikey_auth,
+    charge_extra,
+    invalid_apikey_cache,
+    failed_auth_cache,
+    invalidate_apikey,
+    APIKEY_INVALIDATION_CHANNEL,
+)
+from api.db import models
+from api.usage import UsageRecorder
+from api.invalidation import InvalidationListener
+from api.tokens import TokenSigner
+from .fake_redis import FakeRedis
+from .conftest import TestingSessionLocal, engine, get_test_db, query_logger
+
+
+@pytest.fixture
+def profile(monkeypatch):
+    checked = []
+    monkeypatch.setattr(
+        auth.limiter,
+        "check_limit",
+        lambda key, tier, cost=1: checked.append((key, tier)) or True,
+    )
+    monkeypatch.setattr(
+        auth, "usage", UsageRecorder(FakeRedis(), prefix="v3", flush_interval=None)
+    )
+    db = TestingSessionLocal()
+    profile = models.Profile(
+        id=str(uuid.uuid4()), api_key="test-key", api_tier="bronze"
+    )
+    db.add(profile)
+    db.commit()
+    invalidate_apikey()
+    failed_auth_cache.clear()
+    yield profile, checked
+    db.delete(profile)
+    db.commit()
+    db.close()
+    invalidate_apikey()
+    failed_auth_cache.clear()
+
+
+def bills_search():
+    pass
+
+
+def authenticate(apikey, ip="127.0.0.1", authorization=None, db_checkedout=None):
+    request = Request(
+        {
+            "type": "http",
+            "client": (ip, 1234),
+            "headers": [],
+            "endpoint": bills_search,
+        }
+    )
+    dependency = get_test_db()
+    db = next(dependency)
+    try:
+        apikey_auth(
+            request, apikey=apikey, x_api_key=None, authorization=authorization, db=db
+        )
+        if db_checkedout is not None:
+            # connections still held while the request's session is open
+            db_checkedout.append(engine.pool.checkedout())
+        return request
+    finally:
+        dependency.close()
+
+
+def test_apikey_auth_caches_tier(profile):
+    profile, checked = profile
+    authenticate("test-key")
+    assert query_logger.count == 1
+    authenticate("test-key")
+    assert query_logger.count == 0
+    assert checked == [("test-key", "bronze"), ("test-key", "bronze")]
+
+
+def test_apikey_auth_releases_connection(profile):
+    checkedout = []
+    authenticate("test-key", db_checkedout=checkedout)
+    assert query_logger.count == 1
+    # not kept while the request waits for admission
+    assert checkedout == [0]
+
+
+def test_apikey_auth_records_usage(profile):
+    authenticate("test-key")
+    authenticate("test-key")
+    with pytest.raises(HTTPException):
+        authenticate("not-a-key")
+    auth.usage.flush()
+    day = auth.usage.clock().date()
+    assert auth.usage.get_usage("test-key", day) == {"bills_search": 2}
+    assert auth.usage.get_usage("not-a-key", day) == {}
+
+
+def test_apikey_auth_invalidate(profile):
+    profile, checked = profile
+    authenticate("test-key")
+    db = TestingSessionLocal()
+    db.query(models.Profile).filter(models.Profile.id == profile.id).update(
+        {"api_tier": "silver"}
+    )
+    db.commit()
+    db.close()
+
+    # still the cached tier until the key is invalidated
+    authenticate("test-key")
+    invalidate_apikey("test-key")
+    authenticate("test-key")
+    assert query_logger.count == 1
+    assert [tier for key, tier in checked] == ["bronze", "bronze", "silver"]
+
+
+def test_apikey_invalidation_published(profile):
+    profile, checked = profile
+    redis = FakeRedis()
+    # two workers' listeners
+    listeners = [
+        InvalidationListener(
+            redis, APIKEY_INVALIDATION_CHANNEL, invalidate_apikey, interval=None
+        )
+        for _ in range(2)
+    ]
+    for listener in listeners:
+        listener.flush()
+    authenticate("test-key")
+    db = TestingSessionLocal()
+    db.query(models.Profile).filter(models.Profile.id == profile.id).update(
+        {"api_tier": "silver"}
+    )
+    db.commit()
+    db.close()
+
+    # e.g. from openstates.org, after the change
+    assert redis.publish(APIKEY_INVALIDATION_CHANNEL, "test-key") == 2
+    authenticate("test-key")
+    for listener in listeners:
+        listener.flush()
+    authenticate("test-key")
+    assert [tier for key, tier in checked] == ["bronze", "bronze", "silver"]
+
+    redis.publish(APIKEY_INVALIDATION_CHANNEL, "*")
+    listeners[0].flush()
+    authenticate("test-key")
+    assert query_logger.count == 1
+    for listener in listeners:
+        listener.close()
+    assert redis.subscribers == []
+
+
+def test_apikey_invalidation_resubscribe():
+    redis = FakeRedis()
+    invalidated = []
+    listener = InvalidationListener(redis, "channel", invalidated.append, interval=None)
+    listener.flush()
+    # anything could have been missed before subscribing
+    assert invalidated == [None]
+    redis.publish("channel", "key")
+    listener.flush()
+    assert invalidated == [None, "key"]
+
+    def broken():
+        raise ConnectionError()
+
+    listener._pubsub.get_message = broken
+    with pytest.raises(ConnectionError):
+        listener.flush()
+    assert listener._pubsub is None
+    listener.flush()
+    assert invalidated == [None, "key", None]
+
+
+def test_apikey_auth_invalid_key(profile):
+    with pytest.raises(HTTPException) as e:
+        authenticate("not-a-key")
+    assert e.value.status_code == 401
+    assert "Invalid" in e.value.detail
+    assert "not-a-key" in invalid_apikey_cache
+
+    # known bad keys are rejected without a query
+    with pytest.raises(HTTPException) as e:
+        authenticate("not-a-key")
+    assert e.value.status_code == 401
+    assert query_logger.count == 0
+
+
+def test_apikey_auth_invalid_key_created(profile):
+    with pytest.raises(HTTPException):
+        authenticate("new-key")
+    invalidate_apikey("new-key")
+    assert "new-key" not in invalid_apikey_cache
+
+
+def test_apikey_auth_failed_auth_throttle(profile):
+    for n in range(auth.MAX_FAILED_AUTH):
+        with pytest.raises(HTTPException) as e:
+            authenticate(f"bad-key-{n}", ip="10.0.0.1")
+        assert e.value.status_code == 401
+
+    with pytest.raises(HTTPException) as e:
+        authenticate("another-bad-key", ip="10.0.0.1")
+    assert e.value.status_code == 429
+    assert e.value.headers["Retry-After"] == "60"
+    assert query_logger.count == 0
+
+    # other clients, and keys already known to be good, aren't affected
+    authenticate("test-key")
+    authenticate("test-key", ip="10.0.0.1")
+
+
+def test_apikey_auth_missing_key():
+    with pytest.raises(HTTPException) as e:
+        apikey_auth(None, apikey=None, x_api_key=None, authorization=None, db=None)
+    assert e.value.status_code == 403
+
+
+def test_charge_extra(profile, monkeypatch):
+    profile, checked = profile
+    charged = []
+    monkeypatch.setattr(
+        auth.limiter, "check_limit", lambda key, tier, cost=1: charged.append(cost)
+    )
+    request = authenticate("test-key")
+    charge_extra(request, 0)
+    charge_extra(request, 4)
+    assert charged == [1, 4]
+    assert request.state.cost == 5
+
+
+def test_charge_extra_limited(profile, monkeypatch):
+    request = authenticate("test-key")
+
+    def check_limit(key, tier, cost=1):
+        raise RateLimitExceeded("exceeded limit of 40/min: 41")
+
+    monkeypatch.setattr(auth.limiter, "check_limit", check_limit)
+    with pytest.raises(HTTPException) as e:
+        charge_extra(request, 4)
+    assert e.value.status_code == 429
+
+
+@pytest.fixture
+def signer(monkeypatch):
+    signer = TokenSigner({"k1": b"secret"})
+    monkeypatch.setattr(auth, "signer", signer)
+    return signer
+
+
+def test_apikey_auth_access_token(profile, signer):
+    profile, checked = profile
+    token = signer.mint(profile.id, "silver", "test-key")
+    authenticate(None, authorization=f"Bearer {token}")
+    # the token is all that's needed
+    assert query_logger.count == 0
+    assert checked == [("test-key", "silver")]
+
+
+def test_apikey_auth_access_token_shares_limits(profile, signer):
+    profile, checked = profile
+    token = signer.mint(profile.id, "bronze", "test-key")
+    # the API key isn't readable from the token
+    assert "test-key" not in str(base64.urlsafe_b64decode(token.split(".")[0] + "=="))
+    authenticate("test-key")
+    authenticate(None, authorization=f"Bearer {token}")
+    authenticate("test-key")
+    # one bucket & one usage record, whichever credential is used
+    assert checked == [("test-key", "bronze")] * 3
+    auth.usage.flush()
+    day = auth.usage.clock().date()
+    assert auth.usage.get_usage("test-key", day) == {"bills_search": 3}
+
+
+def test_apikey_auth_invalid_access_token(profile, signer):
+    token = TokenSigner({"k1": b"not the secret"}).mint(
+        "someone", "unlimited", "test-key"
+    )
+    with pytest.raises(HTTPException) as e:
+        authenticate("test-key", authorization=f"Bearer {token}")
+    assert e.value.status_code == 401
+    assert e.value.headers == {"WWW-Authenticate": "Bearer"}
+    assert query_logger.count == 0
+
+
+def test_create_token(client, profile, signer):
+    profile, checked = profile
+    response = client.post("/tokens", headers={"X-API-KEY": "test-key"})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["token_type"] == "bearer"
+    assert data["expires_in"] == signer.ttl
+    claims = signer.verify(data["access_token"])
+    assert (claims.sub, claims.tier, claims.kid) == (profile.id, "bronze", "k1")
+    assert claims.apikey == "test-key"
+
+
+def test_create_token_requires_key(client, profile, signer):
+    token = signer.mint(profile[0].id, "bronze", "test-key")
+    response = client.post("/tokens", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 403
+
+
+def test_create_token_disabled(client, profile, monkeypatch):
+    monkeypatch.setattr(auth, "signer", TokenSigner({}))
+    response = client.post("/tokens", headers={"X-API-KEY": "test-key"})
+    assert response.status_code == 404
@@ -1,3 +1,4 @@
+import json
 import uuid
 from .conftest import query_logger
 from api.bills import BillSortOption
@@ -181,7 +182,7 @@ def test_bills_include_basics(client):
         "/bills?jurisdiction=ne&session=2020&include=sponsorships&include=abstracts"
         "&include=other_titles&include=other_identifiers&include=actions&include=sources"
     )
-    assert query_logger.count == 9
+    assert query_logger.count == 2
     assert response.status_code == 200
     for b in response.json()["results"]:
         assert len(b["sponsorships"]) == 2
@@ -197,7 +198,7 @@ def test_bills_include_documents_versions(client):
     response = client.get(
         "/bills?jurisdiction=ne&session=2020&include=documents&include=versions"
     )
-    assert query_logger.count == 6
+    assert query_logger.count == 2
     assert response.status_code == 200
     for b in response.json()["results"]:
         assert len(b["documents"]) == 3
@@ -223,7 +224,7 @@ def test_bills_include_documents_versions(client):
 
 def test_bills_include_votes(client):
     response = client.get("/bills?q=HB1&include=votes")
-    assert query_logger.count == 7
+    assert query_logger.count == 2
     assert response.status_code == 200
     b = response.json()["results"][0]
     votes = b["votes"]
@@ -277,7 +278,7 @@ def test_bills_include_votes(client):
 
 def test_bills_include_related_bills(client):
     response = client.get("/bills?q=HB1&include=related_bills")
-    assert query_logger.count == 3
+    assert query_logger.count == 2
     assert response.status_code == 200
     b = response.json()["results"][0]
     assert b["related_bills"] == [
@@ -343,7 +344,7 @@ def test_bills_sort_ordering_correct(client):
 def test_bill_detail_basic(client):
     response = client.get("/bills/oh/2021/HB 1").json()
     assert response["id"] == "ocd-bill/1234"
-    assert query_logger.count == 1
+    assert query_logger.count == 2
 
 
 def test_bill_detail_404(client):
@@ -355,31 +356,31 @@ def test_bill_detail_404(client):
 def test_bill_detail_id_normalization(client):
     response = client.get("/bills/oh/2021/HB1").json()
     assert response["id"] == "ocd-bill/1234"
-    assert query_logger.count == 1
+    assert query_logger.count == 2
 
     response = client.get("/bills/oh/2021/hb1").json()
     assert response["id"] == "ocd-bill/1234"
-    assert query_logger.count == 1
+    assert query_logger.count == 2
 
 
 def test_bill_openstates_url(client):
     response = client.get("/bills/oh/2021/HB1").json()
     assert response["openstates_url"] == "https://openstates.org/oh/bills/2021/HB1/"
-    assert query_logger.count == 1
+    assert query_logger.count == 2
 
 
 def test_bill_detail_includes(client):
     response = client.get("/bills/oh/2021/HB 1?include=votes").json()
     assert response["id"] == "ocd-bill/1234"
     assert len(response["votes"]) == 2
-    assert query_logger.count == 6
+    assert query_logger.count == 2
 
 
 def test_bill_detail_by_internal_id(client):
     response = client.get("/bills/ocd-bill/1234").json()
     assert response["id"] == "ocd-bill/1234"
     assert response["identifier"] == "HB 1"
-    assert query_logger.count == 1
+    assert query_logger.count == 2
 
 
 def test_bill_detail_sponsorship_resolution(client):
@@ -408,7 +409,7 @@ def test_bill_detail_sponsorship_resolution(client):
             },
         },
     }
-    assert query_logger.count == 3
+    assert query_logger.count == 2
 
 
 def test_bills_include_actions(client):
@@ -438,3 +439,66 @@ def test_bills_include_actions(client):
                 assert "id" in entity
                 assert "name" in entity
                 assert "type" in entity
+
+
+def test_bills_fields(client):
+    response = client.get(
+        "/bills?jurisdiction=ne&fields=identifier,title&fields=openstates_url"
+    ).json()
+    assert query_logger.count == 2
+    # only the requested columns are selected
+    assert "opencivicdata_bill.extras" not in query_logger.statements[0]
+    assert len(response["results"]) == 7
+    for bill in response["results"]:
+        assert set(bill) == {"identifier", "title", "openstates_url"}
+
+
+def test_bills_fields_with_include(client):
+    response = client.get("/bills?jurisdiction=ne&fields=id&include=votes").json()
+    assert set(response["results"][0]) == {"id", "votes"}
+
+
+def test_bills_fields_invalid(client):
+    response = client.get("/bills?jurisdiction=ne&fields=identifier,nonsense")
+    assert response.status_code == 400
+    response = client.get("/bills?jurisdiction=ne&fields=votes")
+    assert response.status_code == 400
+
+
+def test_bill_detail_fields(client):
+    response = client.get("/bills/oh/2021/HB 1?fields=session,jurisdiction").json()
+    assert query_logger.count == 2
+    assert response["session"] == "2021"
+    assert set(response) == {"session", "jurisdiction"}
+
+
+def test_bills_ndjson(client):
+    response = client.get("/bills.ndjson?jurisdiction=ne&sort=first_action_asc")
+    assert query_logger.count == 2
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert len(lines) == 7
+    paginated = client.get(
+        "/bills?jurisdiction=ne&sort=first_action_asc&per_page=20"
+    ).json()
+    assert lines == paginated["results"]
+
+
+def test_bills_ndjson_include_and_fields(client):
+    response = client.get(
+        "/bills.ndjson?jurisdiction=oh&session=2021&include=sponsorships&fields=identifier"
+    )
+    assert query_logger.count == 2
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert len(lines) == 1
+    assert set(lines[0]) == {"identifier", "sponsorships"}
+    assert len(lines[0]["sponsorships"]) == 2
+
+
+def test_bills_ndjson_filters(client):
+    response = client.get("/bills.ndjson")
+    assert response.status_code == 400
+    assert "required" in response.json()["detail"]
+    response = client.get("/bills.ndjson?session=2020")
+    assert response.status_code == 400
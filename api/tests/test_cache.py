@@ -0,0 +1,43 @@
+from api.cache import TTLCache
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_cache_get_set():
+    cache = TTLCache(maxsize=10, ttl=60)
+    assert cache.get("a") is None
+    assert cache.get("a", 0) == 0
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    assert "a" in cache
+    assert cache.pop("a") == 1
+    assert "a" not in cache
+
+
+def test_ttl_cache_expiry():
+    timer = FakeTimer()
+    cache = TTLCache(maxsize=10, ttl=60, timer=timer)
+    cache.set("a", 1)
+    timer.now = 59
+    assert cache.get("a") == 1
+    timer.now = 60
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_ttl_cache_lru_eviction():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    # touch a so that b is the least recently used
+    cache.get("a")
+    cache.set("c", 3)
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
@@ -45,14 +45,14 @@ SENATE_MEMBERSHIPS = [
 
 def test_committee_detail(client):
     response = client.get("/committees/" + SENATE_COM_ID)
-    assert query_logger.count == 1
+    assert query_logger.count == 2
     response = response.json()
     assert response == SENATE_COM_RESPONSE
 
 
 def test_committee_detail_include_memberships(client):
     response = client.get("/committees/" + SENATE_COM_ID + "?include=memberships")
-    assert query_logger.count == 3
+    assert query_logger.count == 2
     response = response.json()
     assert response == dict(memberships=SENATE_MEMBERSHIPS, **SENATE_COM_RESPONSE)
 
@@ -69,14 +69,14 @@ def test_committee_list(client):
 
 def test_committee_list_empty(client):
     response = client.get("/committees?jurisdiction=nh")
-    assert query_logger.count == 2
+    assert query_logger.count == 3
     response = response.json()
     assert len(response["results"]) == 0
 
 
 def test_committee_list_with_members(client):
     response = client.get("/committees?jurisdiction=oh&include=memberships")
-    assert query_logger.count == 4
+    assert query_logger.count == 2
     response = response.json()
     assert len(response["results"]) == 3
     assert response["results"][0]["memberships"] == []
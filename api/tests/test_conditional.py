@@ -0,0 +1,114 @@
+from .conftest import query_logger
+from .test_committees import SENATE_COM_ID
+
+
+def test_conditional_headers(client):
+    response = client.get("/bills?jurisdiction=ne")
+    assert response.status_code == 200
+    assert response.headers["last-modified"] == "Sun, 01 Aug 2021 00:00:00 GMT"
+    assert response.headers["etag"].startswith('W/"')
+
+    # same data, but a different response
+    other = client.get("/bills?jurisdiction=ne&per_page=1")
+    assert other.headers["last-modified"] == response.headers["last-modified"]
+    assert other.headers["etag"] != response.headers["etag"]
+
+    # the API key doesn't change the response
+    keyed = client.get("/bills?jurisdiction=ne&apikey=secret")
+    assert keyed.headers["etag"] == response.headers["etag"]
+
+
+def test_conditional_if_none_match(client):
+    etag = client.get("/bills?jurisdiction=ne").headers["etag"]
+    response = client.get("/bills?jurisdiction=ne", headers={"If-None-Match": etag})
+    assert query_logger.count == 1
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert response.content == b""
+
+    # weak comparison & lists of tags
+    response = client.get(
+        "/bills?jurisdiction=ne", headers={"If-None-Match": f'"abc", {etag[2:]}'}
+    )
+    assert response.status_code == 304
+
+    response = client.get("/bills?jurisdiction=ne", headers={"If-None-Match": '"abc"'})
+    assert response.status_code == 200
+
+
+def test_conditional_if_modified_since(client):
+    response = client.get(
+        "/people?jurisdiction=ne",
+        headers={"If-Modified-Since": "Mon, 02 Aug 2021 00:00:00 GMT"},
+    )
+    assert query_logger.count == 1
+    assert response.status_code == 304
+
+    response = client.get(
+        "/people?jurisdiction=ne",
+        headers={"If-Modified-Since": "Sun, 01 Aug 2021 00:00:00 GMT"},
+    )
+    assert response.status_code == 200
+    assert response.headers["last-modified"] == "Mon, 02 Aug 2021 00:00:00 GMT"
+
+    # unparseable dates are ignored
+    response = client.get(
+        "/people?jurisdiction=ne", headers={"If-Modified-Since": "yesterday"}
+    )
+    assert response.status_code == 200
+
+
+def test_conditional_if_none_match_takes_precedence(client):
+    response = client.get(
+        "/people?jurisdiction=ne",
+        headers={
+            "If-None-Match": '"abc"',
+            "If-Modified-Since": "Mon, 02 Aug 2021 00:00:00 GMT",
+        },
+    )
+    assert response.status_code == 200
+
+
+def test_conditional_detail_routes(client):
+    for url in [
+        "/bills/ocd-bill/1234",
+        "/bills/oh/2021/HB 1",
+        "/committees/" + SENATE_COM_ID,
+        "/jurisdictions/oh",
+    ]:
+        etag = client.get(url).headers["etag"]
+        response = client.get(url, headers={"If-None-Match": etag})
+        assert query_logger.count == 1
+        assert response.status_code == 304
+
+
+def test_conditional_missing_watermark(client):
+    # nothing to derive validators from, the usual 404
+    response = client.get("/bills/ocd-bill/nonexistent", headers={"If-None-Match": "*"})
+    assert response.status_code == 404
+    assert "etag" not in response.headers
+
+
+def test_conditional_invalid_request(client):
+    # filters are still validated first
+    response = client.get(
+        "/bills?session=2021",
+        headers={"If-Modified-Since": "Mon, 02 Aug 2021 00:00:00 GMT"},
+    )
+    assert response.status_code == 400
+
+
+def test_conditional_jurisdictions(client):
+    response = client.get("/jurisdictions")
+    # the most recent of either update across all jurisdictions
+    assert response.headers["last-modified"] == "Thu, 05 Aug 2021 00:00:00 GMT"
+    response = client.get("/jurisdictions?classification=municipality")
+    assert response.headers["last-modified"] == "Mon, 02 Aug 2021 00:00:00 GMT"
+
+    # latest_runs changes with each run, so they're part of the watermark
+    url = "/jurisdictions/ne?include=latest_runs"
+    response = client.get(url)
+    assert response.headers["last-modified"] == "Mon, 02 Aug 2021 00:00:00 GMT"
+    response = client.get(url, headers={"If-None-Match": response.headers["etag"]})
+    assert query_logger.count == 1
+    assert response.status_code == 304
@@ -0,0 +1,70 @@
+import pytest
+from fastapi import Request
+from api.main import app
+from api.auth import apikey_auth
+from api.bills import bills_search, bill_detail, BillPagination
+from api.jurisdictions import jurisdiction_list
+from api.cost import request_cost
+
+
+def make_request(endpoint, query_string=""):
+    return Request(
+        {
+            "type": "http",
+            "headers": [],
+            "query_string": query_string.encode(),
+            "endpoint": endpoint,
+        }
+    )
+
+
+def test_request_cost():
+    assert request_cost(make_request(jurisdiction_list)) == 1
+    assert request_cost(make_request(bills_search, "jurisdiction=ne")) == 1
+    # 9 relationship paths for 20 bills
+    heavy = "include=votes&include=actions&include=versions&per_page=20"
+    assert request_cost(make_request(bills_search, heavy)) == 5
+    # fewer results cost less
+    assert request_cost(make_request(bills_search, heavy + "&per_page=5")) == 2
+    assert request_cost(make_request(bill_detail, heavy)) == 2
+
+
+def test_request_cost_invalid_params():
+    # these fail validation later, they shouldn't fail here
+    request = make_request(bills_search, "include=nonsense&per_page=abc")
+    assert request_cost(request) == 1
+    request = make_request(bills_search, "include=votes&per_page=1000")
+    assert request_cost(request) == BillPagination.cost(
+        {"votes"}, BillPagination.max_per_page
+    )
+
+
+def test_request_cost_unregistered_endpoint():
+    assert request_cost(make_request(None)) == 1
+
+
+@pytest.fixture
+def costed_client(client, monkeypatch):
+    def auth(request: Request):
+        request.state.cost = request_cost(request)
+
+    monkeypatch.setitem(app.dependency_overrides, apikey_auth, auth)
+    return client
+
+
+def test_request_cost_header(costed_client):
+    response = costed_client.get("/jurisdictions")
+    assert response.headers["x-request-cost"] == "1"
+    response = costed_client.get(
+        "/bills?jurisdiction=ne&include=votes&include=actions&include=versions"
+        "&per_page=20"
+    )
+    assert response.headers["x-request-cost"] == "5"
+    # even if the request fails
+    response = costed_client.get("/bills?include=votes")
+    assert response.status_code == 400
+    assert response.headers["x-request-cost"] == "2"
+
+
+def test_request_cost_header_not_charged(client):
+    assert "x-request-cost" not in client.get("/jurisdictions").headers
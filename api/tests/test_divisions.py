@@ -0,0 +1,272 @@
+import json
+import asyncio
+import pytest
+from prometheus_client import REGISTRY
+from api import divisions, people
+from api.divisions import DivisionResolver, GeoCache
+from api.upstream import UpstreamClient
+from .conftest import query_logger
+
+
+def square(min_lng, min_lat, max_lng, max_lat):
+    return [
+        [min_lng, min_lat],
+        [max_lng, min_lat],
+        [max_lng, max_lat],
+        [min_lng, max_lat],
+        [min_lng, min_lat],
+    ]
+
+
+def feature(division_id, geometry_type, coordinates, **properties):
+    return {
+        "type": "Feature",
+        "properties": {"ocdid": division_id, **properties},
+        "geometry": {"type": geometry_type, "coordinates": coordinates},
+    }
+
+
+NE_SLDU_1 = "ocd-division/country:us/state:ne/sldu:1"
+NE_SLDU_2 = "ocd-division/country:us/state:ne/sldu:2"
+NE_CD_1 = "ocd-division/country:us/state:ne/cd:1"
+
+FEATURES = [
+    # with a hole, which is district 2
+    feature(
+        NE_SLDU_1,
+        "Polygon",
+        [square(-101, 41, -99, 42), square(-100.5, 41.25, -100, 41.75)],
+    ),
+    feature(NE_SLDU_2, "Polygon", [square(-100.5, 41.25, -100, 41.75)]),
+    feature(
+        NE_CD_1,
+        "MultiPolygon",
+        [[square(-101, 41, -100, 42)], [square(-98, 40, -97, 41)]],
+        name="Nebraska 1st",
+    ),
+]
+
+
+@pytest.fixture
+def resolver(monkeypatch):
+    resolver = DivisionResolver(FEATURES)
+    monkeypatch.setattr(divisions, "resolver", resolver)
+    monkeypatch.setattr(divisions, "geo_cache", GeoCache())
+    return resolver
+
+
+def ids(found):
+    return [d["id"] for d in found]
+
+
+def test_resolver_lookup(resolver):
+    assert ids(resolver.lookup(41.5, -100.75)) == [NE_SLDU_1, NE_CD_1]
+    assert ids(resolver.lookup(41.5, -99.5)) == [NE_SLDU_1]
+    assert resolver.lookup(0, 0) == []
+
+
+def test_resolver_holes(resolver):
+    assert ids(resolver.lookup(41.5, -100.25)) == [NE_SLDU_2, NE_CD_1]
+
+
+def test_resolver_multipolygon(resolver):
+    assert resolver.lookup(40.5, -97.5) == [
+        {"id": NE_CD_1, "state": "ne", "name": "Nebraska 1st", "division_set": "cd"}
+    ]
+
+
+def test_resolver_division_from_id(resolver):
+    assert resolver.lookup(41.5, -99.5) == [
+        {"id": NE_SLDU_1, "state": "ne", "name": "1", "division_set": "sldu"}
+    ]
+
+
+def test_resolver_small_cells():
+    # polygons spanning many cells are found from any of them
+    resolver = DivisionResolver(FEATURES, cell_size=0.1)
+    assert ids(resolver.lookup(41.95, -99.05)) == [NE_SLDU_1]
+    assert ids(resolver.lookup(41.05, -100.95)) == [NE_SLDU_1, NE_CD_1]
+
+
+def test_resolver_unsupported_geometry():
+    point = feature(NE_SLDU_1, "Point", [-100, 41])
+    with pytest.raises(ValueError):
+        DivisionResolver([point])
+
+
+def test_resolver_from_geojson(tmp_path):
+    (tmp_path / "sldu.geojson").write_text(
+        json.dumps({"type": "FeatureCollection", "features": FEATURES[:2]})
+    )
+    (tmp_path / "cd.json").write_text(json.dumps(FEATURES[2]))
+    resolver = DivisionResolver.from_geojson(str(tmp_path))
+    assert resolver.divisions == 3
+    assert set(ids(resolver.lookup(41.5, -100.75))) == {NE_SLDU_1, NE_CD_1}
+    resolver = DivisionResolver.from_geojson(str(tmp_path / "cd.json"))
+    assert ids(resolver.lookup(41.5, -100.75)) == [NE_CD_1]
+
+
+def test_divisions_geo(client, resolver):
+    query_logger.reset()
+    response = client.get("/divisions.geo?lat=41.5&lng=-99.5")
+    assert response.status_code == 200
+    assert response.json() == {
+        "divisions": [
+            {"id": NE_SLDU_1, "state": "ne", "name": "1", "division_set": "sldu"}
+        ]
+    }
+    assert query_logger.count == 0
+
+
+def test_divisions_geo_not_loaded(client, monkeypatch):
+    monkeypatch.setattr(divisions, "resolver", None)
+    assert client.get("/divisions.geo?lat=41.5&lng=-100").status_code == 404
+
+
+def test_people_geo_local_divisions(client, resolver, monkeypatch):
+    # nothing listening, the upstream isn't needed
+    monkeypatch.setattr(people, "geo_client", UpstreamClient("http://127.0.0.1:9"))
+    response = client.get("/people.geo?lat=41.5&lng=-99.5").json()
+    assert query_logger.count == 1
+    assert [p["name"] for p in response["results"]] == ["Amy Adams"]
+
+
+def in_event_loop():
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+@pytest.fixture
+def lookup_threads(monkeypatch):
+    """records, for each local lookup, whether it blocked the event loop"""
+    calls = []
+    lookup = divisions.lookup
+
+    def recording_lookup(lat, lng):
+        calls.append(in_event_loop())
+        return lookup(lat, lng)
+
+    monkeypatch.setattr(divisions, "lookup", recording_lookup)
+    return calls
+
+
+def test_people_geo_local_lookup_in_threadpool(client, resolver, lookup_threads):
+    response = client.get("/people.geo?lat=41.5&lng=-99.5").json()
+    assert [p["name"] for p in response["results"]] == ["Amy Adams"]
+    assert lookup_threads == [False]
+    # no divisions, no query
+    assert client.get("/people.geo?lat=0&lng=0").json()["results"] == []
+    assert query_logger.count == 0
+
+
+def test_people_geo_batch_local_lookups_in_threadpool(client, resolver, lookup_threads):
+    points = [{"lat": 41.5, "lng": -99.5}, {"lat": 0, "lng": 0}] * 3
+    response = client.post("/people.geo/batch", json={"points": points})
+    assert response.status_code == 200
+    # once per distinct point, none of them on the event loop
+    assert lookup_threads == [False, False]
+
+
+class Timer:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def cache_lookups(result):
+    return REGISTRY.get_sample_value("geo_cache_lookups_total", {"result": result}) or 0
+
+
+def test_resolver_uniform(resolver):
+    # well inside district 1 & the congressional district
+    assert resolver.uniform((-100.8, 41.8, -100.7, 41.9))
+    # across the edge of district 2 (the hole)
+    assert not resolver.uniform((-100.55, 41.5, -100.45, 41.6))
+    # containing a corner of it, without any of the rectangle's corners crossing
+    assert not resolver.uniform((-100.6, 41.7, -100.4, 41.8))
+
+
+def test_resolver_uniform_diagonal():
+    # the edge passes through the rectangle, neither end is in it
+    triangle = feature(NE_SLDU_1, "Polygon", [[[0, 0], [10, 10], [10, 0], [0, 0]]])
+    resolver = DivisionResolver([triangle])
+    assert not resolver.uniform((4.9, 5.0, 5.1, 5.1))
+    assert resolver.uniform((6.0, 5.0, 6.1, 5.1))
+
+
+def test_geo_cache():
+    timer = Timer()
+    cache = GeoCache(ttl=60, cell_size=0.01, timer=timer)
+    cache.set(41.5, -100.5, ["point"])
+    cache.set(41.705, -100.705, ["cell"], whole_cell=True)
+    misses = cache_lookups("miss")
+    assert cache.get(41.5, -100.5) == ["point"]
+    assert cache.get(41.5001, -100.5) is None
+    assert cache.get(41.701, -100.709) == ["cell"]
+    assert cache.get(41.711, -100.705) is None
+    assert cache_lookups("miss") == misses + 2
+    timer.now = 60
+    assert cache.get(41.5, -100.5) is None
+
+
+def test_geo_cache_evicts_least_recent():
+    cache = GeoCache(maxsize=2)
+    cache.set(1, 1, ["a"])
+    cache.set(2, 2, ["b"])
+    cache.get(1, 1)
+    cache.set(3, 3, ["c"])
+    assert cache.get(1, 1) == ["a"]
+    assert cache.get(2, 2) is None
+
+
+def test_lookup_caches_uniform_cells(resolver):
+    hits = cache_lookups("cell_hit")
+    assert ids(divisions.lookup(41.8005, -100.8005)) == [NE_SLDU_1, NE_CD_1]
+    # elsewhere in the same cell
+    assert ids(divisions.lookup(41.8001, -100.8009)) == [NE_SLDU_1, NE_CD_1]
+    assert cache_lookups("cell_hit") == hits + 1
+
+
+def test_lookup_near_boundary_caches_point(resolver):
+    hits = cache_lookups("point_hit")
+    # just inside district 2, in a cell its edge goes through
+    assert ids(divisions.lookup(41.5, -100.4999)) == [NE_SLDU_2, NE_CD_1]
+    assert ids(divisions.lookup(41.5, -100.4999)) == [NE_SLDU_2, NE_CD_1]
+    assert cache_lookups("point_hit") == hits + 1
+    assert ids(divisions.lookup(41.5, -100.5001)) == [NE_SLDU_1, NE_CD_1]
+
+
+def test_people_geo_batch(client, resolver):
+    points = [
+        {"lat": 41.5, "lng": -99.5},
+        {"lat": 41.5, "lng": -100.25},
+        {"lat": 0, "lng": 0},
+        {"lat": 41.5, "lng": -99.5},
+    ]
+    response = client.post(
+        "/people.geo/batch?fields=name,party", json={"points": points}
+    )
+    assert response.status_code == 200
+    # only the roster's update check, whatever the number of points
+    assert query_logger.count == 1
+    amy = {"name": "Amy Adams", "party": "Democratic"}
+    assert response.json() == {
+        "results": [
+            {"lat": 41.5, "lng": -99.5, "results": [amy]},
+            {"lat": 41.5, "lng": -100.25, "results": []},
+            {"lat": 0, "lng": 0, "results": []},
+            {"lat": 41.5, "lng": -99.5, "results": [amy]},
+        ]
+    }
+
+
+def test_people_geo_batch_limits(client, resolver):
+    assert client.post("/people.geo/batch", json={"points": []}).status_code == 422
+    points = [{"lat": 0, "lng": 0}] * (people.GEO_BATCH_MAX_POINTS + 1)
+    response = client.post("/people.geo/batch", json={"points": points})
+    assert response.status_code == 422
@@ -3,7 +3,7 @@ from .conftest import query_logger
 
 def test_events_list(client):
     response = client.get("/events?jurisdiction=ne").json()
-    assert query_logger.count == 2
+    assert query_logger.count == 1
     assert len(response["results"]) == 3
     assert response["results"][0]["name"] == "Event #0"
     assert "links" not in response["results"][0]
@@ -15,7 +15,7 @@ def test_events_list_simple_includes(client):
         "/events?jurisdiction=ne&include=sources&include=links"
     ).json()
     # no extra queries for these
-    assert query_logger.count == 2
+    assert query_logger.count == 1
     assert len(response["results"]) == 3
     assert response["results"][0]["name"] == "Event #0"
     assert response["results"][0]["links"][0]["url"] == "https://example.com/0"
@@ -26,8 +26,7 @@ def test_events_list_join_includes(client):
     response = client.get(
         "/events?jurisdiction=ne&include=media&include=documents&include=participants"
     ).json()
-    # one extra query each
-    assert query_logger.count == 5
+    assert query_logger.count == 1
     assert len(response["results"]) == 3
     assert response["results"][0]["name"] == "Event #0"
     assert len(response["results"][0]["media"]) == 1
@@ -38,7 +37,7 @@ def test_events_list_join_includes(client):
 def test_events_list_join_agenda(client):
     response = client.get("/events?jurisdiction=ne&include=agenda").json()
     # agenda is 3 extra queries together
-    assert query_logger.count == 5
+    assert query_logger.count == 4
     assert len(response["results"]) == 3
     assert response["results"][0]["name"] == "Event #0"
     assert len(response["results"][0]["agenda"]) == 2
@@ -53,7 +52,7 @@ def test_events_list_join_agenda(client):
 
 def test_events_list_deleted(client):
     response = client.get("/events?jurisdiction=ne&deleted=true").json()
-    assert query_logger.count == 2
+    assert query_logger.count == 1
     assert len(response["results"]) == 1
     assert response["results"][0]["name"] == "Event #4"
     assert response["results"][0]["deleted"] is True
@@ -61,14 +60,14 @@ def test_events_list_deleted(client):
 
 def test_events_list_before(client):
     response = client.get("/events?jurisdiction=ne&before=2021-01-02").json()
-    assert query_logger.count == 2
+    assert query_logger.count == 1
     assert len(response["results"]) == 1
     assert response["results"][0]["start_date"] == "2021-01-01"
 
 
 def test_events_list_after(client):
     response = client.get("/events?jurisdiction=ne&after=2021-01-02").json()
-    assert query_logger.count == 2
+    assert query_logger.count == 1
     assert len(response["results"]) == 1
     assert response["results"][0]["start_date"] == "2021-01-03"
 
@@ -77,14 +76,14 @@ def test_events_list_before_and_after(client):
     response = client.get(
         "/events?jurisdiction=ne&after=2021-01-01&before=2021-01-03"
     ).json()
-    assert query_logger.count == 2
+    assert query_logger.count == 1
     assert len(response["results"]) == 1
     assert response["results"][0]["start_date"] == "2021-01-02"
 
 
 def test_events_list_require_bills(client):
     response = client.get("/events?jurisdiction=ne&require_bills=true").json()
-    assert query_logger.count == 2
+    assert query_logger.count == 1
     assert len(response["results"]) == 1
     assert response["results"][0]["name"] == "Event #0"
 
@@ -94,7 +93,7 @@ def test_events_list_require_bills_include_agenda(client):
         "/events?jurisdiction=ne&require_bills=true&include=agenda"
     ).json()
     # join count should still be 5, checking for weirdness w/ group by/agenda join
-    assert query_logger.count == 5
+    assert query_logger.count == 4
     assert len(response["results"]) == 1
     assert response["results"][0]["name"] == "Event #0"
 
@@ -182,3 +181,12 @@ def test_event_by_id_all_includes(client):
     # 3 joins for media, documents, participants, and 3 more for agenda
     assert query_logger.count == 7
     assert response == FULL_EVENT
+
+
+def test_events_list_fields(client):
+    response = client.get(
+        "/events?jurisdiction=ne&fields=name,jurisdiction&include=links"
+    ).json()
+    assert query_logger.count == 1
+    assert len(response["results"]) == 3
+    assert set(response["results"][0]) == {"name", "jurisdiction", "links"}
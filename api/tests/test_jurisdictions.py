@@ -91,7 +91,7 @@ def test_jurisdiction_include_sessions(client):
     )
     response = response.json()
     # is included, legislative sessions are inline
-    assert query_logger.count == 4
+    assert query_logger.count == 2
     assert len(response["results"][0]["legislative_sessions"]) == 2
     assert response["results"][0]["legislative_sessions"][0] == {
         "identifier": "2020",
@@ -124,13 +124,13 @@ NEBRASKA_RESPONSE = {
 def test_jurisdiction_detail_by_abbr(client):
     response = client.get("/jurisdictions/ne").json()
     assert response == NEBRASKA_RESPONSE
-    assert query_logger.count == 1
+    assert query_logger.count == 2
 
 
 def test_jurisdiction_detail_by_name(client):
     response = client.get("/jurisdictions/Nebraska").json()
     assert response == NEBRASKA_RESPONSE
-    assert query_logger.count == 1
+    assert query_logger.count == 2
 
 
 def test_jurisdiction_detail_by_jid(client):
@@ -138,7 +138,7 @@ def test_jurisdiction_detail_by_jid(client):
         "/jurisdictions/ocd-jurisdiction/country:us/state:ne/government"
     ).json()
     assert response == NEBRASKA_RESPONSE
-    assert query_logger.count == 1
+    assert query_logger.count == 2
 
 
 def test_jurisdiction_detail_404(client):
@@ -150,10 +150,10 @@ def test_jurisdiction_detail_404(client):
 def test_jurisdiction_include_orgs(client):
     response = client.get("/jurisdictions/ne?include=organizations").json()
     assert len(response["organizations"]) == 2
-    assert query_logger.count == 3
+    assert query_logger.count == 4
 
 
 def test_jurisdiction_include_latest_runs(client):
     response = client.get("/jurisdictions/ne?include=latest_runs").json()
     assert len(response["latest_runs"]) == 20
-    assert query_logger.count == 2
+    assert query_logger.count == 3
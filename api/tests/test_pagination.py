@@ -1,6 +1,10 @@
 import pytest
+from .conftest import query_logger, TestingSessionLocal
 from api.db import get_db, models
-from api.pagination import Pagination
+from api.pagination import Pagination, count_cache
+from api.bills import BillSortOption, BillPagination, BillInclude
+from api.people import PeoplePagination, PersonInclude
+from api.events import EventPagination
 
 
 def test_pagination_basic(client):
@@ -79,3 +83,207 @@ def test_pagination_no_order_by():
     with pytest.raises(Exception) as e:
         p.paginate(query)
     assert "ordering is required for pagination" in str(e)
+
+
+def test_pagination_cursor_walk(client):
+    expected = [
+        b["id"]
+        for b in client.get("/bills?jurisdiction=ne&per_page=20").json()["results"]
+    ]
+    seen = []
+    cursor = ""
+    while cursor is not None:
+        response = client.get(f"/bills?jurisdiction=ne&per_page=3&cursor={cursor}")
+        assert response.status_code == 200
+        response = response.json()
+        assert len(response["results"]) <= 3
+        assert "total_items" not in response["pagination"]
+        seen.extend(b["id"] for b in response["results"])
+        cursor = response["pagination"].get("next_cursor")
+    assert len(seen) == len(set(seen))
+    assert sorted(seen) == sorted(expected)
+
+
+def test_pagination_cursor_all_sorts(client):
+    for sort in BillSortOption:
+        url = f"/bills?jurisdiction=ne&sort={sort.value}"
+        expected = [b["id"] for b in client.get(url).json()["results"]]
+        seen = []
+        cursor = ""
+        while cursor is not None:
+            response = client.get(f"{url}&per_page=2&cursor={cursor}").json()
+            seen.extend(b["id"] for b in response["results"])
+            cursor = response["pagination"].get("next_cursor")
+        # rows that tie on the sort key may come back in either order without a cursor
+        assert sorted(seen) == sorted(expected)
+
+
+def test_pagination_cursor_null_sort_keys(client):
+    db = TestingSessionLocal()
+    bill = (
+        db.query(models.Bill)
+        .join(models.Bill.legislative_session)
+        .filter(
+            models.LegislativeSession.jurisdiction_id
+            == "ocd-jurisdiction/country:us/state:ne/government",
+            models.Bill.first_action_date.isnot(None),
+        )
+        .order_by(models.Bill.id)
+        .first()
+    )
+    first_action_date = bill.first_action_date
+    bill.first_action_date = None
+    db.commit()
+    try:
+        for sort in ("first_action_asc", "first_action_desc"):
+            url = f"/bills?jurisdiction=ne&sort={sort}"
+            expected = [b["id"] for b in client.get(url).json()["results"]]
+            seen = []
+            cursor = ""
+            while cursor is not None:
+                response = client.get(f"{url}&per_page=2&cursor={cursor}").json()
+                seen.extend(b["id"] for b in response["results"])
+                cursor = response["pagination"].get("next_cursor")
+            assert sorted(seen) == sorted(expected)
+            # NULLs sort last either way
+            assert seen[-1] == bill.id
+    finally:
+        bill.first_action_date = first_action_date
+        db.commit()
+        db.close()
+
+
+def test_pagination_cursor_people(client):
+    response = client.get("/people?jurisdiction=ne&per_page=1&cursor=").json()
+    assert response["results"][0]["name"] == "Amy Adams"
+    cursor = response["pagination"]["next_cursor"]
+    response = client.get(f"/people?jurisdiction=ne&per_page=1&cursor={cursor}").json()
+    assert response["results"][0]["name"] == "Boo Berri"
+    assert "next_cursor" not in response["pagination"]
+
+
+def test_pagination_cursor_invalid(client):
+    response = client.get("/bills?jurisdiction=ne&cursor=garbage")
+    assert response.status_code == 400
+    assert "invalid cursor" in response.json()["detail"]
+
+
+def test_pagination_cursor_wrong_sort(client):
+    cursor = client.get("/bills?jurisdiction=ne&per_page=1&cursor=").json()[
+        "pagination"
+    ]["next_cursor"]
+    response = client.get(
+        f"/bills?jurisdiction=ne&per_page=1&sort=updated_asc&cursor={cursor}"
+    )
+    assert response.status_code == 400
+    assert "sort order" in response.json()["detail"]
+
+
+def test_pagination_count_none(client):
+    response = client.get("/jurisdictions?per_page=2&count=none")
+    assert query_logger.count == 2
+    assert response.json()["pagination"] == {
+        "page": 1,
+        "per_page": 2,
+        "has_next_page": True,
+    }
+    response = client.get("/jurisdictions?per_page=2&page=2&count=none").json()
+    assert response["results"][0]["name"] == "Ohio"
+    assert response["pagination"]["has_next_page"] is False
+
+    response = client.get("/jurisdictions?per_page=2&page=3&count=none")
+    assert response.status_code == 404
+    assert "invalid page" in response.json()["detail"]
+
+
+def test_pagination_count_estimate_uses_cache(client):
+    count_cache.clear()
+    client.get("/bills?jurisdiction=ne&per_page=3")
+    # same filters, different page & ordering, reuses the exact count from above
+    response = client.get(
+        "/bills?jurisdiction=ne&per_page=3&page=2&sort=updated_asc&count=estimate"
+    )
+    assert query_logger.count == 2
+    assert response.json()["pagination"] == {
+        "page": 2,
+        "per_page": 3,
+        "max_page": 3,
+        "total_items": 7,
+    }
+
+
+def test_pagination_count_estimate_planner(client):
+    count_cache.clear()
+    response = client.get("/bills?jurisdiction=ne&session=2021&count=estimate")
+    # one query for the page and one EXPLAIN
+    assert query_logger.count == 3
+    response = response.json()
+    assert len(response["results"]) == 2
+    # the planner's guess, but never fewer than the rows we saw
+    assert response["pagination"]["total_items"] >= 2
+
+
+def test_pagination_count_estimate_in_filter(client):
+    count_cache.clear()
+    # IN filters are rendered with their values for the EXPLAIN
+    response = client.get("/committees?jurisdiction=ne&count=estimate")
+    assert response.status_code == 200
+    assert response.json()["pagination"]["total_items"] >= len(
+        response.json()["results"]
+    )
+    response = client.get("/people?id=ocd-person/1&id=ocd-person/2&count=estimate")
+    assert response.status_code == 200
+
+
+def test_pagination_cursor_with_count(client):
+    response = client.get("/bills?jurisdiction=ne&per_page=3&cursor=&count=exact")
+    assert response.json()["pagination"]["total_items"] == 7
+
+
+def test_aggregate_include_matches_selectin(client, monkeypatch):
+    monkeypatch.setattr(BillPagination, "core_rows", False)
+    url = "/bills?q=HB1&include=votes&include=sponsorships&include=actions"
+    aggregated = client.get(url).json()
+    assert query_logger.count == 2
+    monkeypatch.setattr(BillPagination, "include_strategies", {})
+    selectin = client.get(url).json()
+    # one per relationship path, less any many-to-one already in the identity map
+    assert query_logger.count > 5
+    assert aggregated == selectin
+
+
+def test_aggregate_include_computed_field():
+    # PersonOffice.name is a Python property, so offices can't be built in SQL
+    with pytest.raises(ValueError):
+        PeoplePagination.aggregate_include(PersonInclude.offices, models.Person)
+
+
+def test_core_rows_match_orm(client, monkeypatch):
+    bill_includes = "&".join(f"include={i.value}" for i in BillInclude)
+    # bills & people also run a watermark query for conditional GET, people are
+    # searched by name as jurisdiction listings come from the roster snapshot
+    urls = [
+        (BillPagination, f"/bills?jurisdiction=oh&{bill_includes}", 2),
+        (BillPagination, "/bills/oh/2021/HB 1?include=votes&include=related_bills", 2),
+        (BillPagination, "/bills?jurisdiction=ne&fields=id,openstates_url", 2),
+        (
+            PeoplePagination,
+            "/people?name=a&include=other_names&include=links",
+            2,
+        ),
+        (EventPagination, "/events?jurisdiction=ne&include=media&include=links", 1),
+    ]
+    for Pag, url, queries in urls:
+        core = client.get(url).json()
+        assert query_logger.count == queries
+        monkeypatch.setattr(Pag, "core_rows", False)
+        orm = client.get(url).json()
+        monkeypatch.undo()
+        assert core == orm
+
+
+def test_core_rows_computed_include_falls_back_to_orm(client):
+    # PersonOffice.name is a Python property, so offices need ORM objects
+    response = client.get("/people?name=amy&include=offices").json()
+    assert query_logger.count == 3
+    assert response["results"][0]["offices"] is not None
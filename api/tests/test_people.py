@@ -1,11 +1,15 @@
+import pytest
+from api import admission, divisions, people
+from api.divisions import GeoCache
+from api.upstream import CircuitBreaker, UpstreamBusy, UpstreamClient
 from .conftest import query_logger
-from unittest import mock
+from .stub_server import StubServer
 
 
 def test_by_jurisdiction_abbr(client):
     # by abbr
     response = client.get("/people?jurisdiction=ne").json()
-    assert query_logger.count == 2
+    assert query_logger.count == 1
     assert len(response["results"]) == 2
     assert response["results"][0]["name"] == "Amy Adams"
     assert response["results"][1]["name"] == "Boo Berri"
@@ -14,7 +18,7 @@ def test_by_jurisdiction_abbr(client):
 def test_by_jurisdiction_name(client):
     # by name
     response = client.get("/people?jurisdiction=Nebraska").json()
-    assert query_logger.count == 2
+    assert query_logger.count == 1
     assert len(response["results"]) == 2
     assert response["results"][0]["name"] == "Amy Adams"
     assert response["results"][1]["name"] == "Boo Berri"
@@ -25,7 +29,7 @@ def test_by_jurisdiction_jid(client):
     response = client.get(
         "/people?jurisdiction=ocd-jurisdiction/country:us/state:ne/government"
     ).json()
-    assert query_logger.count == 2
+    assert query_logger.count == 1
     assert len(response["results"]) == 2
     assert response["results"][0]["name"] == "Amy Adams"
     assert response["results"][1]["name"] == "Boo Berri"
@@ -35,7 +39,7 @@ def test_by_district(client):
     response = client.get(
         "/people?jurisdiction=ocd-jurisdiction/country:us/state:ne/government&district=1"
     ).json()
-    assert query_logger.count == 2
+    assert query_logger.count == 1
     assert len(response["results"]) == 1
     assert response["results"][0]["name"] == "Amy Adams"
 
@@ -44,7 +48,7 @@ def test_by_district_text(client):
     response = client.get(
         "/people?jurisdiction=ocd-jurisdiction/country:us/state:ne/government&district=1A"
     ).json()
-    assert query_logger.count == 2
+    assert query_logger.count == 1
     assert len(response["results"]) == 0
 
 
@@ -59,12 +63,12 @@ def test_by_jurisdiction_and_org_classification(client):
     response = client.get(
         "/people?jurisdiction=ne&org_classification=legislature"
     ).json()
-    assert query_logger.count == 2
+    assert query_logger.count == 1
     assert len(response["results"]) == 1
     assert response["results"][0]["name"] == "Amy Adams"
 
     response = client.get("/people?jurisdiction=ne&org_classification=executive").json()
-    assert query_logger.count == 2
+    assert query_logger.count == 1
     assert len(response["results"]) == 1
     assert response["results"][0]["name"] == "Boo Berri"
     response = client.get("/people?jurisdiction=ne&org_classification=lower").json()
@@ -140,7 +144,7 @@ def test_people_includes_normal(client):
         "/people?id=ocd-person/11111111-1111-1111-1111-111111111111"
         "&include=other_names&include=other_identifiers&include=links&include=sources"
     ).json()
-    assert query_logger.count == 6  # 4 extra queries
+    assert query_logger.count == 2  # includes are selected as JSON
     assert response["results"][0]["other_names"] == [
         {"name": "Amy 'Aardvark' Adams", "note": "nickname"}
     ]
@@ -169,19 +173,40 @@ def test_people_include_office(client):
     ]
 
 
-def test_people_geo_basic(client):
-    with mock.patch("api.people.session.get") as mock_get:
-        mock_get.return_value.json.return_value = {
-            "divisions": [
-                {
-                    "id": "ocd-division/country:us/state:ne/sldu:1",
-                    "state": "ne",
-                    "name": "1",
-                    "division_set": "sldu",
-                },
-            ]
-        }
-        response = client.get("/people.geo?lat=41.5&lng=-100").json()
+@pytest.fixture
+def geo_upstream(monkeypatch):
+    stub = StubServer()
+    client = UpstreamClient(
+        stub.url,
+        read_timeout=0.2,
+        retries=1,
+        backoff=0,
+        breaker=CircuitBreaker(failure_threshold=4),
+    )
+    monkeypatch.setattr(people, "geo_client", client)
+    monkeypatch.setattr(divisions, "geo_cache", GeoCache())
+    yield stub
+    stub.close()
+
+
+def test_people_geo_basic(client, geo_upstream):
+    geo_upstream.respond(
+        (
+            200,
+            {
+                "divisions": [
+                    {
+                        "id": "ocd-division/country:us/state:ne/sldu:1",
+                        "state": "ne",
+                        "name": "1",
+                        "division_set": "sldu",
+                    },
+                ]
+            },
+        )
+    )
+    response = client.get("/people.geo?lat=41.5&lng=-100").json()
+    assert geo_upstream.requests == ["/divisions.geo?lat=41.5&lng=-100.0"]
     # 1 query b/c we bypass count() since pagination isn't really needed
     assert query_logger.count == 1
     assert len(response["results"]) == 1
@@ -190,42 +215,183 @@ def test_people_geo_basic(client):
     assert response["pagination"]["total_items"] == 1
 
 
-def test_people_geo_bad_param(client):
+def test_people_geo_bad_param(client, geo_upstream):
     # missing parameter
-    with mock.patch("api.people.session.get") as mock_get:
-        response = client.get("/people.geo?lat=38")
-        assert response.status_code == 422
-        assert response.json()
-        assert query_logger.count == 0
-        assert mock_get.called is False
+    response = client.get("/people.geo?lat=38")
+    assert response.status_code == 422
+    assert response.json()
+    assert query_logger.count == 0
 
     # non-float param
-    with mock.patch("api.people.session.get") as mock_get:
-        response = client.get("/people.geo?lat=38&lng=abc")
-        assert response.status_code == 422
-        assert response.json()
-        assert query_logger.count == 0
-        assert mock_get.called is False
+    response = client.get("/people.geo?lat=38&lng=abc")
+    assert response.status_code == 422
+    assert response.json()
+    assert query_logger.count == 0
+    assert geo_upstream.requests == []
 
 
-def test_people_geo_bad_upstream(client):
+def test_people_geo_bad_upstream(client, geo_upstream):
     # unexpected response from upstream
-    with mock.patch("api.people.session.get") as mock_get:
-        mock_get.return_value.json.return_value = {"endpoint disabled": True}
-        response = client.get("/people.geo?lat=50&lng=50")
-        assert response.status_code == 500
-        assert response.json()
-        assert query_logger.count == 0
-        assert mock_get.called is True
-
-
-def test_people_geo_empty(client):
-    with mock.patch("api.people.session.get") as mock_get:
-        mock_get.return_value.json.return_value = {"divisions": []}
-        response = client.get("/people.geo?lat=0&lng=0")
-        assert response.json() == {
-            "results": [],
-            "pagination": {"max_page": 1, "per_page": 100, "page": 1, "total_items": 0},
+    geo_upstream.respond((200, {"endpoint disabled": True}))
+    response = client.get("/people.geo?lat=50&lng=50")
+    assert response.status_code == 500
+    assert response.json()
+    assert query_logger.count == 0
+    assert len(geo_upstream.requests) == 1
+
+
+def test_people_geo_upstream_retried(client, geo_upstream):
+    geo_upstream.respond((503, {}), (200, {"divisions": []}))
+    response = client.get("/people.geo?lat=0&lng=0")
+    assert response.status_code == 200
+    assert len(geo_upstream.requests) == 2
+
+
+def test_people_geo_upstream_timeout(client, geo_upstream):
+    geo_upstream.respond((200, {"divisions": []}, 0.5))
+    response = client.get("/people.geo?lat=0&lng=0")
+    assert response.status_code == 502
+    assert "Geo endpoint" in response.json()["detail"]
+    assert query_logger.count == 0
+
+
+def test_people_geo_upstream_circuit_open(client, geo_upstream):
+    geo_upstream.respond((500, {}))
+    breaker = people.geo_client.breaker
+    # each request is tried twice
+    for _ in range(2):
+        assert client.get("/people.geo?lat=0&lng=0").status_code == 502
+    assert breaker.state == "open"
+    calls = len(geo_upstream.requests)
+    # fails fast, without calling the upstream
+    response = client.get("/people.geo?lat=0&lng=0")
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == str(breaker.reset_timeout)
+    assert len(geo_upstream.requests) == calls
+
+
+def test_people_geo_upstream_busy(client, geo_upstream, monkeypatch):
+    async def get_json(path, params=None):
+        raise UpstreamBusy("no upstream connection available in time")
+
+    monkeypatch.setattr(people.geo_client, "get_json", get_json)
+    response = client.get("/people.geo?lat=0&lng=0")
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+    assert people.geo_client.breaker.state == "closed"
+
+
+def test_people_geo_admitted_after_upstream(client, geo_upstream, monkeypatch):
+    active = []
+
+    async def get_json(path, params=None):
+        active.append(admission.controller.active)
+        return {"divisions": []}
+
+    monkeypatch.setattr(people.geo_client, "get_json", get_json)
+    assert client.get("/people.geo?lat=0&lng=0").status_code == 200
+    # no slot is held while waiting on the upstream
+    assert active == [0]
+
+    found = {
+        "divisions": [{"id": "ocd-division/country:us/state:ne/sldu:1", "state": "ne"}]
+    }
+
+    async def get_json(path, params=None):
+        return found
+
+    monkeypatch.setattr(people.geo_client, "get_json", get_json)
+    monkeypatch.setattr(admission.controller, "limit", 0)
+    monkeypatch.setattr(admission.controller, "max_queue", 0)
+    # but the database step is admitted like any other route
+    assert client.get("/people.geo?lat=41.5&lng=-100").status_code == 503
+
+
+def test_people_geo_batch_admitted_after_upstream(client, geo_upstream, monkeypatch):
+    active = []
+
+    async def get_json(path, params=None):
+        active.append(admission.controller.active)
+        return {"divisions": []}
+
+    monkeypatch.setattr(people.geo_client, "get_json", get_json)
+    points = [{"lat": 0, "lng": n} for n in range(3)]
+    response = client.post("/people.geo/batch", json={"points": points})
+    assert response.status_code == 200
+    assert active == [0, 0, 0]
+
+    monkeypatch.setattr(admission.controller, "limit", 0)
+    monkeypatch.setattr(admission.controller, "max_queue", 0)
+    response = client.post("/people.geo/batch", json={"points": points})
+    assert response.status_code == 503
+
+
+def test_people_geo_upstream_cached(client, geo_upstream):
+    geo_upstream.respond((200, {"divisions": []}))
+    client.get("/people.geo?lat=41.5&lng=-100")
+    client.get("/people.geo?lat=41.5&lng=-100")
+    assert len(geo_upstream.requests) == 1
+    # upstream results aren't known to hold for a whole cell
+    client.get("/people.geo?lat=41.5001&lng=-100")
+    assert len(geo_upstream.requests) == 2
+
+
+def test_people_geo_bad_upstream_not_cached(client, geo_upstream):
+    geo_upstream.respond((200, {"divisions": [{"id": "no state"}]}))
+    assert client.get("/people.geo?lat=41.5&lng=-100").status_code == 500
+    assert client.get("/people.geo?lat=41.5&lng=-100").status_code == 500
+    assert len(geo_upstream.requests) == 2
+
+
+def test_people_geo_batch_upstream(client, geo_upstream):
+    geo_upstream.respond(
+        (
+            200,
+            {
+                "divisions": [
+                    {"id": "ocd-division/country:us/state:ne/sldu:1", "state": "ne"}
+                ]
+            },
+        )
+    )
+    points = [{"lat": 41.5, "lng": -100}, {"lat": 41.6, "lng": -100}] * 3
+    response = client.post("/people.geo/batch", json={"points": points}).json()
+    # once per distinct point
+    assert len(geo_upstream.requests) == 2
+    assert query_logger.count == 1
+    assert [
+        [person["name"] for person in result["results"]]
+        for result in response["results"]
+    ] == [["Amy Adams"]] * 6
+
+
+def test_people_geo_batch_upstream_error(client, geo_upstream):
+    geo_upstream.respond((500, {}))
+    points = [{"lat": 41.5, "lng": -100}]
+    response = client.post("/people.geo/batch", json={"points": points})
+    assert response.status_code == 502
+
+
+def test_people_geo_empty(client, geo_upstream):
+    geo_upstream.respond((200, {"divisions": []}))
+    response = client.get("/people.geo?lat=0&lng=0")
+    assert response.json() == {
+        "results": [],
+        "pagination": {"max_page": 1, "per_page": 100, "page": 1, "total_items": 0},
+    }
+    assert query_logger.count == 0
+    assert len(geo_upstream.requests) == 1
+
+
+def test_people_fields(client):
+    response = client.get(
+        "/people?id=ocd-person/11111111-1111-1111-1111-111111111111"
+        "&fields=name,openstates_url"
+    ).json()
+    assert query_logger.count == 2
+    assert response["results"] == [
+        {
+            "name": "Amy Adams",
+            "openstates_url": "https://openstates.org/person/amy-adams-WCfTognxqNqfz8qrH12uH/",
         }
-        assert query_logger.count == 0
-        assert mock_get.called is True
+    ]
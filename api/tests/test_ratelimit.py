@@ -0,0 +1,128 @@
+import datetime
+import pytest
+from rrl import RateLimiter, RateLimitExceeded, Tier
+from api.ratelimit import HybridRateLimiter
+from .fake_redis import FakeRedis
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = datetime.datetime(2021, 8, 1, 12, 30, 15)
+
+    def __call__(self):
+        return self.now
+
+
+def make_limiter(**kwargs):
+    rrl_limiter = RateLimiter(
+        prefix="v3",
+        tiers=[Tier("test", 10, 0, 100)],
+        use_redis_time=False,
+        track_daily_usage=True,
+    )
+    rrl_limiter.redis = FakeRedis()
+    clock = FakeClock()
+    kwargs.setdefault("sync_interval", None)
+    return HybridRateLimiter(rrl_limiter, clock=clock, **kwargs), clock
+
+
+def test_hybrid_limiter_local_until_sync():
+    limiter, clock = make_limiter()
+    for _ in range(5):
+        assert limiter.check_limit("key", "test")
+    assert limiter.redis.calls == 0
+
+    limiter.flush()
+    assert limiter.redis.calls == 1
+    # same keys as rrl, only the daily count is kept for usage tracking
+    assert limiter.redis.data == {"v3:key:m30": 5, "v3:key:d20210801": 5}
+    assert limiter.redis.expires == {"v3:key:m30": 60}
+    day = datetime.date(2021, 8, 1)
+    assert limiter.limiter.get_usage_since("key", day, day)[0].calls == 5
+
+    # nothing pending, nothing sent
+    limiter.flush()
+    assert limiter.redis.calls == 1
+
+
+def test_hybrid_limiter_exact_near_limit():
+    limiter, clock = make_limiter()
+    for _ in range(9):
+        limiter.check_limit("key", "test")
+    assert limiter.redis.calls == 0
+
+    # past 90% of the limit requests go to Redis, with what's pending
+    limiter.check_limit("key", "test")
+    assert limiter.redis.calls == 1
+    assert limiter.redis.data["v3:key:m30"] == 10
+
+    # Redis said the limit was reached, no need to ask again this minute
+    with pytest.raises(RateLimitExceeded) as e:
+        limiter.check_limit("key", "test")
+    assert str(e.value) == "exceeded limit of 10/min: 11"
+    assert limiter.redis.calls == 1
+
+    # still counted, like rrl does
+    limiter.flush()
+    assert limiter.redis.data["v3:key:m30"] == 11
+
+
+def test_hybrid_limiter_fleet_counts():
+    limiter, clock = make_limiter()
+    # other workers have used up the key's limit
+    limiter.redis.data["v3:key:m30"] = 20
+    limiter.check_limit("key", "test")
+    limiter.flush()
+    with pytest.raises(RateLimitExceeded):
+        limiter.check_limit("key", "test")
+
+    # until the next minute
+    clock.now += datetime.timedelta(minutes=1)
+    assert limiter.check_limit("key", "test")
+    limiter.flush()
+    assert limiter.redis.data["v3:key:m31"] == 1
+
+
+def test_hybrid_limiter_cost():
+    limiter, clock = make_limiter()
+    limiter.check_limit("key", "test", cost=4)
+    with pytest.raises(RateLimitExceeded):
+        limiter.check_limit("key", "test", cost=7)
+
+
+def test_hybrid_limiter_unknown_tier():
+    limiter, clock = make_limiter()
+    with pytest.raises(ValueError):
+        limiter.check_limit("key", "gold")
+
+
+def test_hybrid_limiter_sync_failure_keeps_counts():
+    limiter, clock = make_limiter()
+    limiter.check_limit("key", "test")
+    pipeline = limiter.redis.pipeline
+
+    def broken():
+        raise ConnectionError()
+
+    limiter.redis.pipeline = broken
+    with pytest.raises(ConnectionError):
+        limiter.flush()
+    limiter.redis.pipeline = pipeline
+    limiter.flush()
+    assert limiter.redis.data["v3:key:m30"] == 1
+
+
+def test_hybrid_limiter_drops_old_windows():
+    limiter, clock = make_limiter()
+    limiter.check_limit("key", "test")
+    limiter.flush()
+    clock.now += datetime.timedelta(days=1)
+    limiter.flush()
+    assert limiter._counters == {}
+
+
+def test_hybrid_limiter_background_sync():
+    limiter, clock = make_limiter(sync_interval=0.01)
+    limiter.check_limit("key", "test")
+    limiter.close()
+    assert limiter.redis.data["v3:key:m30"] == 1
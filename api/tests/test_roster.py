@@ -0,0 +1,131 @@
+import datetime
+from api import people
+from api.db import models
+from api.people import roster_people
+from api.roster import RosterSnapshot
+from .conftest import TestingSessionLocal, query_logger
+
+
+NE = "ocd-jurisdiction/country:us/state:ne/government"
+
+
+def test_roster_matches_database(client):
+    url = (
+        "/people?jurisdiction=ne&include=offices&include=links&include=other_names"
+        "&include=other_identifiers&include=sources"
+    )
+    snapshot = client.get(url).json()
+    assert query_logger.count == 1
+    # cursor pagination is still served by the database
+    database = client.get(url + "&cursor=").json()
+    assert query_logger.count > 1
+    assert snapshot["results"] == database["results"]
+
+    url = "/people?jurisdiction=ne&fields=name,openstates_url&include=links"
+    assert client.get(url).json()["results"] == (
+        client.get(url + "&cursor=").json()["results"]
+    )
+
+
+def test_roster_pagination(client):
+    response = client.get("/people?jurisdiction=ne&per_page=1&page=2").json()
+    assert [p["name"] for p in response["results"]] == ["Boo Berri"]
+    assert response["pagination"] == {
+        "per_page": 1,
+        "page": 2,
+        "max_page": 2,
+        "total_items": 2,
+    }
+    response = client.get("/people?jurisdiction=ne&per_page=1&count=none").json()
+    assert response["pagination"] == {"per_page": 1, "page": 1, "has_next_page": True}
+    assert client.get("/people?jurisdiction=ne&page=3").status_code == 404
+    assert client.get("/people?jurisdiction=ne&per_page=0").status_code == 400
+    assert client.get("/people?jurisdiction=ne&fields=nope").status_code == 400
+
+
+def test_roster_unknown_jurisdiction(client):
+    response = client.get("/people?jurisdiction=Narnia").json()
+    assert response["results"] == []
+    assert response["pagination"]["total_items"] == 0
+
+
+def test_roster_reloads_updated_jurisdictions():
+    loaded = []
+
+    def load(db, jurisdiction_ids):
+        loaded.append(sorted(jurisdiction_ids))
+        return roster_people(db, jurisdiction_ids)
+
+    snapshot = RosterSnapshot(load)
+    db = TestingSessionLocal()
+    try:
+        snapshot.refresh(db)
+        assert NE in loaded[0]
+        assert [p["name"] for p in snapshot.people([NE])] == ["Amy Adams", "Boo Berri"]
+
+        # nothing changed
+        snapshot.refresh(db)
+        assert len(loaded) == 1
+
+        ne = db.query(models.Jurisdiction).get(NE)
+        previous = ne.latest_people_update
+        ne.latest_people_update = datetime.datetime(2021, 9, 1)
+        db.commit()
+        try:
+            snapshot.refresh(db)
+            assert loaded[1] == [NE]
+            assert snapshot.updated([NE]) == datetime.datetime(2021, 9, 1)
+            assert len(snapshot.people([NE])) == 2
+        finally:
+            ne.latest_people_update = previous
+            db.commit()
+    finally:
+        db.close()
+
+
+def test_roster_serves_snapshot_during_reload():
+    loaded = []
+
+    def load(db, jurisdiction_ids):
+        loaded.append(sorted(jurisdiction_ids))
+        return roster_people(db, jurisdiction_ids)
+
+    snapshot = RosterSnapshot(load)
+    db = TestingSessionLocal()
+    ne = db.query(models.Jurisdiction).get(NE)
+    previous = ne.latest_people_update
+    try:
+        snapshot.refresh(db)
+        ne.latest_people_update = datetime.datetime(2021, 9, 1)
+        db.commit()
+
+        # another request is reloading, this one doesn't wait for it
+        with snapshot._lock:
+            snapshot.refresh(db)
+        assert len(loaded) == 1
+        assert snapshot.updated([NE]) == previous
+
+        snapshot.refresh(db)
+        assert loaded[1] == [NE]
+        assert snapshot.updated([NE]) == datetime.datetime(2021, 9, 1)
+    finally:
+        ne.latest_people_update = previous
+        db.commit()
+        db.close()
+
+
+def test_roster_indexes():
+    snapshot = people.roster
+    assert [p["name"] for p in snapshot.people([NE], chamber="executive")] == [
+        "Boo Berri"
+    ]
+    assert [p["name"] for p in snapshot.people([NE], district="1")] == ["Amy Adams"]
+    assert snapshot.people([NE], chamber="lower", district="1") == []
+    assert [
+        p["name"]
+        for p in snapshot.in_divisions(["ocd-division/country:us/state:ne/sldu:1"])
+    ] == ["Amy Adams"]
+    assert snapshot.jurisdiction_ids("ne") == [NE]
+    assert snapshot.jurisdiction_ids("Nebraska") == [NE]
+    assert snapshot.jurisdiction_ids(NE) == [NE]
+    assert snapshot.jurisdiction_ids("ocd-jurisdiction/nowhere") == []
@@ -0,0 +1,70 @@
+import datetime
+from fastapi.encoders import jsonable_encoder
+from pydantic import ValidationError
+from api.db import models
+from api.schemas import Bill, Person, Event, Jurisdiction, DataExport
+from api.serializers import serializer
+from .conftest import TestingSessionLocal
+
+
+def validated(schema, obj):
+    """what FastAPI returns for obj with response_model=schema & exclude_none=True"""
+    data = schema.from_orm(obj).dict(exclude_none=True)
+    return jsonable_encoder(schema.parse_obj(data), exclude_none=True)
+
+
+def test_serializer_matches_response_model():
+    db = TestingSessionLocal()
+    for model, schema in [
+        (models.Bill, Bill),
+        (models.Person, Person),
+        (models.Event, Event),
+        (models.Jurisdiction, Jurisdiction),
+    ]:
+        checked = 0
+        for obj in db.query(model):
+            try:
+                expected = validated(schema, obj)
+            except ValidationError:
+                # some fixtures (e.g. people only referenced by votes) aren't complete
+                continue
+            assert serializer(schema)(obj) == expected
+            checked += 1
+        assert checked
+    db.close()
+
+
+def test_serializer_names():
+    data = {"name": "Amy Adams", "party": "Democratic", "given_name": "Amy"}
+    assert serializer(Person, frozenset(["name", "party"]))(data) == {
+        "name": "Amy Adams",
+        "party": "Democratic",
+    }
+
+
+def test_serializer_from_json():
+    # as returned by a JSON include, with Postgres' datetime format
+    data = {
+        "data_type": "csv",
+        "url": "https://example.com",
+        "created_at": "2021-01-01T00:00:00.5+00:00",
+        "updated_at": None,
+    }
+    assert serializer(DataExport)(data) == {
+        "data_type": "csv",
+        "url": "https://example.com",
+        "created_at": "2021-01-01T00:00:00.500000+00:00",
+    }
+
+
+def test_serializer_overrides_and_defaults():
+    data = {"id": "ocd-bill/1", "created_at": datetime.datetime(2021, 1, 1)}
+    result = serializer(Bill, frozenset(["id", "created_at", "classification"]))(
+        data, {"id": "ocd-bill/2"}
+    )
+    # null classification falls back to the default, like the response_model would
+    assert result == {
+        "id": "ocd-bill/2",
+        "classification": [],
+        "created_at": "2021-01-01T00:00:00",
+    }
@@ -0,0 +1,77 @@
+import orjson
+import pytest
+from api.tokens import InvalidToken, TokenSigner, _b64decode, parse_keys
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_600_000_000
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_roundtrip():
+    signer = TokenSigner({"k1": b"secret"}, ttl=60, clock=Clock())
+    claims = signer.verify(signer.mint("profile-id", "bronze", "api-key"))
+    assert (claims.sub, claims.tier, claims.kid) == ("profile-id", "bronze", "k1")
+    assert claims.exp == 1_600_000_060
+    assert claims.apikey == "api-key"
+
+
+def test_token_apikey_encrypted():
+    signer = TokenSigner({"k1": b"secret"})
+    tokens = [signer.mint("profile-id", "bronze", "api-key") for _ in range(2)]
+    payloads = [orjson.loads(_b64decode(token.split(".")[0])) for token in tokens]
+    # a new nonce for each token
+    assert payloads[0]["ref"] != payloads[1]["ref"]
+    assert all(b"api-key" not in _b64decode(p["ref"]) for p in payloads)
+    # only readable with the signing key
+    other = TokenSigner({"k1": b"other"})
+    assert other._open("k1", _b64decode(payloads[0]["ref"])) != b"api-key"
+
+
+def test_token_expires():
+    clock = Clock()
+    signer = TokenSigner({"k1": b"secret"}, ttl=60, clock=clock)
+    token = signer.mint("profile-id", "bronze", "api-key")
+    clock.now += 60
+    with pytest.raises(InvalidToken):
+        signer.verify(token)
+
+
+@pytest.mark.parametrize(
+    "token", ["", "abc", "a.b.c", "not base64!.abc", "e30.abc", "W10.abc"]
+)
+def test_token_malformed(token):
+    with pytest.raises(InvalidToken):
+        TokenSigner({"k1": b"secret"}).verify(token)
+
+
+def test_token_tampered():
+    signer = TokenSigner({"k1": b"secret"})
+    token = signer.mint("profile-id", "bronze", "api-key")
+    unlimited = TokenSigner({"k1": b"guess"}).mint("profile-id", "unlimited", "api-key")
+    # a payload with another tier, under the original signature
+    forged = unlimited.split(".")[0] + "." + token.split(".")[1]
+    with pytest.raises(InvalidToken):
+        signer.verify(forged)
+
+
+def test_token_key_rotation():
+    old = TokenSigner({"k1": b"old"})
+    token = old.mint("profile-id", "bronze", "api-key")
+    # the new key signs, the old one is still accepted
+    rotated = TokenSigner({"k2": b"new", "k1": b"old"})
+    assert rotated.verify(token).kid == "k1"
+    assert rotated.verify(rotated.mint("profile-id", "bronze", "api-key")).kid == "k2"
+    # until it is dropped
+    with pytest.raises(InvalidToken):
+        TokenSigner({"k2": b"new"}).verify(token)
+
+
+def test_parse_keys():
+    assert parse_keys("") == {}
+    assert parse_keys("k2:new, k1:old") == {"k2": b"new", "k1": b"old"}
+    with pytest.raises(ValueError):
+        parse_keys("no-secret")
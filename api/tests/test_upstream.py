@@ -0,0 +1,201 @@
+import asyncio
+import pytest
+from api.upstream import (
+    CircuitBreaker,
+    CircuitOpen,
+    UpstreamBusy,
+    UpstreamClient,
+    UpstreamError,
+)
+from .stub_server import StubServer
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def stub():
+    stub = StubServer()
+    yield stub
+    stub.close()
+
+
+def get(client, path="/divisions.geo"):
+    return asyncio.run(client.get_json(path))
+
+
+def test_circuit_breaker_opens_after_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10, clock=Clock())
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    breaker.before_call()
+    breaker.record_success()
+    # only consecutive failures count
+    assert breaker.state == "closed"
+    for _ in range(3):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpen) as e:
+        breaker.before_call()
+    assert e.value.retry_after == 10
+
+
+def test_circuit_breaker_half_open():
+    clock = Clock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    clock.now = 10
+    assert breaker.state == "half-open"
+    # a single trial call at a time
+    breaker.before_call()
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+    # which re-opens the circuit if it fails
+    breaker.record_failure()
+    assert breaker.state == "open"
+    clock.now = 20
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.before_call()
+
+
+def test_circuit_breaker_abandoned_trial():
+    clock = Clock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    clock.now = 10
+    breaker.before_call()
+    breaker.abandon()
+    breaker.before_call()
+
+
+def test_upstream_client_get_json(stub):
+    stub.respond((200, {"divisions": []}))
+    client = UpstreamClient(stub.url)
+    assert get(client) == {"divisions": []}
+    assert stub.requests == ["/divisions.geo"]
+
+
+def test_upstream_client_retries(stub):
+    stub.respond((502, {}), (500, {}), (200, {"ok": True}))
+    client = UpstreamClient(stub.url, retries=2, backoff=0.01)
+    assert get(client) == {"ok": True}
+    assert len(stub.requests) == 3
+    assert client.breaker.failures == 0
+
+
+def test_upstream_client_gives_up(stub):
+    stub.respond((500, {}))
+    client = UpstreamClient(stub.url, retries=2, backoff=0)
+    with pytest.raises(UpstreamError):
+        get(client)
+    assert len(stub.requests) == 3
+    assert client.breaker.failures == 3
+
+
+def test_upstream_client_client_errors_not_retried(stub):
+    stub.respond((404, {}))
+    client = UpstreamClient(stub.url, retries=2, backoff=0)
+    with pytest.raises(UpstreamError):
+        get(client)
+    assert len(stub.requests) == 1
+    assert client.breaker.failures == 0
+
+
+def test_upstream_client_invalid_json(stub):
+    stub.respond((200, b"<html>"))
+    with pytest.raises(UpstreamError):
+        get(UpstreamClient(stub.url, retries=0))
+
+
+def test_upstream_client_connection_refused():
+    stub = StubServer()
+    stub.close()
+    client = UpstreamClient(stub.url, retries=1, backoff=0)
+    with pytest.raises(UpstreamError):
+        get(client)
+    assert client.breaker.failures == 2
+
+
+def test_upstream_client_fails_fast_when_open(stub):
+    stub.respond((200, {}, 0.5))
+    client = UpstreamClient(
+        stub.url,
+        read_timeout=0.1,
+        retries=0,
+        breaker=CircuitBreaker(failure_threshold=1),
+    )
+    with pytest.raises(UpstreamError):
+        get(client)
+    with pytest.raises(CircuitOpen):
+        get(client)
+    assert len(stub.requests) == 1
+
+
+def test_upstream_client_bounded_pool(stub):
+    stub.respond((200, {}, 0.2))
+    # the second request waits for the only connection longer than the pool timeout
+    client = UpstreamClient(stub.url, max_connections=1, connect_timeout=0.1, retries=0)
+
+    async def main():
+        return await asyncio.gather(
+            client.get_json("/a"), client.get_json("/b"), return_exceptions=True
+        )
+
+    results = asyncio.run(main())
+    assert results[0] == {}
+    assert isinstance(results[1], UpstreamBusy)
+    assert len(stub.requests) == 1
+
+
+def test_upstream_client_pool_timeouts_keep_circuit_closed(stub):
+    stub.respond((200, {}, 0.2))
+    client = UpstreamClient(
+        stub.url,
+        max_connections=1,
+        connect_timeout=0.05,
+        retries=1,
+        backoff=0,
+        breaker=CircuitBreaker(failure_threshold=2),
+    )
+
+    async def main():
+        return await asyncio.gather(
+            *(client.get_json(f"/{n}") for n in range(4)), return_exceptions=True
+        )
+
+    results = asyncio.run(main())
+    assert results[0] == {}
+    assert all(isinstance(result, UpstreamBusy) for result in results[1:])
+    # not retried, and not the upstream's fault
+    assert len(stub.requests) == 1
+    assert client.breaker.state == "closed"
+    assert client.breaker.failures == 0
+
+
+def test_upstream_client_slots_shared(stub):
+    stub.respond((200, {}, 0.1))
+    client = UpstreamClient(stub.url, max_connections=2, connect_timeout=0.05)
+
+    async def batch():
+        # like two requests' batches, each with its own many lookups
+        async def lookup(n):
+            async with client.slots():
+                return await client.get_json(f"/{n}")
+
+        return await asyncio.gather(*(lookup(n) for n in range(3)))
+
+    async def main():
+        assert client.slots() is client.slots()
+        return await asyncio.gather(batch(), batch())
+
+    # together they never wait on the pool long enough to time out
+    assert asyncio.run(main()) == [[{}] * 3] * 2
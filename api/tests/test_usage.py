@@ -0,0 +1,69 @@
+import datetime
+import pytest
+from api.usage import UsageRecorder
+from .fake_redis import FakeRedis
+
+
+def make_recorder(**kwargs):
+    kwargs.setdefault("flush_interval", None)
+    recorder = UsageRecorder(FakeRedis(), prefix="v3", **kwargs)
+    recorder.clock = lambda: datetime.datetime(2021, 8, 1, 12)
+    return recorder
+
+
+def test_usage_batched():
+    recorder = make_recorder()
+    recorder.record("key", "bills_search")
+    recorder.record("key", "bills_search")
+    recorder.record("key", "people_search")
+    recorder.record("other", "bills_search")
+    assert recorder.redis.calls == 0
+
+    recorder.flush()
+    assert recorder.redis.calls == 1
+    day = datetime.date(2021, 8, 1)
+    assert recorder.get_usage("key", day) == {"bills_search": 2, "people_search": 1}
+    assert recorder.get_usage("other", day) == {"bills_search": 1}
+
+    # adds to what's there
+    recorder.record("key", "bills_search")
+    recorder.flush()
+    recorder.flush()
+    assert recorder.redis.calls == 2
+    assert recorder.get_usage("key", day)["bills_search"] == 3
+
+
+def test_usage_flush_failure_keeps_counts():
+    recorder = make_recorder()
+    recorder.record("key", "bills_search")
+    pipeline = recorder.redis.pipeline
+
+    def broken():
+        raise ConnectionError()
+
+    recorder.redis.pipeline = broken
+    with pytest.raises(ConnectionError):
+        recorder.flush()
+    recorder.redis.pipeline = pipeline
+    recorder.flush()
+    assert recorder.get_usage("key", datetime.date(2021, 8, 1)) == {"bills_search": 1}
+
+
+def test_usage_close_flushes():
+    recorder = make_recorder(flush_interval=60)
+    recorder.record("key", "bills_search")
+    recorder.close()
+    assert recorder.get_usage("key", datetime.date(2021, 8, 1)) == {"bills_search": 1}
+
+
+def test_usage_flushes_early_when_full():
+    recorder = make_recorder(flush_interval=60, max_pending=2)
+    recorder.record("a", "bills_search")
+    recorder.record("b", "bills_search")
+    # woken up well before the interval
+    for _ in range(100):
+        if recorder.redis.calls:
+            break
+        recorder._stop.wait(0.01)
+    assert recorder.redis.calls == 1
+    recorder.close()
@@ -0,0 +1,165 @@
+"""
+Short-lived signed access tokens.
+
+Heavy clients can trade their API key for a token (POST /tokens) and send it as
+Authorization: Bearer <token>.  The token carries everything apikey_auth needs, the
+profile it was issued to (sub), its tier and expiry (exp), and is signed with
+HMAC-SHA256, so checking one is a signature check: no database query, no cache.
+
+Tokens are <payload>.<signature>, both base64url encoded, the payload being JSON.
+The payload names the signing key (kid), so keys can be rotated: the first key in
+ACCESS_TOKEN_KEYS signs new tokens and all of them are accepted, so a new key is
+added first, and an old one is dropped once the tokens it signed have expired.
+
+Requests with a token count against the same rate limits & usage as the API key it
+was issued for.  The key travels in the token (ref) encrypted with a keystream derived
+from the signing key, so the token can be mapped back to the key's counters without
+a query, and without handing the key out to whatever sees the token.
+
+A token can't be revoked before it expires, and a tier change applies to new tokens
+only, which is why they are short-lived.
+"""
+import os
+import hmac
+import struct
+import time
+import base64
+import hashlib
+from typing import Dict, Optional
+import orjson
+
+# random bytes in front of each encrypted ref, so no two use the same keystream
+NONCE_SIZE = 16
+
+
+class InvalidToken(Exception):
+    pass
+
+
+class TokenClaims:
+    __slots__ = ("sub", "tier", "exp", "kid", "apikey")
+
+    def __init__(self, sub: str, tier: str, exp: int, kid: str, apikey: str):
+        self.sub = sub
+        self.tier = tier
+        self.exp = exp
+        self.kid = kid
+        # the API key the token was issued for, decrypted from ref
+        self.apikey = apikey
+
+
+class TokenSigner:
+    """
+    Mints and verifies tokens with keys, a dict of kid -> secret, the first of which
+    signs new tokens.  Without keys, tokens are disabled.
+    """
+
+    def __init__(self, keys: Dict[str, bytes], *, ttl: int = 900, clock=time.time):
+        self.keys = keys
+        self.ttl = ttl
+        self.clock = clock
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.keys)
+
+    def mint(self, sub: str, tier: str, apikey: str, ttl: Optional[int] = None) -> str:
+        kid = next(iter(self.keys))
+        payload = _b64encode(
+            orjson.dumps(
+                {
+                    "sub": sub,
+                    "tier": tier,
+                    "exp": int(self.clock()) + (ttl or self.ttl),
+                    "kid": kid,
+                    "ref": _b64encode(self._seal(kid, apikey.encode())),
+                }
+            )
+        )
+        return f"{payload}.{_b64encode(self._sign(kid, payload))}"
+
+    def verify(self, token: str) -> TokenClaims:
+        """claims of a token, raises InvalidToken if it is malformed, forged or expired"""
+        try:
+            payload, signature = token.split(".")
+            claims = orjson.loads(_b64decode(payload))
+            kid = claims["kid"]
+            key_known = kid in self.keys
+        except (ValueError, TypeError, KeyError):
+            raise InvalidToken("malformed token")
+        if not key_known:
+            raise InvalidToken("unknown signing key")
+        try:
+            signature = _b64decode(signature)
+        except ValueError:
+            raise InvalidToken("malformed token")
+        if not hmac.compare_digest(signature, self._sign(kid, payload)):
+            raise InvalidToken("bad signature")
+        try:
+            claims = TokenClaims(
+                sub=claims["sub"],
+                tier=claims["tier"],
+                exp=claims["exp"],
+                kid=kid,
+                apikey=self._open(kid, _b64decode(claims["ref"])).decode(),
+            )
+        except (KeyError, ValueError, TypeError):
+            raise InvalidToken("malformed token")
+        if claims.exp <= self.clock():
+            raise InvalidToken("token expired")
+        return claims
+
+    def _sign(self, kid: str, payload: str) -> bytes:
+        return hmac.new(self.keys[kid], payload.encode(), hashlib.sha256).digest()
+
+    def _seal(self, kid: str, data: bytes) -> bytes:
+        nonce = os.urandom(NONCE_SIZE)
+        return nonce + _xor(data, self._keystream(kid, nonce, len(data)))
+
+    def _open(self, kid: str, sealed: bytes) -> bytes:
+        nonce, data = sealed[:NONCE_SIZE], sealed[NONCE_SIZE:]
+        if len(nonce) != NONCE_SIZE:
+            raise ValueError("ref too short")
+        return _xor(data, self._keystream(kid, nonce, len(data)))
+
+    def _keystream(self, kid: str, nonce: bytes, length: int) -> bytes:
+        # HMAC-SHA256 in counter mode, with a key derived from the signing key so
+        # the keystream never equals a signature
+        key = hmac.new(self.keys[kid], b"ref", hashlib.sha256).digest()
+        blocks = (length + 31) // 32
+        stream = b"".join(
+            hmac.new(key, nonce + struct.pack(">I", n), hashlib.sha256).digest()
+            for n in range(blocks)
+        )
+        return stream[:length]
+
+
+def _xor(data: bytes, stream: bytes) -> bytes:
+    return bytes(a ^ b for a, b in zip(data, stream))
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    # binascii.Error is a ValueError
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def parse_keys(value: str) -> Dict[str, bytes]:
+    """ACCESS_TOKEN_KEYS format: kid:secret,kid:secret,..."""
+    keys = {}
+    for item in value.split(","):
+        if item.strip():
+            kid, _, secret = item.strip().partition(":")
+            if not kid or not secret:
+                raise ValueError("ACCESS_TOKEN_KEYS entries must be kid:secret")
+            keys[kid] = secret.encode()
+    return keys
+
+
+signer = TokenSigner(
+    parse_keys(os.environ.get("ACCESS_TOKEN_KEYS", "")),
+    ttl=int(os.environ.get("ACCESS_TOKEN_TTL", 900)),
+)
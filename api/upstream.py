@@ -0,0 +1,188 @@
+"""
+Calls to other HTTP services, made without blocking the event loop.
+
+UpstreamClient wraps an httpx.AsyncClient with a bounded connection pool and explicit
+timeouts, retries failed attempts with jittered backoff, and keeps a CircuitBreaker:
+after failure_threshold failures in a row, calls fail immediately with CircuitOpen for
+reset_timeout seconds, then a single trial call decides whether the upstream is back.
+That way an unhealthy upstream costs requests a fast error rather than a timeout each.
+"""
+import time
+import random
+import asyncio
+from typing import Optional
+import httpx
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class UpstreamBusy(UpstreamError):
+    """this worker's connections to the upstream are all in use"""
+
+
+class CircuitOpen(UpstreamError):
+    def __init__(self, retry_after: float):
+        super().__init__("upstream unavailable, circuit open")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Closed until failure_threshold consecutive failures, then open for reset_timeout
+    seconds, then half-open: one call is let through, and its result closes or
+    re-opens the circuit.
+
+    Used from the event loop only, so it needs no locking.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+        clock=time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if self.clock() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half-open"
+
+    @property
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0
+        return max(0, self.opened_at + self.reset_timeout - self.clock())
+
+    def before_call(self):
+        """raises CircuitOpen unless a call may be made now"""
+        state = self.state
+        if state == "open" or (state == "half-open" and self._trial):
+            raise CircuitOpen(self.retry_after or self.reset_timeout)
+        if state == "half-open":
+            self._trial = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    def abandon(self):
+        """the call was given up on (e.g. cancelled) without a result"""
+        self._trial = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial or self.failures >= self.failure_threshold:
+            self.opened_at = self.clock()
+        self._trial = False
+
+
+class UpstreamClient:
+    """
+    GETs JSON from base_url, at most max_connections at once per worker.
+
+    Connection errors, timeouts and 5xx responses are retried up to retries times,
+    waiting a random time up to backoff * 2**attempt seconds in between, and count as
+    failures for the circuit breaker.  Timing out waiting for one of the pool's
+    connections raises UpstreamBusy right away, without counting as a failure.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        *,
+        max_connections: int = 10,
+        connect_timeout: float = 1,
+        read_timeout: float = 3,
+        retries: int = 1,
+        backoff: float = 0.1,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.base_url = base_url
+        self.limits = httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_connections
+        )
+        self.timeout = httpx.Timeout(
+            connect=connect_timeout,
+            read=read_timeout,
+            write=read_timeout,
+            # waiting for one of the pool's connections
+            pool=connect_timeout,
+        )
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self._client = None
+        self._loop = None
+        self._slots = None
+
+    async def get_json(self, path: str, params: Optional[dict] = None):
+        """
+        the decoded JSON response, raises CircuitOpen while the upstream is considered
+        down or UpstreamError once retries are exhausted
+        """
+        client = self._get_client()
+        for attempt in range(self.retries + 1):
+            self.breaker.before_call()
+            try:
+                response = await client.get(path, params=params)
+                if response.status_code >= 500:
+                    raise UpstreamError(f"upstream returned {response.status_code}")
+            except httpx.PoolTimeout:
+                # waiting on our own pool says nothing about the upstream's health
+                self.breaker.abandon()
+                raise UpstreamBusy("no upstream connection available in time")
+            except (httpx.TransportError, UpstreamError) as e:
+                self.breaker.record_failure()
+                error = e
+            except asyncio.CancelledError:
+                self.breaker.abandon()
+                raise
+            else:
+                # a 4xx is the request's problem, the upstream is fine
+                self.breaker.record_success()
+                try:
+                    response.raise_for_status()
+                    return response.json()
+                except (httpx.HTTPStatusError, ValueError) as e:
+                    raise UpstreamError(str(e))
+            if attempt < self.retries:
+                await asyncio.sleep(random.uniform(0, self.backoff * 2**attempt))
+        raise UpstreamError(str(error) or type(error).__name__)
+
+    def slots(self) -> asyncio.Semaphore:
+        """
+        a semaphore sized to the connection pool, shared by every caller on this event
+        loop, to bound many calls made at once (e.g. from several requests) so they
+        don't wait on the pool past its timeout
+        """
+        self._get_client()
+        return self._slots
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # connections belong to the event loop they were made on, a new loop (as in
+        # tests) gets a new pool
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url, limits=self.limits, timeout=self.timeout
+            )
+            self._slots = asyncio.Semaphore(self.limits.max_connections)
+            self._loop = loop
+        return self._client
@@ -0,0 +1,77 @@
+"""
+Per-endpoint daily usage, counted in memory and written to Redis in batches.
+
+Each worker adds up requests per (api_key, day, endpoint) and a background thread
+writes them in one pipeline every flush_interval seconds, or sooner if many keys are
+pending.  Workers flush on shutdown, so a graceful restart loses nothing and a crash
+loses at most one interval's worth of counts.
+
+Counts are kept in a hash per key and day, usage:<day>:<api_key>, with a field per
+endpoint.  (The per-key daily totals rrl keeps are still maintained by the limiter.)
+Requests made with an access token are recorded under the API key it was issued for.
+"""
+import datetime
+import threading
+from collections import defaultdict
+from typing import Dict, Optional
+from .background import BackgroundFlusher
+
+
+class UsageRecorder(BackgroundFlusher):
+    thread_name = "usage-flush"
+
+    def __init__(
+        self,
+        redis,
+        *,
+        prefix: str,
+        flush_interval: Optional[float] = 10,
+        max_pending: int = 5000,
+        clock=datetime.datetime.utcnow,
+    ):
+        super().__init__(flush_interval)
+        self.redis = redis
+        self.prefix = prefix
+        self.max_pending = max_pending
+        self.clock = clock
+        self._pending = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, api_key: str, endpoint: str, count: int = 1):
+        self._ensure_started()
+        day = self.clock().strftime("%Y%m%d")
+        with self._lock:
+            self._pending[(api_key, day, endpoint)] += count
+            if len(self._pending) >= self.max_pending:
+                self.wake()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(int)
+        if not pending:
+            return
+        try:
+            pipe = self.redis.pipeline()
+            for (api_key, day, endpoint), count in pending.items():
+                pipe.hincrby(self._key(api_key, day), endpoint, count)
+            pipe.execute()
+        except Exception:
+            # keep the counts to write next time
+            with self._lock:
+                for key, count in pending.items():
+                    self._pending[key] += count
+            raise
+
+    def get_usage(self, api_key: str, day: datetime.date) -> Dict[str, int]:
+        """endpoint -> calls for api_key on day, as written so far"""
+        usage = self.redis.hgetall(self._key(api_key, day.strftime("%Y%m%d")))
+        return {
+            _decode(endpoint): int(_decode(count)) for endpoint, count in usage.items()
+        }
+
+    def _key(self, api_key, day):
+        return f"{self.prefix}:usage:{day}:{api_key}"
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value